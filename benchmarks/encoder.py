@@ -0,0 +1,95 @@
+"""
+Benchmark of the encoding of model dictionaries to JSON.
+
+Compare :func:`despinassy.encoder.dumps` with the standard `json` module
+using a custom `JSONEncoder` on 100k rows shaped like the output of
+:meth:`despinassy.Printer.PrinterTransaction.to_dict` and
+:meth:`despinassy.Printer.Printer.to_dict`.
+
+Run from the repository root with `PYTHONPATH=. python benchmarks/encoder.py`.
+"""
+
+from despinassy import encoder
+from despinassy.ipc import IpcOrigin
+from despinassy.Printer import PrinterDialectEnum, PrinterTypeEnum
+import datetime
+import enum
+import json
+import timeit
+
+ROWS = 100000
+
+
+class CustomEncoder(json.JSONEncoder):
+    """Typical `JSONEncoder` hook of the applications using despinassy"""
+
+    def default(self, o):
+        if isinstance(o, datetime.datetime):
+            return o.isoformat()
+        if isinstance(o, datetime.date):
+            return o.isoformat()
+        if isinstance(o, enum.Enum):
+            return o.value
+        return super().default(o)
+
+
+def make_rows(n):
+    now = datetime.datetime(2026, 10, 18, 12, 0, 0, 1)
+    rows = []
+    for i in range(n):
+        if i % 2:
+            rows.append(
+                {
+                    "id": i,
+                    "barcode": "BARCODE%i" % (i),
+                    "name": "Part %i" % (i),
+                    "number": 1,
+                    "origin": IpcOrigin.HURON,
+                    "device": "huron",
+                    "created_at": now + datetime.timedelta(seconds=i),
+                }
+            )
+        else:
+            rows.append(
+                {
+                    "id": i,
+                    "type": PrinterTypeEnum.STATIC,
+                    "available": True,
+                    "width": 60,
+                    "height": 30,
+                    "dialect": PrinterDialectEnum.ZEBRA_ZPL,
+                    "name": "printer %i" % (i),
+                    "redis": "victoria",
+                    "settings": {"address": "192.168.0.%i" % (i % 256)},
+                    "created_at": now,
+                    "updated_at": now + datetime.timedelta(seconds=i),
+                    "hidden": False,
+                }
+            )
+    return rows
+
+
+def bench(name, func, number=5):
+    best = min(timeit.repeat(func, number=number, repeat=3)) / number
+    print("%-45s %8.1f ms" % (name, best * 1000))
+
+
+if __name__ == "__main__":
+    rows = make_rows(ROWS)
+    assert json.loads(encoder.dumps(rows)) == json.loads(
+        json.dumps(rows, cls=CustomEncoder)
+    )
+
+    bench("json.dumps(cls=CustomEncoder)", lambda: json.dumps(rows, cls=CustomEncoder))
+    bench(
+        "json.dumps(cls=CustomEncoder).encode()",
+        lambda: json.dumps(rows, cls=CustomEncoder).encode("utf-8"),
+    )
+    bench("encoder._dumps_json (stdlib C encoder)", lambda: encoder._dumps_json(rows))
+    if encoder.orjson is not None:
+        bench("encoder.dumps (orjson)", lambda: encoder.dumps(rows))
+    bench(
+        "json.dumps per row",
+        lambda: [json.dumps(r, cls=CustomEncoder) for r in rows],
+    )
+    bench("encoder.dumps per row", lambda: [encoder.dumps(r) for r in rows])
@@ -0,0 +1,97 @@
+"""
+Microbenchmark of the construction and serialization of IPC messages.
+
+Compare the slotted :class:`despinassy.ipc.IpcPrintMessage` with the
+dataclass implementation it replaced.
+
+Run from the repository root with `PYTHONPATH=. python benchmarks/ipc_message.py`.
+"""
+
+from despinassy.ipc import (
+    IpcOrigin,
+    IpcMessageType,
+    IpcPrintMessage,
+    IpcCodec,
+    create_nametuple,
+    ipc_encode,
+)
+from typing import Optional, Union
+import dataclasses
+import timeit
+
+
+@dataclasses.dataclass
+class DataclassMessage:
+    destination: str = ""
+    origin: IpcOrigin = IpcOrigin.UNDEFINED
+    device: Optional[str] = None
+    msg_type: IpcMessageType = IpcMessageType.UNDEFINED
+
+    def __post_init__(self):
+        self.origin = IpcOrigin(self.origin)
+        self.msg_type = IpcMessageType(self.msg_type)
+
+
+@dataclasses.dataclass
+class DataclassPrintMessage(DataclassMessage):
+    barcode: str = ""
+    name: str = ""
+    number: Union[int, float] = 1
+
+    def __post_init__(self):
+        self.msg_type = IpcMessageType.PRINT
+        self.barcode = str(self.barcode)
+        self.origin = IpcOrigin(self.origin)
+        self.name = str(self.name)
+        self.number = int(self.number)
+
+    def _asdict(self):
+        return dataclasses.asdict(self)
+
+
+class PartRow:
+    """Stand-in of a :class:`despinassy.Part` row"""
+
+    def __init__(self, n):
+        self.id = n
+        self.barcode = "BARCODE%i" % (n)
+        self.name = "Part %i" % (n)
+        self.counter = n
+
+
+ROWS = [PartRow(n) for n in range(1000)]
+KWARGS = {"destination": "victoria", "origin": IpcOrigin.HURON, "number": 1}
+
+
+def bench(name, func, number=200):
+    best = min(timeit.repeat(func, number=number, repeat=5))
+    print("%-40s %8.2f us/msg" % (name, best / number / len(ROWS) * 1e6))
+
+
+if __name__ == "__main__":
+    dc = [create_nametuple(DataclassPrintMessage, r, **KWARGS) for r in ROWS]
+    slotted = [IpcPrintMessage.from_model(r, **KWARGS) for r in ROWS]
+
+    bench(
+        "dataclass create_nametuple",
+        lambda: [create_nametuple(DataclassPrintMessage, r, **KWARGS) for r in ROWS],
+    )
+    bench(
+        "slotted from_model",
+        lambda: [IpcPrintMessage.from_model(r, **KWARGS) for r in ROWS],
+    )
+    bench(
+        "dataclass __init__",
+        lambda: [DataclassPrintMessage(barcode=r.barcode, name=r.name) for r in ROWS],
+    )
+    bench(
+        "slotted __init__",
+        lambda: [IpcPrintMessage(barcode=r.barcode, name=r.name) for r in ROWS],
+    )
+    bench("dataclass _asdict", lambda: [m._asdict() for m in dc])
+    bench("slotted _asdict", lambda: [m._asdict() for m in slotted])
+    bench("slotted encode json", lambda: [ipc_encode(m) for m in slotted])
+    bench(
+        "slotted encode binary",
+        lambda: [ipc_encode(m, IpcCodec.BINARY) for m in slotted],
+    )
@@ -1,10 +1,19 @@
 from despinassy.db import db
-from sqlalchemy.orm import relationship
+from despinassy.cache import LRUCache
+from sqlalchemy.orm import relationship, Session
+from sqlalchemy import event
+from sqlalchemy.sql import select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 import datetime
 
+channel_cache = LRUCache(maxsize=1024)
+"""Cache of the id of the channels by name used by :meth:`Channel.get_or_create`"""
+
 
 class Channel(db.Model):
     __tablename__ = "channel"
+    __serialize_fields__ = ("id", "name")
 
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     name = db.Column(db.String(128), unique=True, index=True)
@@ -22,8 +31,113 @@ class Channel(db.Model):
     def __str__(self):
         return self.name
 
+    @staticmethod
+    def get_or_create(name):
+        """Return the channel named `name`, creating it if missing.
+
+        The id of the channel is resolved through the `channel_cache` and the
+        channel itself through the identity map of the session, so resolving
+        an already known channel usually doesn't query the database.
+        A missing channel is created with a single
+        `INSERT ... ON CONFLICT DO NOTHING` when the database support it.
+
+        The channel is created in the current transaction, nothing is
+        committed.
+
+        :param name: Name of the channel.
+        """
+        channel = Channel.query.get(channel_cache.get_or_load(name, Channel._upsert))
+        if channel is None or channel.name != name:
+            # The cached id belong to a deleted channel.
+            channel_cache.invalidate(name)
+            channel = Channel.query.get(
+                channel_cache.get_or_load(name, Channel._upsert)
+            )
+        return channel
+
+    @staticmethod
+    def resolve(value):
+        """Return the channel of a device `redis` field value.
+
+        :param value: A :class:`despinassy.Channel.Channel` or the name of a
+         channel created if missing.
+        """
+        if isinstance(value, str):
+            return Channel.get_or_create(value)
+        elif isinstance(value, Channel):
+            return value
+        else:
+            raise Exception("Not valid redis")
+
+    @staticmethod
+    def _upsert(name):
+        table = Channel.__table__
+        values = {"name": name, "created_at": datetime.datetime.utcnow()}
+        dialect = db.dialect_name()
+        if dialect == "postgresql":
+            channel_id = db.session.execute(
+                pg_insert(table)
+                .values(**values)
+                .on_conflict_do_nothing(index_elements=["name"])
+                .returning(table.c.id)
+            ).scalar()
+            if channel_id is not None:
+                db.session.info.setdefault("channel_created", set()).add(name)
+                return channel_id
+        elif dialect == "sqlite":
+            if db.session.execute(
+                table.insert().prefix_with("OR IGNORE").values(**values)
+            ).rowcount:
+                db.session.info.setdefault("channel_created", set()).add(name)
+        else:
+            channel_id = db.session.execute(
+                select([table.c.id]).where(table.c.name == name)
+            ).scalar()
+            if channel_id is not None:
+                return channel_id
+            try:
+                with db.session.begin_nested():
+                    db.session.execute(table.insert().values(**values))
+                db.session.info.setdefault("channel_created", set()).add(name)
+            except IntegrityError:
+                pass
+        return db.session.execute(
+            select([table.c.id]).where(table.c.name == name)
+        ).scalar()
+
     def to_dict(self):
         return {
             "id": self.id,
             "name": self.name,
         }
+
+
+@event.listens_for(Channel, "after_update")
+@event.listens_for(Channel, "after_delete")
+def _invalidate_channel_cache(mapper, connection, target):
+    channel_cache.clear()
+
+
+@event.listens_for(Session, "after_bulk_update")
+@event.listens_for(Session, "after_bulk_delete")
+def _invalidate_channel_cache_on_bulk(context):
+    if context.mapper.class_ is Channel:
+        channel_cache.clear()
+
+
+@event.listens_for(Session, "after_commit")
+def _forget_created_channels(session):
+    session.info.pop("channel_created", None)
+
+
+@event.listens_for(Session, "after_rollback")
+def _invalidate_created_channels(session):
+    # The channels created in the rolled back transaction don't exist anymore.
+    names = session.info.pop("channel_created", None)
+    if names:
+        channel_cache.invalidate(*names)
+
+
+@event.listens_for(Channel.__table__, "after_drop")
+def _invalidate_channel_cache_on_drop(target, connection, **kw):
+    channel_cache.clear()
@@ -1,10 +1,26 @@
 from despinassy.db import db
-from despinassy.Part import Part
-from sqlalchemy.orm import relationship, validates
+from despinassy.Part import Part, _chunks
+from sqlalchemy.orm import relationship, validates, aliased, contains_eager, Session
+from sqlalchemy import event, literal, bindparam
+from sqlalchemy.sql import exists, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from enum import IntEnum
 import csv
 import io
 import datetime
+import time
+
+EXPORT_CHUNK_SIZE = 1000
+"""Default number of inventory entries per chunk of :meth:`Inventory.iter_csv`"""
+
+IN_CHUNK_SIZE = 500
+"""Maximum number of values in a single SQL `IN` clause"""
+
+UPSERT_CHUNK_SIZE = 1000
+"""
+Maximum number of rows of a single multi-row `INSERT ... ON CONFLICT`,
+keeping the statement under the bind parameters limit of PostgreSQL
+"""
 
 
 class InventoryUnitEnum(IntEnum):
@@ -42,6 +58,11 @@ class InventorySession(db.Model):
     """
 
     __tablename__ = "inventory_session"
+    __serialize_fields__ = ("id", "created_at")
+
+    __table_args__ = (
+        db.Index("ix_inventory_session_created_at_id", "created_at", "id"),
+    )
 
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
 
@@ -50,19 +71,123 @@ class InventorySession(db.Model):
 
     created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
 
+    CACHE_TTL = 60.0
+    """
+    Number of seconds the id of the current session is kept in the process
+    cache of :meth:`InventorySession.current_id`.
+    """
+
+    INVALIDATION_CHANNEL = "despinassy:inventory_session"
+    """
+    Redis channel used to invalidate the cached current session of the other
+    processes. See :meth:`InventorySession.listen_invalidation`.
+    """
+
+    _current = None
+    """Cached `(id, expiration)` of the current session"""
+
+    @staticmethod
+    def _last_query(*entities):
+        return db.session.query(*entities).order_by(
+            InventorySession.created_at.desc(), InventorySession.id.desc()
+        )
+
     @staticmethod
     def last():
         """
         Return the last session added to the database.
         """
-        return InventorySession.query.order_by(
-            InventorySession.created_at.desc()
-        ).first()
+        return InventorySession._last_query(InventorySession).first()
+
+    @staticmethod
+    def current_id():
+        """
+        Return the id of the last session added to the database.
+
+        The id is cached in the process for :attr:`InventorySession.CACHE_TTL`
+        seconds. The cache is invalidated when a session is created or
+        deleted by this process and by the other processes listening for
+        invalidation (see :meth:`InventorySession.listen_invalidation`).
+        """
+        current = InventorySession._current
+        if current is not None and current[1] > time.monotonic():
+            return current[0]
+
+        last = InventorySession._last_query(InventorySession.id).first()
+        if last is None:
+            return None
+        InventorySession._current = (
+            last.id,
+            time.monotonic() + InventorySession.CACHE_TTL,
+        )
+        return last.id
+
+    @staticmethod
+    def invalidate_current():
+        """
+        Invalidate the cached id of the current session of this process.
+        """
+        InventorySession._current = None
+
+    @staticmethod
+    def notify_invalidation(redis):
+        """
+        Ask the other processes to invalidate their cached current session.
+
+        :param redis: Redis client used to publish the invalidation on
+         :attr:`InventorySession.INVALIDATION_CHANNEL`.
+        """
+        return redis.publish(InventorySession.INVALIDATION_CHANNEL, "invalidate")
+
+    @staticmethod
+    def listen_invalidation(redis, sleep_time=0.1):
+        """
+        Invalidate the cached current session of this process each time
+        another process call :meth:`InventorySession.notify_invalidation`.
+
+        :param redis: Redis client used to subscribe to
+         :attr:`InventorySession.INVALIDATION_CHANNEL`.
+
+        :return: The background thread handling the subscription.
+        """
+        pubsub = redis.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(
+            **{
+                InventorySession.INVALIDATION_CHANNEL: lambda msg: (
+                    InventorySession.invalidate_current()
+                )
+            }
+        )
+        return pubsub.run_in_thread(sleep_time=sleep_time, daemon=True)
 
     def to_dict(self):
         return {"id": self.id, "created_at": self.created_at}
 
 
+@event.listens_for(InventorySession, "after_insert")
+@event.listens_for(InventorySession, "after_delete")
+def _invalidate_current_session(mapper, connection, target):
+    InventorySession.invalidate_current()
+
+
+@event.listens_for(InventorySession.__table__, "after_drop")
+def _invalidate_current_session_on_drop(target, connection, **kw):
+    InventorySession.invalidate_current()
+
+
+@event.listens_for(Session, "after_bulk_delete")
+def _invalidate_current_session_on_bulk_delete(delete_context):
+    if delete_context.mapper.class_ is InventorySession:
+        InventorySession.invalidate_current()
+
+
+@event.listens_for(Session, "after_rollback")
+def _invalidate_current_session_on_rollback(session):
+    # The cached session could have been created in the rolled back
+    # transaction.
+    InventorySession.invalidate_current()
+
+
 class Inventory(db.Model):
     """
     The Inventory model code associate a number and a unit to an existing
@@ -73,8 +198,22 @@ class Inventory(db.Model):
     """
 
     __tablename__ = "inventory"
+    __serialize_fields__ = (
+        "id",
+        ("session", "session_id"),
+        "part.id",
+        "part.barcode",
+        "part.name",
+        ("part.counter", "part.print_count"),
+        "quantity",
+        ("unit", "unit", str),
+    )
 
-    __table_args__ = (db.UniqueConstraint("part_id", "session_id"),)
+    __table_args__ = (db.UniqueConstraint("session_id", "part_id"),)
+    """
+    The unique constraint index lead with `session_id` to serve the
+    lookups of entries of a session. `part_id` get its own index.
+    """
 
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
 
@@ -84,7 +223,9 @@ class Inventory(db.Model):
     unit = db.Column(db.Enum(InventoryUnitEnum), default=InventoryUnitEnum.PIECES)
     """The unit of quantity"""
 
-    part_id = db.Column(db.Integer, db.ForeignKey("part.id", ondelete="CASCADE"))
+    part_id = db.Column(
+        db.Integer, db.ForeignKey("part.id", ondelete="CASCADE"), index=True
+    )
     part = relationship("Part")
     """Part associated with this inventory entry"""
 
@@ -100,9 +241,8 @@ class Inventory(db.Model):
     )
 
     def __init__(self, **kwargs):
-        kwargs["session"] = InventorySession.query.order_by(
-            InventorySession.created_at.desc()
-        ).first()
+        if "session" not in kwargs and "session_id" not in kwargs:
+            kwargs["session_id"] = InventorySession.current_id()
         super().__init__(**kwargs)
 
     def __repr__(self):
@@ -115,6 +255,223 @@ class Inventory(db.Model):
     def add(self, number=1):
         self.quantity += int(number)
 
+    @staticmethod
+    def increment(barcode, quantity=1, unit=InventoryUnitEnum.PIECES):
+        """Atomically add a quantity to the inventory entry of a part in the
+        current session.
+
+        Unlike :meth:`Inventory.add` the addition is done by the database
+        without loading the entry first, so concurrent increments of the same
+        part from different processes are never lost. The entry is created
+        if the part has none in the current session yet.
+
+        On PostgreSQL this is a single `INSERT ... ON CONFLICT DO UPDATE`
+        statement. Other databases first try to `UPDATE` the entry and
+        `INSERT` it if missing, relying on the database wide write lock of
+        SQLite to prevent a concurrent insert in between.
+
+        The change is not committed and inventory objects already loaded in
+        the session are not refreshed.
+
+        :param barcode: Barcode of the :class:`despinassy.Part`.
+
+        :param quantity: Quantity to add to the inventory entry.
+
+        :param unit: Unit of a newly created inventory entry.
+
+        :return: The new quantity of the entry or None if no part exist with
+         this barcode.
+
+        :raise ValueError: If there is no inventory session yet, see
+         :meth:`Inventory.archive`.
+        """
+        session_id = Inventory._current_session_id()
+        if db.dialect_name() == "postgresql":
+            return Inventory._increment_postgresql(barcode, quantity, unit, session_id)
+
+        table = Inventory.__table__
+        part_id = select([Part.id]).where(Part.barcode == barcode).as_scalar()
+        entry = (table.c.session_id == session_id) & (table.c.part_id == part_id)
+        updated = db.session.execute(
+            table.update().where(entry).values(quantity=table.c.quantity + quantity)
+        )
+        if updated.rowcount:
+            return db.session.execute(select([table.c.quantity]).where(entry)).scalar()
+
+        inserted = db.session.execute(
+            table.insert().from_select(
+                ["part_id", "session_id", "quantity", "unit"],
+                Inventory._new_entries_select(barcode, quantity, unit, session_id),
+            )
+        )
+        return float(quantity) if inserted.rowcount else None
+
+    @staticmethod
+    def increment_many(scans, unit=InventoryUnitEnum.PIECES):
+        """Add the quantities of a batch of scans to the inventory entries of
+        the current session.
+
+        The quantities of the same barcode are summed before touching the
+        database, the barcodes are resolved to parts with `IN` queries on the
+        barcode index and the entries are updated with a single statement
+        per :data:`UPSERT_CHUNK_SIZE` entries on PostgreSQL (a constant
+        number of statements otherwise) whatever the number of scans.
+        See :meth:`Inventory.increment`.
+
+        The change is not committed and inventory objects already loaded in
+        the session are not refreshed.
+
+        :param scans: Iterable of `(barcode, quantity)` tuples.
+
+        :param unit: Unit of the newly created inventory entries.
+
+        :return: Dictionary of the new quantity of each scanned barcode.
+         Barcodes that don't match any part are left out.
+
+        :raise ValueError: If there is no inventory session yet, see
+         :meth:`Inventory.archive`.
+        """
+        session_id = Inventory._current_session_id()
+        totals = {}
+        for barcode, quantity in scans:
+            totals[barcode] = totals.get(barcode, 0) + quantity
+
+        parts = {}
+        for barcodes in _chunks(list(totals), IN_CHUNK_SIZE):
+            parts.update(
+                db.session.query(Part.id, Part.barcode).filter(
+                    Part.barcode.in_(barcodes)
+                )
+            )
+        if not parts:
+            return {}
+
+        table = Inventory.__table__
+        now = datetime.datetime.utcnow()
+        if db.dialect_name() == "postgresql":
+            result = {}
+            for chunk in _chunks(parts.items(), UPSERT_CHUNK_SIZE):
+                stmt = pg_insert(table).values(
+                    [
+                        {
+                            "part_id": part_id,
+                            "session_id": session_id,
+                            "quantity": totals[barcode],
+                            "unit": unit,
+                            "created_at": now,
+                            "updated_at": now,
+                        }
+                        for (part_id, barcode) in chunk
+                    ]
+                )
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=["part_id", "session_id"],
+                    set_={
+                        "quantity": table.c.quantity + stmt.excluded.quantity,
+                        "updated_at": stmt.excluded.updated_at,
+                    },
+                ).returning(table.c.part_id, table.c.quantity)
+                result.update(
+                    (parts[part_id], q) for (part_id, q) in db.session.execute(stmt)
+                )
+            return result
+
+        # Like in `increment` the entries are updated first so the write lock
+        # of SQLite is held before looking for the missing entries.
+        part_ids = list(parts)
+        in_session = table.c.session_id == session_id
+        rows = [
+            {"b_part_id": part_id, "b_quantity": totals[parts[part_id]]}
+            for part_id in part_ids
+        ]
+        updated = db.session.execute(
+            table.update()
+            .where(in_session & (table.c.part_id == bindparam("b_part_id")))
+            .values(quantity=table.c.quantity + bindparam("b_quantity")),
+            rows,
+        )
+        if updated.rowcount < len(rows):
+            new_entry = select(
+                [
+                    bindparam("b_part_id", type_=table.c.part_id.type),
+                    literal(session_id, type_=table.c.session_id.type),
+                    bindparam("b_quantity", type_=table.c.quantity.type),
+                    literal(unit, type_=table.c.unit.type),
+                    literal(now, type_=table.c.created_at.type),
+                    literal(now, type_=table.c.updated_at.type),
+                ]
+            ).where(
+                ~exists().where(
+                    in_session & (table.c.part_id == bindparam("b_part_id"))
+                )
+            )
+            db.session.execute(
+                table.insert().from_select(
+                    [
+                        "part_id",
+                        "session_id",
+                        "quantity",
+                        "unit",
+                        "created_at",
+                        "updated_at",
+                    ],
+                    new_entry,
+                ),
+                rows,
+            )
+
+        result = {}
+        for ids in _chunks(part_ids, IN_CHUNK_SIZE):
+            result.update(
+                (parts[part_id], q)
+                for (part_id, q) in db.session.execute(
+                    select([table.c.part_id, table.c.quantity]).where(
+                        in_session & table.c.part_id.in_(ids)
+                    )
+                )
+            )
+        return result
+
+    @staticmethod
+    def _current_session_id():
+        # Without a session the entries would be written with a NULL
+        # `session_id`, which the unique constraint doesn't deduplicate.
+        session_id = InventorySession.current_id()
+        if session_id is None:
+            raise ValueError("No inventory session")
+        return session_id
+
+    @staticmethod
+    def _new_entries_select(barcode, quantity, unit, session_id):
+        """Select the columns of a new inventory entry for the part with
+        `barcode`.
+        """
+        table = Inventory.__table__
+        return select(
+            [
+                Part.id,
+                literal(session_id, type_=table.c.session_id.type),
+                literal(quantity, type_=table.c.quantity.type),
+                literal(unit, type_=table.c.unit.type),
+            ]
+        ).where(Part.barcode == barcode)
+
+    @staticmethod
+    def _increment_postgresql(barcode, quantity, unit, session_id):
+        table = Inventory.__table__
+        stmt = pg_insert(table).from_select(
+            ["part_id", "session_id", "quantity", "unit"],
+            Inventory._new_entries_select(barcode, quantity, unit, session_id),
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["part_id", "session_id"],
+            set_={
+                "quantity": table.c.quantity + stmt.excluded.quantity,
+                "updated_at": datetime.datetime.utcnow(),
+            },
+        ).returning(table.c.quantity)
+        return db.session.execute(stmt).scalar()
+
     def to_dict(self):
         return {
             "id": self.id,
@@ -129,29 +486,129 @@ class Inventory(db.Model):
         """
         Return the inventory entries from the last session.
         """
-        last_session = InventorySession.last()
-        return Inventory.query.filter(Inventory.session == last_session)
+        return Inventory.query.filter(
+            Inventory.session_id == InventorySession.current_id()
+        )
+
+    @staticmethod
+    def _with_part_columns(query, columns):
+        """Project an inventory query on the given columns of the inventory
+        entries and of their :class:`despinassy.Part`.
+
+        The columns are selected with a single joined query without
+        creating any ORM object.
+
+        :param columns: Callable receiving the joined part alias and returning
+         the columns to select.
+        """
+        part = aliased(Part)
+        return query.join(part, Inventory.part_id == part.id).with_entities(
+            *columns(part)
+        )
+
+    @staticmethod
+    def bulk_to_dict(query=None):
+        """Serialize many inventory entries like :meth:`Inventory.to_dict`.
+
+        Unlike calling :meth:`Inventory.to_dict` on each entry that trigger
+        a query per entry to load its part, the entries and their part are
+        retrieved in a single query with :meth:`Inventory.serialize_query`.
+
+        :param query: Query of the inventory entries to serialize.
+         The entries of the last session are serialized by default.
+        """
+        if query is None:
+            query = Inventory.last_session_entries()
+        return Inventory.serialize_query(query)
 
     @staticmethod
-    def archive():
+    def archive(redis=None):
         """
         Archive the current inventory by creating a new
         :class:`despinassy.inventory.InventorySession`.
+
+        :param redis: Optional redis client used to notify the other
+         processes that the current session changed.
         """
         db.session.add(InventorySession())
         db.session.commit()
+        InventorySession.invalidate_current()
+        if redis is not None:
+            InventorySession.notify_invalidation(redis)
 
     @staticmethod
-    def retrieve_inventory_from_barcode(barcode):
+    def _session_entries_query(session=None):
+        """Query of the entries of a session joined with their part.
+
+        :param session: The :class:`despinassy.Inventory.InventorySession`
+         of the entries. The current session is used by default.
+        """
+        session_id = InventorySession.current_id() if session is None else session.id
         return (
             db.session.query(Inventory)
-            .join(Part)
+            .join(Inventory.part)
+            .options(contains_eager(Inventory.part))
+            .filter(Inventory.session_id == session_id)
+        )
+
+    @staticmethod
+    def retrieve_inventory_from_barcode(barcode, session=None):
+        """Return the inventory entry of the part with `barcode` in a session.
+
+        The lookup use the part barcode index and the `(session_id, part_id)`
+        unique index.
+
+        :param barcode: Barcode of the :class:`despinassy.Part`.
+
+        :param session: The :class:`despinassy.Inventory.InventorySession`
+         of the entry. The current session is used by default.
+        """
+        return (
+            Inventory._session_entries_query(session)
             .filter(Part.barcode == barcode)
             .first()
         )
 
     @staticmethod
-    def _export_csv(delimiter=","):
+    def retrieve_inventories_from_barcodes(barcodes, session=None):
+        """Bulk version of :meth:`Inventory.retrieve_inventory_from_barcode`.
+
+        :param barcodes: Iterable of barcodes.
+
+        :param session: The :class:`despinassy.Inventory.InventorySession`
+         of the entries. The current session is used by default.
+
+        :return: Dictionary of the inventory entry of each barcode. Barcodes
+         without entry in the session are left out.
+        """
+        result = {}
+        for chunk in _chunks(set(barcodes), IN_CHUNK_SIZE):
+            entries = Inventory._session_entries_query(session).filter(
+                Part.barcode.in_(chunk)
+            )
+            result.update((i.part.barcode, i) for i in entries)
+        return result
+
+    @staticmethod
+    def iter_csv(delimiter=",", chunk_size=EXPORT_CHUNK_SIZE):
+        """Generate the inventory entries of the last session as '.csv'
+        chunks.
+
+        The entries are streamed from the database `chunk_size` at a time
+        and each chunk of '.csv' content is yielded as soon as it is written,
+        so the whole export is never held in memory. The generator can be
+        written to a file or directly returned in a streaming response.
+
+        The database is only queried while the generator is consumed. In a
+        Flask view the application context is already popped at that time,
+        so the generator must be wrapped with :func:`flask.stream_with_context`
+        (e.g. `flask.Response(flask.stream_with_context(Inventory.iter_csv()),
+        mimetype="text/csv")`).
+
+        :param delimiter: The '.csv' column delimiter.
+
+        :param chunk_size: Number of inventory entries per yielded chunk.
+        """
         strio = io.StringIO(newline=None)
         columns = [
             "id",
@@ -162,30 +619,46 @@ class Inventory(db.Model):
             "created_at",
             "updated_at",
         ]
-        writer = csv.DictWriter(
-            strio, fieldnames=columns, delimiter=delimiter, lineterminator="\n"
-        )
-        writer.writeheader()
-
-        for i in Inventory.last_session_entries().all():
-            row = {
-                "id": i.id,
-                "part_name": i.part.name,
-                "part_barcode": i.part.barcode,
-                "quantity": i.quantity,
-                "unit": i.unit,
-                "created_at": str(i.created_at),
-                "updated_at": str(i.updated_at),
-            }
+        writer = csv.writer(strio, delimiter=delimiter, lineterminator="\n")
+        writer.writerow(columns)
+
+        rows = Inventory._with_part_columns(
+            Inventory.last_session_entries(),
+            lambda part: (
+                Inventory.id,
+                part.name,
+                part.barcode,
+                Inventory.quantity,
+                Inventory.unit,
+                Inventory.created_at,
+                Inventory.updated_at,
+            ),
+        ).yield_per(chunk_size)
+        for n, row in enumerate(rows, 1):
             writer.writerow(row)
+            if n % chunk_size == 0:
+                yield strio.getvalue()
+                strio.seek(0)
+                strio.truncate()
+
+        if strio.tell():
+            yield strio.getvalue()
+
+    @staticmethod
+    def _export_csv(delimiter=","):
+        strio = io.StringIO(newline=None)
+        for chunk in Inventory.iter_csv(delimiter=delimiter):
+            strio.write(chunk)
 
         return strio
 
     @staticmethod
-    def export_csv(path):
+    def export_csv(path, delimiter=","):
         """Export the inventory entries to a '.csv' file
 
+        The file is written chunk by chunk with :meth:`Inventory.iter_csv`.
+
         :param path: The location of the '.csv' file to save
         """
         with open(path, "w") as csvfile:
-            csvfile.write(Inventory._export_csv().getvalue())
+            csvfile.writelines(Inventory.iter_csv(delimiter=delimiter))
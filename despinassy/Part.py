@@ -1,15 +1,92 @@
 from despinassy.db import db
-from sqlalchemy.orm import relationship
-from sqlalchemy import inspect
+from despinassy.cache import InvalidationPublisher, LRUCache
+from sqlalchemy.orm import relationship, column_property, Session, object_session
+from sqlalchemy import inspect, event
 from sqlalchemy.orm import validates
 from sqlalchemy.exc import ArgumentError
-from sqlalchemy import tuple_
-from sqlalchemy.sql import and_, or_
+from sqlalchemy import Table, Column, Integer, String, MetaData
+from sqlalchemy.sql import exists, func, select, bindparam
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+import collections
+import dataclasses
 import datetime
+import hashlib
+import json
+import itertools
 import csv
 import io
 import os
 
+IMPORT_CHUNK_SIZE = 5000
+"""Default number of '.csv' rows staged at once by :meth:`Part.import_csv`"""
+
+part_import_staging = Table(
+    "part_import_staging",
+    MetaData(),
+    Column("id", Integer, primary_key=True, autoincrement=True),
+    Column("name", String(256)),
+    Column("barcode", String(128), index=True),
+    Column("fingerprint", String(40)),
+    prefixes=["TEMPORARY"],
+)
+"""
+Temporary table receiving the content of a '.csv' during a part import.
+
+The table is not part of the `db` metadata and only live for the duration of
+the import on the connection doing it.
+"""
+
+
+@dataclasses.dataclass
+class PartImportSummary:
+    """Count of the changes made by a :meth:`Part.import_csv`."""
+
+    skipped: bool = False
+    """The file was identical to the last import and nothing was done"""
+    inserted: int = 0
+    """Number of new parts"""
+    unhidden: int = 0
+    """Number of existing parts present in the '.csv' that got unhidden"""
+    updated: int = 0
+    """Number of existing parts whose content changed in the '.csv'"""
+    hidden: int = 0
+    """Number of existing parts absent from the '.csv' that got hidden"""
+
+
+PartSnapshot = collections.namedtuple(
+    "PartSnapshot", ("id", "name", "barcode", "hidden")
+)
+"""Immutable copy of the main fields of a part returned by :meth:`Part.lookup`"""
+
+part_lookup_cache = LRUCache(maxsize=1024, ttl=300.0, negative_ttl=5.0)
+"""
+Cache of :meth:`Part.lookup` by barcode.
+
+It is invalidated when a part is inserted, updated or deleted and by
+:meth:`Part.import_csv`. The unknown barcodes are only cached for a few
+seconds so a part created by another process is soon found. See
+:meth:`Part.listen_lookup_invalidation` to also invalidate the cache when
+the parts are changed by other processes.
+"""
+
+
+def part_fingerprint(name, barcode):
+    """Return the fingerprint of the imported content of a part.
+
+    The fingerprint allow to detect the parts whose content changed between
+    two imports by comparing a single fixed size value.
+    """
+    return hashlib.sha1(("%s\x1f%s" % (name, barcode)).encode("utf-8")).hexdigest()
+
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
 
 class Part(db.Model):
     """
@@ -19,6 +96,7 @@ class Part(db.Model):
     """
 
     __tablename__ = "part"
+    __serialize_fields__ = ("id", "barcode", "name", ("counter", "print_count"))
 
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
 
@@ -29,7 +107,18 @@ class Part(db.Model):
     """Familiar name of the part"""
 
     counter = db.Column(db.Integer, default=0)
-    """Count of the number of time the `Part` has been printed"""
+    """
+    Count of the number of time the `Part` has been printed up to the last
+    :meth:`despinassy.Part.Part.compact_counters`, the prints counted by
+    :meth:`despinassy.Part.Part.printed` since are not included.
+    See `print_count` for the exact count.
+    """
+
+    fingerprint = db.Column(db.String(40))
+    """
+    Fingerprint of the `name` and `barcode` of the part.
+    See :func:`despinassy.Part.part_fingerprint`.
+    """
 
     inventories = relationship(
         "Inventory",
@@ -77,19 +166,188 @@ class Part(db.Model):
         return "<Part %r:%r>" % (self.name, self.barcode)
 
     def printed(self, number=1):
-        self.counter += number
+        """Count `number` new prints of the part.
+
+        Instead of updating the `counter` of the part, a
+        :class:`despinassy.Part.PartCounterDelta` is appended so concurrent
+        prints of the same part don't contend on its row. The `print_count`
+        of the part includes the new prints once the session is flushed.
+        """
+        db.session.add(PartCounterDelta(part=self, delta=number))
+
+    @staticmethod
+    def lookup(barcode):
+        """Return the part of a barcode through the `part_lookup_cache`.
+
+        :param barcode: Barcode of the part.
+
+        :return: A :class:`despinassy.Part.PartSnapshot` of the part or `None`
+         if no part has this barcode.
+        """
+        return part_lookup_cache.get_or_load(barcode, Part._load_snapshot)
+
+    @staticmethod
+    def _load_snapshot(barcode):
+        row = (
+            db.session.query(Part.id, Part.name, Part.barcode, Part.hidden)
+            .filter(Part.barcode == barcode)
+            .first()
+        )
+        return PartSnapshot(*row) if row is not None else None
+
+    @staticmethod
+    def lookup_stats():
+        """Return the :class:`despinassy.cache.CacheStats` of
+        :meth:`Part.lookup`.
+        """
+        return part_lookup_cache.stats()
+
+    LOOKUP_INVALIDATION_CHANNEL = "despinassy:part_lookup"
+    """
+    Redis channel used to invalidate the `part_lookup_cache` of the other
+    processes. See :meth:`Part.listen_lookup_invalidation`.
+    """
+
+    _lookup_publisher = None
+    """:class:`despinassy.cache.InvalidationPublisher` of this process"""
+
+    @staticmethod
+    def publish_lookup_invalidation(redis):
+        """
+        Publish the invalidations of the `part_lookup_cache` of this process,
+        once the changes of the parts are committed, to the other processes.
+
+        The invalidations are published from a background thread so a commit
+        never waits for redis.
+
+        :param redis: Redis client used to publish on
+         :attr:`Part.LOOKUP_INVALIDATION_CHANNEL`, `None` to stop publishing.
+
+        :return: The :class:`despinassy.cache.InvalidationPublisher` or
+         `None`.
+        """
+        publisher = Part._lookup_publisher
+        Part._lookup_publisher = None
+        if publisher is not None:
+            publisher.close()
+        if redis is not None:
+            Part._lookup_publisher = InvalidationPublisher(redis)
+        return Part._lookup_publisher
+
+    @staticmethod
+    def notify_lookup_invalidation(redis, *barcodes):
+        """
+        Ask the other processes to invalidate their cached lookups of
+        `barcodes`, or every cached lookup if no barcode is given.
+
+        :param redis: Redis client used to publish on
+         :attr:`Part.LOOKUP_INVALIDATION_CHANNEL`.
+        """
+        return redis.publish(Part.LOOKUP_INVALIDATION_CHANNEL, json.dumps(barcodes))
+
+    @staticmethod
+    def listen_lookup_invalidation(redis, sleep_time=0.1):
+        """
+        Invalidate the `part_lookup_cache` of this process each time another
+        process call :meth:`Part.notify_lookup_invalidation`.
+
+        :param redis: Redis client used to subscribe to
+         :attr:`Part.LOOKUP_INVALIDATION_CHANNEL`.
+
+        :return: The background thread handling the subscription.
+        """
+        pubsub = redis.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(**{Part.LOOKUP_INVALIDATION_CHANNEL: _on_lookup_invalidation})
+        return pubsub.run_in_thread(sleep_time=sleep_time, daemon=True)
+
+    @staticmethod
+    def _notify_lookup_invalidation(barcodes):
+        publisher = Part._lookup_publisher
+        if publisher is not None:
+            publisher.publish(Part.LOOKUP_INVALIDATION_CHANNEL, json.dumps(barcodes))
+
+    @staticmethod
+    def print_counts(part_ids=None):
+        """Return the exact print count of parts with a single query.
+
+        :param part_ids: Ids of the parts, all the parts by default.
+
+        :return: A dictionary of the print count by part id.
+        """
+        query = db.session.query(Part.id, Part.print_count)
+        if part_ids is not None:
+            query = query.filter(Part.id.in_(list(part_ids)))
+        return dict(query)
+
+    @staticmethod
+    def compact_counters():
+        """Fold the pending :class:`despinassy.Part.PartCounterDelta` into the
+        `counter` of their part and delete them.
+
+        :return: The number of deltas compacted.
+        """
+        delta = PartCounterDelta.__table__
+        try:
+            if db.dialect_name() == "postgresql":
+                # Only the deleted deltas are added, whatever the deltas
+                # inserted concurrently.
+                rows = db.session.execute(
+                    delta.delete().returning(delta.c.part_id, delta.c.delta)
+                ).fetchall()
+                totals = {}
+                for part_id, number in rows:
+                    totals[part_id] = totals.get(part_id, 0) + number
+                compacted = len(rows)
+            else:
+                max_id = db.session.execute(select([func.max(delta.c.id)])).scalar()
+                if max_id is None:
+                    return 0
+                pending = delta.c.id <= max_id
+                totals = dict(
+                    db.session.execute(
+                        select([delta.c.part_id, func.sum(delta.c.delta)])
+                        .where(pending)
+                        .group_by(delta.c.part_id)
+                    ).fetchall()
+                )
+                compacted = db.session.execute(delta.delete().where(pending)).rowcount
+            if totals:
+                db.session.execute(
+                    Part.__table__.update()
+                    .where(Part.__table__.c.id == bindparam("part_id"))
+                    .values(
+                        counter=func.coalesce(Part.__table__.c.counter, 0)
+                        + bindparam("total")
+                    ),
+                    [{"part_id": k, "total": v} for (k, v) in totals.items()],
+                )
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        return compacted
 
     def to_dict(self):
+        """Serialize the part.
+
+        The `counter` is the exact `print_count` of the part, like in
+        :meth:`Part.serialize_query`. The `print_count` is loaded with the
+        part so serializing the parts of a query doesn't run a query per part.
+        """
         return {
             "id": self.id,
             "barcode": self.barcode,
             "name": self.name,
-            "counter": self.counter,
+            "counter": self.print_count,
         }
 
     @staticmethod
     def _import_csv_content(
-        strio: io.TextIOWrapper, csv_map=None, delimiter=",", **kwargs
+        strio: io.TextIOWrapper,
+        csv_map=None,
+        delimiter=",",
+        chunk_size=IMPORT_CHUNK_SIZE,
+        **kwargs
     ):
         def _get_column_max_len(col):
             # TODO verify column is of string type
@@ -101,54 +359,183 @@ class Part(db.Model):
                 return content[:max_len]
             return content
 
+        summary = PartImportSummary()
         csv_reader = csv.DictReader(strio, delimiter=delimiter, **kwargs)
 
         if csv_map is None:
             # if no csv_map use the column with matching name.
             csv_map = {}
             for column in inspect(Part).columns.keys():
-                if column in csv_reader.fieldnames:
+                if column in (csv_reader.fieldnames or []):
                     csv_map[column] = column
 
         if ("name" not in csv_map) or ("barcode" not in csv_map):
             # TODO Log error
-            return
+            return summary
 
         # TODO For now only importing 'name' and 'barcode' is supported
         _col_name = csv_map["name"]
         _col_barcode = csv_map["barcode"]
-        tuple_parts = {
-            (x[_col_name], x[_col_barcode])
+
+        def _staging_row(x):
+            name = _truncate_column_content("name", x[_col_name])
+            barcode = _truncate_column_content("barcode", x[_col_barcode])
+            return {
+                "name": name,
+                "barcode": barcode,
+                "fingerprint": part_fingerprint(name, barcode),
+            }
+
+        rows = (
+            _staging_row(x)
             for x in csv_reader
             if x.get(_col_name) and x.get(_col_barcode)
-        }
+        )
+
+        # The '.csv' content is streamed chunk by chunk into a temporary
+        # staging table so the memory usage stay bounded whatever the size of
+        # the file. The reconciliation with the 'part' table is then done
+        # with a few set based statements using the 'barcode' index.
+        # On PostgreSQL the chunks are loaded with the native 'COPY' and the
+        # reconciliation use 'UPDATE ... FROM' and 'ON CONFLICT'.
+        postgresql = db.dialect_name() == "postgresql"
+        conn = db.session.connection()
+        part_import_staging.drop(bind=conn, checkfirst=True)
+        part_import_staging.create(bind=conn)
+        try:
+            for chunk in _chunks(rows, chunk_size):
+                if postgresql:
+                    Part._copy_to_import_staging(conn, chunk)
+                else:
+                    db.session.execute(part_import_staging.insert(), chunk)
+
+            if postgresql:
+                Part._reconcile_import_staging_postgresql(summary)
+            else:
+                Part._reconcile_import_staging(summary)
+        finally:
+            part_import_staging.drop(bind=conn, checkfirst=True)
 
-        # retrieve the 'parts' present in the db and in the '.csv'
-        # cond = tuple_(Part.name, Part.barcode).in_(list(tuple_parts)) # TODO if postgres
-        cond = or_(*(and_(Part.name == x, Part.barcode == y) for (x, y) in tuple_parts))
-        in_db = Part.query.filter(cond)
-        in_db.update({"hidden": False})
+        db.session.commit()
+        part_lookup_cache.clear()
+        Part._notify_lookup_invalidation(())
+        return summary
 
-        to_remove = Part.query.filter(~cond)
-        to_remove.update({"hidden": True})
+    @staticmethod
+    def _reconcile_import_staging(summary):
+        """Apply the content of the staging table to the 'part' table.
 
-        if in_db.count() > 0:
-            # TODO add the part
-            tuple_parts = tuple_parts - {(x.name, x.barcode) for x in in_db.all()}
+        Only the rows whose state actually change are written.
+        """
+        staged = part_import_staging.c
+        Part._deduplicate_import_staging()
+
+        def _staged_value(column):
+            return select([column]).where(staged.barcode == Part.barcode).as_scalar()
+
+        in_staging = exists().where(staged.barcode == Part.barcode)
+        staged_fingerprint = _staged_value(staged.fingerprint)
+
+        summary.unhidden = Part.query.filter(
+            Part.hidden.isnot(False), in_staging
+        ).update({"hidden": False}, synchronize_session=False)
+
+        summary.updated = Part.query.filter(
+            in_staging, Part.fingerprint.is_distinct_from(staged_fingerprint)
+        ).update(
+            {"name": _staged_value(staged.name), "fingerprint": staged_fingerprint},
+            synchronize_session=False,
+        )
+
+        summary.hidden = Part.query.filter(Part.hidden.isnot(True), ~in_staging).update(
+            {"hidden": True}, synchronize_session=False
+        )
+
+        new_parts = select([staged.name, staged.barcode, staged.fingerprint]).where(
+            ~exists().where(Part.barcode == staged.barcode)
+        )
+        result = db.session.execute(
+            Part.__table__.insert().from_select(
+                ["name", "barcode", "fingerprint"], new_parts
+            )
+        )
+        summary.inserted = result.rowcount
 
-        parts = [
-            {
-                "name": _truncate_column_content("name", name),
-                "barcode": _truncate_column_content("barcode", barcode),
-            }
-            for (name, barcode) in tuple_parts
-        ]
+    @staticmethod
+    def _deduplicate_import_staging():
+        """Only keep the last occurence of each barcode in the staging table."""
+        staged = part_import_staging.c
+        last_rows = select([func.max(staged.id)]).group_by(staged.barcode)
+        db.session.execute(
+            part_import_staging.delete().where(~staged.id.in_(last_rows))
+        )
 
-        db.session.bulk_insert_mappings(Part, parts)
-        db.session.commit()
+    @staticmethod
+    def _copy_to_import_staging(conn, chunk):
+        """Bulk load a chunk of rows in the staging table with the PostgreSQL
+        'COPY' command of psycopg2.
+        """
+        buf = io.StringIO()
+        csv.writer(buf).writerows(
+            (x["name"], x["barcode"], x["fingerprint"]) for x in chunk
+        )
+        buf.seek(0)
+        cursor = conn.connection.cursor()
+        try:
+            cursor.copy_expert(
+                "COPY %s (name, barcode, fingerprint) FROM STDIN WITH (FORMAT csv)"
+                % (part_import_staging.name),
+                buf,
+            )
+        finally:
+            cursor.close()
 
     @staticmethod
-    def import_csv(filename, csv_map=None, encoding="latin1"):
+    def _reconcile_import_staging_postgresql(summary):
+        """PostgreSQL version of :meth:`Part._reconcile_import_staging`."""
+        part = Part.__table__
+        staged = part_import_staging.c
+        Part._deduplicate_import_staging()
+
+        summary.unhidden = db.session.execute(
+            part.update()
+            .where(part.c.barcode == staged.barcode)
+            .where(part.c.hidden.isnot(False))
+            .values(hidden=False)
+        ).rowcount
+
+        summary.updated = db.session.execute(
+            part.update()
+            .where(part.c.barcode == staged.barcode)
+            .where(part.c.fingerprint.is_distinct_from(staged.fingerprint))
+            .values(name=staged.name, fingerprint=staged.fingerprint)
+        ).rowcount
+
+        summary.hidden = db.session.execute(
+            part.update()
+            .where(part.c.hidden.isnot(True))
+            .where(~exists().where(staged.barcode == part.c.barcode))
+            .values(hidden=True)
+        ).rowcount
+
+        # The 'WHERE' clause avoid the 'ON CONFLICT' to be parsed as a join.
+        new_parts = select([staged.name, staged.barcode, staged.fingerprint]).where(
+            staged.barcode.isnot(None)
+        )
+        summary.inserted = db.session.execute(
+            pg_insert(part)
+            .from_select(["name", "barcode", "fingerprint"], new_parts)
+            .on_conflict_do_nothing(index_elements=["barcode"])
+        ).rowcount
+
+    @staticmethod
+    def import_csv(
+        filename,
+        csv_map=None,
+        encoding="latin1",
+        chunk_size=IMPORT_CHUNK_SIZE,
+        incremental=False,
+    ):
         """Perform a mass import of a '.csv' file containing parts.
 
         :param filename: The location of the '.csv' file that containing the
@@ -165,9 +552,227 @@ class Part(db.Model):
 
         :param encoding: The encoding of the filename that will be read.
          The encoding 'latin1' is used by default.
+
+        :param chunk_size: Number of '.csv' rows read and staged at once.
+
+        :param incremental: Skip the import when the file and its import
+         parameters are identical to the last import logged in
+         :class:`despinassy.Part.PartImport`.
+
+        :return: A :class:`despinassy.Part.PartImportSummary` counting the
+         parts inserted, unhidden, updated and hidden by the import.
         """
         if not os.path.exists(filename):
             raise FileNotFoundError
 
+        digest = PartImport.file_digest(filename, csv_map, encoding)
+        if incremental:
+            last = PartImport.last()
+            if last is not None and last.digest == digest:
+                return PartImportSummary(skipped=True)
+
         with open(filename, mode="r", encoding=encoding, errors="ignore") as csv_file:
-            Part._import_csv_content(csv_file, csv_map)
+            summary = Part._import_csv_content(csv_file, csv_map, chunk_size=chunk_size)
+
+        db.session.add(
+            PartImport(
+                filename=filename,
+                digest=digest,
+                inserted=summary.inserted,
+                unhidden=summary.unhidden,
+                updated=summary.updated,
+                hidden=summary.hidden,
+            )
+        )
+        db.session.commit()
+        return summary
+
+
+class PartCounterDelta(db.Model):
+    """
+    The `PartCounterDelta` model code, an append-only log of the prints of a
+    :class:`despinassy.Part.Part` not yet compacted in its `counter`.
+
+    See :meth:`despinassy.Part.Part.printed` and
+    :meth:`despinassy.Part.Part.compact_counters`.
+    """
+
+    __tablename__ = "part_counter_delta"
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+
+    part_id = db.Column(
+        db.Integer, db.ForeignKey("part.id", ondelete="CASCADE"), index=True
+    )
+    part = relationship("Part")
+
+    delta = db.Column(db.Integer, nullable=False)
+    """Number of prints"""
+
+    created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+
+
+Part.print_count = column_property(
+    func.coalesce(Part.counter, 0)
+    + func.coalesce(
+        select([func.sum(PartCounterDelta.delta)])
+        .where(PartCounterDelta.part_id == Part.id)
+        .as_scalar(),
+        0,
+    )
+)
+"""
+Exact number of time the `Part` has been printed.
+
+It is loaded with the part by the same query and refreshed after a flush
+adding prints of the part.
+"""
+
+
+@event.listens_for(Session, "after_flush")
+def _expire_part_print_count(session, flush_context):
+    for obj in session.new:
+        if isinstance(obj, PartCounterDelta):
+            part = obj.part
+            # A part inserted by the same flush has no loaded count yet.
+            if part is not None and part not in session.new:
+                session.expire(part, ["print_count"])
+
+
+@event.listens_for(Part, "before_insert")
+@event.listens_for(Part, "before_update")
+def _update_part_fingerprint(mapper, connection, target):
+    target.fingerprint = part_fingerprint(target.name, target.barcode)
+
+
+@event.listens_for(Part, "after_insert")
+@event.listens_for(Part, "after_update")
+@event.listens_for(Part, "after_delete")
+def _invalidate_part_lookup(mapper, connection, target):
+    barcodes = {target.barcode}
+    barcodes.update(inspect(target).attrs.barcode.history.deleted)
+    part_lookup_cache.invalidate(*barcodes)
+    # Invalidate again once the transaction end as a lookup can cache the
+    # flushed but not yet committed part in the meantime.
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault("part_lookup_invalidated", set()).update(barcodes)
+
+
+@event.listens_for(Part.barcode, "set", active_history=True)
+def _load_previous_barcode(target, value, oldvalue, initiator):
+    # Registered with 'active_history' to always have the previous barcode in
+    # the attribute history for '_invalidate_part_lookup'.
+    pass
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_part_lookup_on_commit(session):
+    barcodes = session.info.pop("part_lookup_invalidated", None)
+    cleared = session.info.pop("part_lookup_cleared", False)
+    if barcodes:
+        part_lookup_cache.invalidate(*barcodes)
+    if cleared:
+        Part._notify_lookup_invalidation(())
+    elif barcodes:
+        Part._notify_lookup_invalidation(sorted(b for b in barcodes if b is not None))
+
+
+@event.listens_for(Session, "after_rollback")
+def _invalidate_part_lookup_on_rollback(session):
+    session.info.pop("part_lookup_cleared", None)
+    barcodes = session.info.pop("part_lookup_invalidated", None)
+    if barcodes:
+        part_lookup_cache.invalidate(*barcodes)
+
+
+@event.listens_for(Session, "after_bulk_update")
+@event.listens_for(Session, "after_bulk_delete")
+def _invalidate_part_lookup_on_bulk(context):
+    if context.mapper.class_ is Part:
+        part_lookup_cache.clear()
+        context.session.info["part_lookup_cleared"] = True
+
+
+def _on_lookup_invalidation(message):
+    try:
+        barcodes = json.loads(message["data"])
+    except (TypeError, ValueError):
+        barcodes = None
+    if barcodes and isinstance(barcodes, list):
+        part_lookup_cache.invalidate(*barcodes)
+    else:
+        part_lookup_cache.clear()
+
+
+@event.listens_for(Part.__table__, "after_drop")
+def _invalidate_part_lookup_on_drop(target, connection, **kw):
+    part_lookup_cache.clear()
+
+
+class PartImport(db.Model):
+    """
+    The `PartImport` model code logging each '.csv' file imported with
+    :meth:`despinassy.Part.Part.import_csv`.
+
+    The digest of the last import is used by incremental imports to skip a
+    file that didn't change.
+    """
+
+    __tablename__ = "part_import"
+    __serialize_fields__ = (
+        "id",
+        "filename",
+        "inserted",
+        "unhidden",
+        "updated",
+        "hidden",
+        "created_at",
+    )
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+
+    filename = db.Column(db.String(256))
+    """Location of the imported file"""
+
+    digest = db.Column(db.String(64), nullable=False)
+    """Digest of the file content and of the import parameters"""
+
+    inserted = db.Column(db.Integer, default=0)
+    unhidden = db.Column(db.Integer, default=0)
+    updated = db.Column(db.Integer, default=0)
+    hidden = db.Column(db.Integer, default=0)
+
+    created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+
+    @staticmethod
+    def last():
+        """
+        Return the last import added to the database.
+        """
+        return PartImport.query.order_by(
+            PartImport.created_at.desc(), PartImport.id.desc()
+        ).first()
+
+    @staticmethod
+    def file_digest(filename, csv_map=None, encoding="latin1", block_size=1 << 16):
+        """Return the sha256 digest of a file and of the parameters used to
+        import it.
+        """
+        h = hashlib.sha256()
+        h.update(json.dumps([csv_map, encoding], sort_keys=True).encode("utf-8"))
+        with open(filename, mode="rb") as f:
+            for block in iter(lambda: f.read(block_size), b""):
+                h.update(block)
+        return h.hexdigest()
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "filename": self.filename,
+            "inserted": self.inserted,
+            "unhidden": self.unhidden,
+            "updated": self.updated,
+            "hidden": self.hidden,
+            "created_at": self.created_at,
+        }
@@ -1,11 +1,11 @@
-from despinassy.db import db
+from despinassy.db import db, keyset_page
 from despinassy.ipc import IpcOrigin, IpcMessageType
 from despinassy.Channel import Channel
+from despinassy.buffer import WriteBehindBuffer
+from despinassy.settings import DeviceSettings, decode_settings, settings_to_dict
 from sqlalchemy.orm import relationship, validates
-from sqlalchemy.exc import IntegrityError
 from enum import IntEnum
 import datetime
-import json
 
 
 class PrinterDialectEnum(IntEnum):
@@ -49,6 +49,10 @@ class PrinterTypeEnum(IntEnum):
     """Network printer with a static IP address"""
 
 
+TRANSACTIONS_PAGE_SIZE = 50
+"""Default number of transactions in a page of the history of a printer"""
+
+
 class Printer(db.Model):
     """
     The `Printer` model code.
@@ -60,6 +64,20 @@ class Printer(db.Model):
     """
 
     __tablename__ = "printer"
+    __serialize_fields__ = (
+        "id",
+        "type",
+        "available",
+        "width",
+        "height",
+        "dialect",
+        "name",
+        ("redis", "redis.name", str),
+        ("settings", "settings", settings_to_dict),
+        "created_at",
+        "updated_at",
+        "hidden",
+    )
 
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
 
@@ -95,14 +113,24 @@ class Printer(db.Model):
     """Channel the printer listen for incoming message"""
 
     settings = db.Column(db.JSON)
-    """Settings dependant on printer type"""
+    """
+    Settings dependant on printer type.
+    A JSON string assigned to the settings is stored decoded.
+    See `device_settings` for a parsed view of the settings.
+    """
 
     transactions = relationship(
         "PrinterTransaction",
-        order_by="desc(PrinterTransaction.created_at)",
+        order_by="(desc(PrinterTransaction.created_at), desc(PrinterTransaction.id))",
         back_populates="printer",
     )
-    """List of transaction sent to this printer"""
+    """
+    List of transaction sent to this printer.
+    Loading it loads every transaction still in the table (see
+    :mod:`despinassy.retention`), use
+    :meth:`despinassy.Printer.Printer.transactions_page` to go through
+    the whole history.
+    """
 
     hidden = db.Column(db.Boolean, default=False)
     """Is the printer hidden to the user."""
@@ -112,21 +140,20 @@ class Printer(db.Model):
 
     @validates("redis")
     def validate_redis(self, key, value):
-        c = Channel.query.filter(Channel.name == value)
-        if c.count():
-            c = c.first()
-        else:
-            try:
-                c = Channel(name=value)
-                db.session.add(c)
-                db.session.commit()
-            except IntegrityError:
-                db.session.rollback()
-                c = Channel.query.filter(Channel.name == value).first()
-        return c
+        return Channel.resolve(value)
+
+    @validates("settings")
+    def validate_settings(self, key, value):
+        return decode_settings(value)
+
+    @property
+    def device_settings(self):
+        """:class:`despinassy.settings.DeviceSettings` of the printer"""
+        return DeviceSettings.of(self)
 
     def to_dict(self, full=False):
         if full:
+            transactions, transactions_next = self.transactions_page()
             return {
                 "id": self.id,
                 "type": self.type,
@@ -136,8 +163,9 @@ class Printer(db.Model):
                 "dialect": self.dialect,
                 "name": self.name,
                 "redis": str(self.redis),
-                "settings": json.loads(self.settings),
-                "transactions": [t.to_dict() for t in self.transactions],
+                "settings": self.device_settings.to_dict(),
+                "transactions": [t.to_dict() for t in transactions],
+                "transactions_next": transactions_next,
                 "created_at": self.created_at,
                 "updated_at": self.updated_at,
                 "hidden": self.hidden,
@@ -152,12 +180,39 @@ class Printer(db.Model):
                 "dialect": self.dialect,
                 "name": self.name,
                 "redis": str(self.redis),
-                "settings": json.loads(self.settings),
+                "settings": self.device_settings.to_dict(),
                 "created_at": self.created_at,
                 "updated_at": self.updated_at,
                 "hidden": self.hidden,
             }
 
+    def transactions_page(self, after=None, limit=TRANSACTIONS_PAGE_SIZE):
+        """Return a page of the transactions of this printer from the newest to
+        the oldest.
+
+        :param after: Cursor of the page returned with the previous page or
+         `None` for the first page.
+
+        :param limit: Maximum number of transactions in the page.
+
+        The transactions moved to the partitions of the closed months by
+        :func:`despinassy.retention.rotate` are included.
+
+        :return: The transactions and the cursor of the next page (`None` on
+         the last page). See :func:`despinassy.db.keyset_page`.
+        """
+        from despinassy.retention import history_query
+
+        return keyset_page(
+            history_query(PrinterTransaction).filter(
+                PrinterTransaction.printer_id == self.id
+            ),
+            PrinterTransaction.created_at,
+            PrinterTransaction.id,
+            after=after,
+            limit=limit,
+        )
+
     def add_transaction(self, **kwargs):
         """Helper to create a new :class:`despinassy.Printer.PrinterTransaction`
 
@@ -189,6 +244,23 @@ class PrinterTransaction(db.Model):
     """
 
     __tablename__ = "printer_transaction"
+    __table_args__ = (
+        db.Index(
+            "ix_printer_transaction_printer_id_created_at",
+            "printer_id",
+            "created_at",
+            "id",
+        ),
+    )
+    __serialize_fields__ = (
+        "id",
+        "barcode",
+        "name",
+        "number",
+        "origin",
+        "device",
+        "created_at",
+    )
 
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
 
@@ -239,3 +311,98 @@ class PrinterTransaction(db.Model):
             "device": self.device,
             "created_at": self.created_at,
         }
+
+
+class PrinterTransactionDaily(db.Model):
+    """
+    Daily aggregate of the :class:`despinassy.Printer.PrinterTransaction` of
+    a part on a printer.
+
+    The aggregates are computed by :mod:`despinassy.retention` before the old
+    transactions are dropped.
+    """
+
+    __tablename__ = "printer_transaction_daily"
+    __serialize_fields__ = (
+        "day",
+        ("printer", "printer_id"),
+        "barcode",
+        "transactions",
+        "number",
+    )
+    __table_args__ = (db.UniqueConstraint("day", "printer_id", "barcode"),)
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+
+    day = db.Column(db.Date, nullable=False)
+
+    printer_id = db.Column(db.Integer, db.ForeignKey("printer.id"), index=True)
+    printer = relationship("Printer")
+
+    barcode = db.Column(db.String(50), nullable=False)
+    """Barcode of the printed part"""
+
+    transactions = db.Column(db.Integer, default=0, nullable=False)
+    """Number of transactions aggregated"""
+
+    number = db.Column(db.Integer, default=0, nullable=False)
+    """Total number of output printed"""
+
+    def to_dict(self):
+        return {
+            "day": self.day,
+            "printer": self.printer_id,
+            "barcode": self.barcode,
+            "transactions": self.transactions,
+            "number": self.number,
+        }
+
+
+class PrinterTransactionLogger(WriteBehindBuffer):
+    """
+    Write-behind logger of :class:`despinassy.Printer.PrinterTransaction`.
+
+    Instead of inserting a transaction and updating its printer for each
+    print like :meth:`despinassy.Printer.Printer.add_transaction`, the
+    transactions are buffered and inserted by batch. The `updated_at` of
+    each printer is only updated once per batch.
+
+    See :class:`despinassy.buffer.WriteBehindBuffer` for the parameters.
+    """
+
+    _columns = frozenset(
+        c.key
+        for c in PrinterTransaction.__table__.columns
+        if c.key not in ("id", "printer_id", "created_at")
+    )
+
+    def log(self, printer, **kwargs):
+        """Buffer a transaction of a printer.
+
+        :param printer: The :class:`despinassy.Printer.Printer` (already
+         flushed to the database) or its id.
+
+        :param kwargs: Fields of the transaction, typically the fields of an
+         :class:`despinassy.ipc.IpcPrintMessage`.
+
+        :return: Whether the transaction was buffered, see
+         :meth:`despinassy.buffer.WriteBehindBuffer.append`.
+        """
+        printer_id = printer.id if isinstance(printer, Printer) else printer
+        if printer_id is None:
+            raise ValueError("The printer has no id yet")
+        row = {k: v for (k, v) in kwargs.items() if k in self._columns}
+        row["printer_id"] = printer_id
+        row["created_at"] = datetime.datetime.utcnow()
+        return self.append(row)
+
+    def _load_row(self, line):
+        row = super()._load_row(line)
+        row["origin"] = IpcOrigin(row["origin"])
+        return row
+
+    def _write(self, session, rows):
+        session.bulk_insert_mappings(PrinterTransaction, rows)
+        session.query(Printer).filter(
+            Printer.id.in_({r["printer_id"] for r in rows})
+        ).update({"updated_at": rows[-1]["created_at"]}, synchronize_session=False)
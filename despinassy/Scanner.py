@@ -1,11 +1,11 @@
-from despinassy.db import db
+from despinassy.db import db, keyset_page
 from despinassy.Channel import Channel
+from despinassy.buffer import WriteBehindBuffer
+from despinassy.settings import DeviceSettings, decode_settings, settings_to_dict
 from sqlalchemy.orm import relationship, validates
-from sqlalchemy.exc import IntegrityError
 from sqlalchemy import event
 from enum import IntEnum
 import datetime
-import json
 
 
 class ScannerTypeEnum(IntEnum):
@@ -40,6 +40,10 @@ class ScannerModeEnum(IntEnum):
     """Inventory mode, scanning a barcode will add an entry to the inventory"""
 
 
+TRANSACTIONS_PAGE_SIZE = 50
+"""Default number of transactions in a page of the history of a scanner"""
+
+
 class Scanner(db.Model):
     """
     The `Scanner` model code.
@@ -50,6 +54,18 @@ class Scanner(db.Model):
     """
 
     __tablename__ = "scanner"
+    __serialize_fields__ = (
+        "id",
+        "type",
+        "name",
+        ("redis", "redis.name", str),
+        ("settings", "settings", settings_to_dict),
+        "mode",
+        "available",
+        "created_at",
+        "updated_at",
+        "hidden",
+    )
 
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     type = db.Column(db.Enum(ScannerTypeEnum), nullable=False)
@@ -81,14 +97,24 @@ class Scanner(db.Model):
     """Channel the scanner send message to"""
 
     settings = db.Column(db.JSON)
-    """Settings dependant on scanner type"""
+    """
+    Settings dependant on scanner type.
+    A JSON string assigned to the settings is stored decoded.
+    See `device_settings` for a parsed view of the settings.
+    """
 
     transactions = relationship(
         "ScannerTransaction",
-        order_by="desc(ScannerTransaction.created_at)",
+        order_by="(desc(ScannerTransaction.created_at), desc(ScannerTransaction.id))",
         back_populates="scanner",
     )
-    """List of transaction made by this scanner"""
+    """
+    List of transaction made by this scanner.
+    Loading it loads every transaction still in the table (see
+    :mod:`despinassy.retention`), use
+    :meth:`despinassy.Scanner.Scanner.transactions_page` to go through
+    the whole history.
+    """
 
     hidden = db.Column(db.Boolean, default=False)
     """Is the scanner hidden to the user."""
@@ -98,36 +124,32 @@ class Scanner(db.Model):
 
     @validates("redis")
     def validate_redis(self, key, value):
-        if isinstance(value, str):
-            c = Channel.query.filter_by(name=value).first()
-            if c is None:
-                try:
-                    c = Channel(name=value)
-                    db.session.add(c)
-                    db.session.commit()
-                except IntegrityError:
-                    db.session.rollback()
-                    c = Channel.query.filter(Channel.name == value).first()
-        elif isinstance(value, Channel):
-            c = value
-        else:
-            raise Exception("Not valid redis")
+        return Channel.resolve(value)
+
+    @validates("settings")
+    def validate_settings(self, key, value):
+        return decode_settings(value)
 
-        return c
+    @property
+    def device_settings(self):
+        """:class:`despinassy.settings.DeviceSettings` of the scanner"""
+        return DeviceSettings.of(self)
 
     def to_dict(self, full=False):
         if full:
+            transactions, transactions_next = self.transactions_page()
             return {
                 "id": self.id,
                 "type": self.type,
                 "name": self.name,
                 "redis": str(self.redis),
-                "settings": json.loads(self.settings),
+                "settings": self.device_settings.to_dict(),
                 "mode": self.mode,
                 "available": self.available,
                 "created_at": self.created_at,
                 "updated_at": self.updated_at,
-                "transactions": [t.to_dict() for t in self.transactions],
+                "transactions": [t.to_dict() for t in transactions],
+                "transactions_next": transactions_next,
                 "hidden": self.hidden,
             }
         else:
@@ -136,7 +158,7 @@ class Scanner(db.Model):
                 "type": self.type,
                 "name": self.name,
                 "redis": str(self.redis),
-                "settings": json.loads(self.settings),
+                "settings": self.device_settings.to_dict(),
                 "mode": self.mode,
                 "available": self.available,
                 "created_at": self.created_at,
@@ -144,6 +166,33 @@ class Scanner(db.Model):
                 "hidden": self.hidden,
             }
 
+    def transactions_page(self, after=None, limit=TRANSACTIONS_PAGE_SIZE):
+        """Return a page of the transactions of this scanner from the newest to
+        the oldest.
+
+        :param after: Cursor of the page returned with the previous page or
+         `None` for the first page.
+
+        :param limit: Maximum number of transactions in the page.
+
+        The transactions moved to the partitions of the closed months by
+        :func:`despinassy.retention.rotate` are included.
+
+        :return: The transactions and the cursor of the next page (`None` on
+         the last page). See :func:`despinassy.db.keyset_page`.
+        """
+        from despinassy.retention import history_query
+
+        return keyset_page(
+            history_query(ScannerTransaction).filter(
+                ScannerTransaction.scanner_id == self.id
+            ),
+            ScannerTransaction.created_at,
+            ScannerTransaction.id,
+            after=after,
+            limit=limit,
+        )
+
     def add_transaction(self, **kwargs):
         """Helper to create a new :class:`despinassy.Scanner.ScannerTransaction`
 
@@ -173,6 +222,21 @@ class ScannerTransaction(db.Model):
     """
 
     __tablename__ = "scanner_transaction"
+    __table_args__ = (
+        db.Index(
+            "ix_scanner_transaction_scanner_id_created_at",
+            "scanner_id",
+            "created_at",
+            "id",
+        ),
+    )
+    __serialize_fields__ = (
+        "id",
+        ("mode", "mode", int),
+        "quantity",
+        "value",
+        "created_at",
+    )
 
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
 
@@ -212,3 +276,93 @@ class ScannerTransaction(db.Model):
                 "value": self.value,
                 "created_at": self.created_at,
             }
+
+
+class ScannerTransactionDaily(db.Model):
+    """
+    Daily aggregate of the :class:`despinassy.Scanner.ScannerTransaction` of
+    a scanner in a mode.
+
+    The aggregates are computed by :mod:`despinassy.retention` before the old
+    transactions are dropped.
+    """
+
+    __tablename__ = "scanner_transaction_daily"
+    __serialize_fields__ = (
+        "day",
+        ("scanner", "scanner_id"),
+        ("mode", "mode", int),
+        "transactions",
+        "quantity",
+    )
+    __table_args__ = (db.UniqueConstraint("day", "scanner_id", "mode"),)
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+
+    day = db.Column(db.Date, nullable=False)
+
+    scanner_id = db.Column(db.Integer, db.ForeignKey("scanner.id"), index=True)
+    scanner = relationship("Scanner")
+
+    mode = db.Column(db.Enum(ScannerModeEnum), nullable=False)
+
+    transactions = db.Column(db.Integer, default=0, nullable=False)
+    """Number of scans aggregated"""
+
+    quantity = db.Column(db.Float, default=0, nullable=False)
+    """Total quantity scanned"""
+
+    def to_dict(self):
+        return {
+            "day": self.day,
+            "scanner": self.scanner_id,
+            "mode": int(self.mode),
+            "transactions": self.transactions,
+            "quantity": self.quantity,
+        }
+
+
+class ScannerTransactionRecorder(WriteBehindBuffer):
+    """
+    Write-behind recorder of :class:`despinassy.Scanner.ScannerTransaction`.
+
+    The transactions are buffered and inserted by batch, updating the
+    `updated_at` of each scanner once per batch, so recording a scan doesn't
+    wait for a database commit. Give a `spool_path` to keep the buffered
+    transactions across a crash.
+
+    See :class:`despinassy.buffer.WriteBehindBuffer` for the parameters.
+    """
+
+    _columns = frozenset(("mode", "quantity", "value"))
+
+    def record(self, scanner, **kwargs):
+        """Buffer a transaction of a scanner.
+
+        :param scanner: The :class:`despinassy.Scanner.Scanner` (already
+         flushed to the database) or its id.
+
+        :param kwargs: Fields of the transaction (`mode`, `value` and
+         optionally `quantity`).
+
+        :return: Whether the transaction was buffered, see
+         :meth:`despinassy.buffer.WriteBehindBuffer.append`.
+        """
+        scanner_id = scanner.id if isinstance(scanner, Scanner) else scanner
+        if scanner_id is None:
+            raise ValueError("The scanner has no id yet")
+        row = {k: v for (k, v) in kwargs.items() if k in self._columns}
+        row["scanner_id"] = scanner_id
+        row["created_at"] = datetime.datetime.utcnow()
+        return self.append(row)
+
+    def _load_row(self, line):
+        row = super()._load_row(line)
+        row["mode"] = ScannerModeEnum(row["mode"])
+        return row
+
+    def _write(self, session, rows):
+        session.bulk_insert_mappings(ScannerTransaction, rows)
+        session.query(Scanner).filter(
+            Scanner.id.in_({r["scanner_id"] for r in rows})
+        ).update({"updated_at": rows[-1]["created_at"]}, synchronize_session=False)
@@ -0,0 +1,269 @@
+from despinassy.db import db
+from sqlalchemy.orm import Session
+import atexit
+import datetime
+import json
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class WriteBehindBuffer:
+    """
+    Buffer rows in memory and write them to the database by batch.
+
+    The rows are written by :meth:`WriteBehindBuffer._write`, implemented by
+    the subclasses, once `max_size` rows are buffered or when
+    `flush_interval` seconds elapsed since the last write. The buffer is
+    always flushed when the process exit.
+
+    Each batch is written and committed in a session dedicated to the write,
+    so a flush never commits nor rolls back the pending changes of
+    `db.session`.
+
+    Adding a row never write to the database: the rows are written by a
+    background thread, started with the first row, woken up when the buffer
+    is full and flushing the buffer at least every `flush_interval` seconds.
+    The thread adding a row may hold a write lock of the database (an open
+    write transaction of `db.session` on SQLite or a locked row) which would
+    block the write of the batch. The rows can still be added while a batch
+    is written, up to `max_pending` rows: past this limit adding a row waits
+    at most `overflow_timeout` seconds for the batch to be written then drop
+    the row.
+
+    When a `spool_path` is given, each row is also appended to this local
+    file before being buffered and the rows are removed from the file once
+    written. Rows left in the spool by a crashed process are loaded back
+    in the buffer when a new buffer is created with the same spool. A crash
+    between the write and the removal of the rows from the spool can write
+    a row twice.
+
+    :param max_size: Number of buffered rows triggering a write.
+
+    :param max_pending: Maximum number of buffered rows, `None` for ten times
+     `max_size`.
+
+    :param overflow_timeout: Maximum number of seconds adding a row waits for
+     room in a buffer holding `max_pending` rows.
+
+    :param flush_interval: Maximum number of seconds a row stay buffered.
+
+    :param app: Flask application whose context is pushed when the buffer is
+     flushed from the background thread or at exit.
+
+    :param spool_path: Location of the append-only spool file.
+
+    :param spool_fsync: Whether each row appended to the spool is synced to
+     the disk. Without it the spool survive a crash of the process but not
+     of the system.
+    """
+
+    _datetime_fields = ("created_at",)
+    """Fields of the rows holding a `datetime`, restored from the spool"""
+
+    def __init__(
+        self,
+        max_size=500,
+        flush_interval=1.0,
+        app=None,
+        spool_path=None,
+        spool_fsync=False,
+        max_pending=None,
+        overflow_timeout=1.0,
+    ):
+        self.max_size = max_size
+        self.max_pending = max_pending if max_pending is not None else 10 * max_size
+        self.overflow_timeout = overflow_timeout
+        # Number of rows dropped because the buffer was full.
+        self.dropped = 0
+        self.flush_interval = flush_interval
+        self.app = app
+        self.spool_fsync = spool_fsync
+        self._rows = []
+        # `_lock` protect the buffer and the spool and is never held while
+        # writing to the database. `_flush_lock` serialize the writes so the
+        # spool always start with the rows of the batch being written.
+        self._lock = threading.Lock()
+        self._room = threading.Condition(self._lock)
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._thread = None
+        self._spool = None
+        if spool_path is not None:
+            self._rows = self._replay(spool_path)
+            self._spool = open(spool_path, "ab+")
+        atexit.register(self.close)
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _write(self, session, rows):
+        raise NotImplementedError
+
+    def _write_batch(self, rows):
+        session = Session(bind=db.engine)
+        try:
+            self._write(session, rows)
+            session.commit()
+        finally:
+            # Roll back the batch if the write or the commit failed.
+            session.close()
+
+    def _dump_row(self, row):
+        return json.dumps(
+            {
+                k: v.isoformat() if isinstance(v, datetime.datetime) else v
+                for (k, v) in row.items()
+            }
+        )
+
+    def _load_row(self, line):
+        row = json.loads(line)
+        for k in self._datetime_fields:
+            if row.get(k) is not None:
+                row[k] = datetime.datetime.fromisoformat(row[k])
+        return row
+
+    def _replay(self, spool_path):
+        if not os.path.exists(spool_path):
+            return []
+        rows = []
+        with open(spool_path, encoding="utf-8") as spool:
+            for line in spool:
+                try:
+                    rows.append(self._load_row(line))
+                except ValueError:
+                    # Last line partially written during a crash.
+                    logger.warning("Invalid spooled row %r", line)
+        return rows
+
+    def append(self, row):
+        """Buffer a row and wake up the background thread if the buffer is
+        full.
+
+        :return: Whether the row was buffered, `False` if it was dropped.
+        """
+        self.start()
+        with self._lock:
+            if len(self._rows) >= self.max_pending:
+                self._wake.set()
+                self._room.wait_for(
+                    lambda: len(self._rows) < self.max_pending,
+                    self.overflow_timeout,
+                )
+                if len(self._rows) >= self.max_pending:
+                    self.dropped += 1
+                    logger.warning("Write-behind buffer full, row dropped")
+                    return False
+            if self._spool is not None:
+                self._spool.write((self._dump_row(row) + "\n").encode("utf-8"))
+                self._spool.flush()
+                if self.spool_fsync:
+                    os.fsync(self._spool.fileno())
+            self._rows.append(row)
+            full = len(self._rows) >= self.max_size
+        if full:
+            self._wake.set()
+        return True
+
+    def flush(self):
+        """Write all the buffered rows from the calling thread.
+
+        Unlike :meth:`WriteBehindBuffer.append`, the rows are written by the
+        calling thread, so don't call it while holding a write lock of the
+        database. The rows are kept in the buffer if the write fail.
+
+        :return: The number of rows written.
+        """
+        with self._flush_lock:
+            with self._lock:
+                rows, self._rows = self._rows, []
+                self._room.notify_all()
+                if not rows:
+                    return 0
+                if self._spool is not None:
+                    spooled = self._spool.seek(0, os.SEEK_END)
+            try:
+                self._write_batch(rows)
+            except Exception:
+                with self._lock:
+                    self._rows = rows + self._rows
+                raise
+            if self._spool is not None:
+                with self._lock:
+                    self._drop_spooled(spooled)
+        return len(rows)
+
+    def _drop_spooled(self, size):
+        # Remove the first `size` bytes of the spool, holding the rows just
+        # written, and keep the rows added during the write.
+        self._spool.seek(size)
+        rest = self._spool.read()
+        self._spool.truncate(0)
+        self._spool.write(rest)
+        self._spool.flush()
+        if self.spool_fsync:
+            os.fsync(self._spool.fileno())
+
+    def _flush_in_context(self):
+        if self.app is not None:
+            with self.app.app_context():
+                return self.flush()
+        return self.flush()
+
+    def start(self):
+        """Flush the buffer from a background thread every `flush_interval`
+        seconds and each time it is full.
+
+        The thread is started by the first row added.
+        """
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._stop.clear()
+            self._wake.clear()
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            stop = self._stop.is_set()
+            try:
+                self._flush_in_context()
+            except Exception:
+                logger.exception("Write-behind flush failed")
+                if stop:
+                    # The rows are kept in the spool, if any.
+                    return
+                # Don't retry right away when woken up by a full buffer.
+                self._stop.wait(self.flush_interval)
+            if stop:
+                return
+
+    def close(self):
+        """Stop the background thread once it flushed the remaining rows."""
+        atexit.unregister(self.close)
+        try:
+            if self._thread is not None:
+                self._stop.set()
+                self._wake.set()
+                self._thread.join()
+                self._thread = None
+            else:
+                # Only the rows replayed from the spool.
+                self._flush_in_context()
+        finally:
+            if self._spool is not None:
+                self._spool.close()
+                self._spool = None
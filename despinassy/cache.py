@@ -0,0 +1,189 @@
+"""
+In-process caches of database lookups.
+"""
+
+import collections
+import dataclasses
+import logging
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+
+@dataclasses.dataclass(frozen=True)
+class CacheStats:
+    """Statistics of a :class:`despinassy.cache.LRUCache`."""
+
+    hits: int
+    """Number of lookups answered by the cache"""
+    misses: int
+    """Number of lookups that had to load the value"""
+    evictions: int
+    """Number of entries removed because the cache was full"""
+    size: int
+    """Number of entries currently in the cache"""
+
+    @property
+    def hit_ratio(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+class LRUCache:
+    """
+    Thread-safe least recently used cache whose entries expire after `ttl`
+    seconds.
+
+    Values are loaded on a miss by :meth:`LRUCache.get_or_load`. A value
+    loaded while the cache got invalidated is returned but not stored, so an
+    invalidation racing with a load never leaves a stale entry behind.
+
+    :param maxsize: Maximum number of entries.
+
+    :param ttl: Number of seconds an entry stay valid, `None` to never
+     expire.
+
+    :param clock: Function returning the current time in seconds.
+
+    :param negative_ttl: Number of seconds a `None` value stay valid, `0` to
+     never store it. Defaults to `ttl`.
+    """
+
+    def __init__(
+        self, maxsize=1024, ttl=None, clock=time.monotonic, negative_ttl=_MISSING
+    ):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.negative_ttl = ttl if negative_ttl is _MISSING else negative_ttl
+        self._clock = clock
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expire_at = entry
+                if expire_at is None or self._clock() < expire_at:
+                    self._entries.move_to_end(key)
+                    self._hits += 1
+                    return value
+                del self._entries[key]
+            self._misses += 1
+            return _MISSING
+
+    def get_or_load(self, key, loader):
+        """Return the value of `key`, loading it with `loader(key)` on a miss."""
+        value = self._get(key)
+        if value is not _MISSING:
+            return value
+        generation = self._generation
+        value = loader(key)
+        ttl = self.ttl if value is not None else self.negative_ttl
+        if ttl == 0:
+            return value
+        with self._lock:
+            if generation == self._generation:
+                expire_at = None if ttl is None else self._clock() + ttl
+                self._entries[key] = (value, expire_at)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+                    self._evictions += 1
+        return value
+
+    def invalidate(self, *keys):
+        """Remove the entries of `keys`."""
+        with self._lock:
+            self._generation += 1
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def clear(self):
+        """Remove every entry."""
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+    def stats(self):
+        """Return the :class:`despinassy.cache.CacheStats` of the cache."""
+        with self._lock:
+            return CacheStats(
+                hits=self._hits,
+                misses=self._misses,
+                evictions=self._evictions,
+                size=len(self._entries),
+            )
+
+    def reset_stats(self):
+        with self._lock:
+            self._hits = self._misses = self._evictions = 0
+
+
+class InvalidationPublisher:
+    """
+    Publish the invalidations of the caches to the other processes from a
+    background thread.
+
+    :meth:`InvalidationPublisher.publish` only queue the message, so the
+    commits invalidating a cache never wait for redis. A message that can't
+    be published is logged and dropped: the other processes still expire
+    their entries after the TTL of their cache.
+
+    :param redis: Redis client used to publish the messages.
+
+    :param maxsize: Maximum number of queued messages, the messages published
+     while the queue is full are dropped.
+    """
+
+    def __init__(self, redis, maxsize=1024):
+        self.redis = redis
+        self._queue = queue.Queue(maxsize)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def publish(self, channel, data):
+        """Queue `data` to be published on `channel`.
+
+        :return: Whether the message was queued.
+        """
+        try:
+            self._queue.put_nowait((channel, data))
+        except queue.Full:
+            logger.warning("Invalidation on %s dropped, queue full", channel)
+            return False
+        return True
+
+    def join(self):
+        """Wait until every queued message is published or dropped."""
+        self._queue.join()
+
+    def close(self):
+        """Publish the queued messages and stop the background thread."""
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            message = self._queue.get()
+            try:
+                if message is None:
+                    return
+                self.redis.publish(*message)
+            except Exception:
+                logger.warning(
+                    "Invalidation on %s not published", message[0], exc_info=True
+                )
+            finally:
+                self._queue.task_done()
@@ -1,10 +1,13 @@
 from sqlalchemy import orm
+from sqlalchemy.orm import aliased
+from despinassy import encoder
 from flask_sqlalchemy import SQLAlchemy
 from flask_sqlalchemy.model import Model
 from functools import update_wrapper
 
 from sqlalchemy.engine import Engine
-from sqlalchemy import event
+from sqlalchemy import event, tuple_
+import datetime
 import psycopg2
 
 
@@ -23,6 +26,160 @@ def setupmethod(f):
     return update_wrapper(wrapper_func, f)
 
 
+def keyset_page(query, created_at, id, after=None, limit=50):
+    """Return a page of `query` ordered from the newest to the oldest row.
+
+    The rows are paginated on the (`created_at`, `id`) key instead of an
+    `OFFSET` so a page is an index range scan whatever its depth.
+
+    :param query: Query of the rows to paginate.
+
+    :param created_at: Creation date column of the rows.
+
+    :param id: Primary key column of the rows.
+
+    :param after: Cursor returned with the previous page or `None` for the
+     first page. The date of the cursor can be an ISO 8601 string.
+
+    :param limit: Maximum number of rows in the page.
+
+    :return: The rows of the page and the cursor of the next page (`None` on
+     the last page).
+    """
+    if after is not None:
+        after_created_at, after_id = after
+        if isinstance(after_created_at, str):
+            after_created_at = datetime.datetime.fromisoformat(after_created_at)
+        query = query.filter(
+            tuple_(created_at, id) < tuple_(after_created_at, after_id)
+        )
+    rows = query.order_by(created_at.desc(), id.desc()).limit(limit + 1).all()
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    last = rows[-1]
+    return rows, (getattr(last, created_at.key), getattr(last, id.key))
+
+
+class DespinassyModel(Model):
+    """
+    Base class of the despinassy models adding a bulk serialization API.
+    """
+
+    __serialize_fields__ = None
+    """
+    Fields serialized by default by :meth:`DespinassyModel.serialize_query`,
+    all the columns of the model when `None`.
+    """
+
+    @classmethod
+    def _serialize_plan(cls, fields):
+        plans = cls.__dict__.get("_serialize_plans")
+        if plans is None:
+            plans = {}
+            cls._serialize_plans = plans
+        plan = plans.get(fields)
+        if plan is not None:
+            return plan
+
+        joins = {}
+        columns = []
+        keys = []
+        converters = []
+        for field in fields:
+            if not isinstance(field, tuple):
+                field = (field, field)
+            key, path, *converter = field
+            *relationships, attribute = path.split(".")
+            entity = cls
+            prefix = ()
+            for name in relationships:
+                prefix += (name,)
+                if prefix not in joins:
+                    prop = getattr(entity, name)
+                    joins[prefix] = (aliased(prop.property.mapper.class_), prop)
+                entity = joins[prefix][0]
+            columns.append(getattr(entity, attribute))
+            keys.append(tuple(key.split(".")))
+            converters.append(converter[0] if converter else None)
+        if not any(converters):
+            converters = None
+        plan = (tuple(joins.values()), tuple(columns), tuple(keys), converters)
+        plans[fields] = plan
+        return plan
+
+    @classmethod
+    def serialize_query(cls, query=None, fields=None, ndjson=False, chunk_size=1000):
+        """Serialize the rows of a query without creating any ORM object.
+
+        The fields are selected with a single query joining the many-to-one
+        relationships the fields go through. The projection is compiled once
+        per set of fields.
+
+        :param query: Query of the model to serialize, all the rows by default.
+
+        :param fields: Fields to serialize, the `__serialize_fields__` of the
+         model by default. A field is the name of a column of the model or a
+         dotted path going through relationships (e.g. 'redis.name'), whose
+         value is nested in the result (e.g. `{"redis": {"name": ...}}`).
+         A `(key, path)` tuple serialize the `path` under another `key` and a
+         `(key, path, convert)` tuple also pass the value through the
+         `convert` callable (e.g. `str`), to serialize it like the `to_dict`
+         of the model.
+
+        :param ndjson: Return an iterator of newline delimited JSON lines,
+         encoded to bytes by :func:`despinassy.encoder.dumps_ndjson` and
+         fetched by chunks of `chunk_size` rows, instead of a list of
+         dictionaries.
+        """
+        if query is None:
+            query = cls.query
+        if fields is None:
+            fields = cls.__serialize_fields__ or tuple(
+                c.key for c in cls.__mapper__.column_attrs
+            )
+        joins, columns, keys, converters = cls._serialize_plan(tuple(fields))
+        for target, prop in joins:
+            query = query.outerjoin(target, prop)
+        query = query.with_entities(*columns)
+
+        if converters is None:
+
+            def values(row):
+                return row
+
+        else:
+
+            def values(row):
+                return [
+                    value if convert is None else convert(value)
+                    for (convert, value) in zip(converters, row)
+                ]
+
+        if all(len(k) == 1 for k in keys):
+            flat = [k[0] for k in keys]
+
+            def build(row):
+                return dict(zip(flat, values(row)))
+
+        else:
+
+            def build(row):
+                d = {}
+                for key, value in zip(keys, values(row)):
+                    parent = d
+                    for name in key[:-1]:
+                        parent = parent.setdefault(name, {})
+                    parent[key[-1]] = value
+                return d
+
+        if ndjson:
+            return encoder.dumps_ndjson(
+                build(row) for row in query.yield_per(chunk_size)
+            )
+        return [build(row) for row in query]
+
+
 class NO_APP:
     extensions = {
         "sqlalchemy": None,
@@ -51,7 +208,7 @@ class Despinassy(SQLAlchemy):
         self.initialized = False
         super().__init__(
             query_class=orm.Query,
-            model_class=Model,
+            model_class=DespinassyModel,
         )
 
     def init_app(self, app=None, config={}):
@@ -67,6 +224,12 @@ class Despinassy(SQLAlchemy):
 
         return app
 
+    def dialect_name(self):
+        """Return the name of the dialect of the database in use
+        (e.g. 'postgresql', 'sqlite').
+        """
+        return self.session.get_bind().dialect.name
+
     def create_all(self):
         from despinassy.Scanner import Scanner, ScannerTypeEnum
         from despinassy.Inventory import InventorySession
@@ -0,0 +1,97 @@
+"""
+Fast JSON encoding of the dictionaries returned by the models.
+
+The `to_dict` of the models and :meth:`despinassy.db.DespinassyModel.serialize_query`
+return `datetime` objects and enums that the standard `json` module can't
+encode without a `default` hook. :func:`dumps` encodes them directly to
+UTF-8 bytes:
+
+* `datetime`, `date` and `time` objects as ISO 8601 strings.
+* `IntEnum` members (like :class:`despinassy.Printer.PrinterTypeEnum`) as
+  their integer value, other enum members as their value.
+* Any other mapping (like :class:`despinassy.settings.DeviceSettings`) as a
+  JSON object.
+
+`orjson` is used when it is installed, otherwise a compact encoder of the
+standard `json` module with the :func:`default` hook and its type dispatch
+table.
+"""
+
+from collections.abc import Mapping
+import datetime
+import enum
+import json
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+_ENUM_TABLE = {}
+"""Value of the enum members already encoded"""
+
+
+def _encode_enum(obj):
+    try:
+        return _ENUM_TABLE[obj]
+    except KeyError:
+        for member in type(obj):
+            _ENUM_TABLE[member] = member.value
+        return _ENUM_TABLE[obj]
+
+
+_DEFAULTS = {
+    datetime.datetime: datetime.datetime.isoformat,
+    datetime.date: datetime.date.isoformat,
+    datetime.time: datetime.time.isoformat,
+}
+
+
+def default(obj):
+    """Return a value encodable by `json` of an object it doesn't support.
+
+    Can be used as the `default` of :func:`json.dumps`.
+    """
+    encode = _DEFAULTS.get(type(obj))
+    if encode is not None:
+        return encode(obj)
+    if isinstance(obj, enum.Enum):
+        return _encode_enum(obj)
+    if isinstance(obj, (datetime.datetime, datetime.date, datetime.time)):
+        return obj.isoformat()
+    if isinstance(obj, Mapping):
+        return dict(obj)
+    raise TypeError("Object of type %s is not JSON serializable" % (type(obj).__name__))
+
+
+_encoder = json.JSONEncoder(
+    default=default,
+    separators=(",", ":"),
+    check_circular=False,
+    ensure_ascii=False,
+)
+
+
+def _dumps_json(obj):
+    return _encoder.encode(obj).encode("utf-8")
+
+
+if orjson is not None:
+
+    def _dumps_orjson(obj):
+        return orjson.dumps(obj, default=default, option=orjson.OPT_NON_STR_KEYS)
+
+    _dumps = _dumps_orjson
+else:  # pragma: no cover
+    _dumps = _dumps_json
+
+
+def dumps(obj):
+    """Encode `obj` to compact JSON as UTF-8 bytes."""
+    return _dumps(obj)
+
+
+def dumps_ndjson(rows):
+    """Encode an iterable of rows to newline delimited JSON lines."""
+    for row in rows:
+        yield dumps(row) + b"\n"
@@ -1,7 +1,29 @@
+import asyncio
 import dataclasses
+import inspect
+import logging
 from enum import IntEnum
+from operator import attrgetter
 from typing import Optional, Union
 import json
+import struct
+import time
+import uuid
+
+try:
+    from redis.exceptions import ConnectionError as RedisConnectionError
+    from redis.exceptions import TimeoutError as RedisTimeoutError
+
+    _RECONNECT_EXCEPTIONS = (
+        RedisConnectionError,
+        RedisTimeoutError,
+        ConnectionError,
+        OSError,
+    )
+except ImportError:
+    _RECONNECT_EXCEPTIONS = (ConnectionError, OSError)
+
+logger = logging.getLogger(__name__)
 
 
 class IpcOrigin(IntEnum):
@@ -16,36 +38,125 @@ class IpcMessageType(IntEnum):
     PRINT = 1
 
 
-@dataclasses.dataclass
+_ORIGINS = {int(x): x for x in IpcOrigin}
+_MESSAGE_TYPES = {int(x): x for x in IpcMessageType}
+
+
+def _origin(value) -> IpcOrigin:
+    try:
+        return _ORIGINS[value]
+    except (KeyError, TypeError):
+        return IpcOrigin(value)
+
+
+def _message_type(value) -> IpcMessageType:
+    try:
+        return _MESSAGE_TYPES[value]
+    except (KeyError, TypeError):
+        return IpcMessageType(value)
+
+
 class IpcMessage:
-    destination: str = ""
-    origin: IpcOrigin = IpcOrigin.UNDEFINED
-    device: Optional[str] = None
-    msg_type: IpcMessageType = IpcMessageType.UNDEFINED
+    """
+    Base message exchanged between the processes.
 
-    def __post_init__(self):
-        self.origin = IpcOrigin(self.origin)
-        self.msg_type = IpcMessageType(self.msg_type)
+    Messages are slotted classes with a precomputed table of their fields
+    (`_fields`) to keep their construction and serialization cheap. Enum
+    fields are coerced through lookup tables and the other fields are only
+    converted when they don't already have the right type.
+    """
+
+    __slots__ = ("destination", "origin", "device", "msg_type")
+    _fields = __slots__
+
+    def __init__(
+        self,
+        destination: str = "",
+        origin: IpcOrigin = IpcOrigin.UNDEFINED,
+        device: Optional[str] = None,
+        msg_type: IpcMessageType = IpcMessageType.UNDEFINED,
+    ):
+        self.destination = destination
+        self.origin = _origin(origin)
+        self.device = device
+        self.msg_type = _message_type(msg_type)
+
+    @classmethod
+    def from_dict(cls, d: dict):
+        """Create a message from a dictionary ignoring the unknown keys."""
+        return cls(**{f: d[f] for f in cls._fields if f in d})
+
+    @classmethod
+    def from_model(cls, instance, **kwargs):
+        """Create a message from the attributes of an object (or the keys of
+        a dictionary) having the same name as the message fields.
+
+        :param kwargs: Values overriding the ones of `instance` when they are
+         not empty.
+        """
+        if isinstance(instance, dict):
+            values = {f: instance[f] for f in cls._fields if f in instance}
+        else:
+            values = {
+                f: getattr(instance, f) for f in cls._fields if hasattr(instance, f)
+            }
+        for f in cls._fields:
+            if f in kwargs and (kwargs[f] or f not in values):
+                values[f] = kwargs[f]
+        return cls(**values)
+
+    def _astuple(self):
+        return self._getter(self)
 
     def _asdict(self):
-        return dataclasses.asdict(self)
+        return dict(zip(self._fields, self._getter(self)))
+
+    def __eq__(self, other):
+        if other.__class__ is self.__class__:
+            return self._getter(self) == self._getter(other)
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        return "%s(%s)" % (
+            self.__class__.__name__,
+            ", ".join(
+                "%s=%r" % (f, v) for (f, v) in zip(self._fields, self._getter(self))
+            ),
+        )
 
 
-@dataclasses.dataclass
 class IpcPrintMessage(IpcMessage):
-    barcode: str = ""
-    name: str = ""
-    number: Union[int, float] = 1
+    """
+    Message asking a printer listening on `destination` to print `number`
+    times the part `barcode`.
+    """
 
-    def __post_init__(self):
+    __slots__ = ("barcode", "name", "number")
+    _fields = IpcMessage._fields + __slots__
+
+    def __init__(
+        self,
+        destination: str = "",
+        origin: IpcOrigin = IpcOrigin.UNDEFINED,
+        device: Optional[str] = None,
+        msg_type: IpcMessageType = IpcMessageType.PRINT,
+        barcode: str = "",
+        name: str = "",
+        number: Union[int, float] = 1,
+    ):
+        self.destination = destination
+        self.origin = _origin(origin)
+        self.device = device
         self.msg_type = IpcMessageType.PRINT
-        self.barcode = str(self.barcode)
-        self.origin = IpcOrigin(self.origin)
-        self.name = str(self.name)
-        self.number = int(self.number)
+        self.barcode = barcode if type(barcode) is str else str(barcode)
+        self.name = name if type(name) is str else str(name)
+        self.number = number if type(number) is int else int(number)
 
-    def _asdict(self):
-        return dataclasses.asdict(self)
+
+IpcMessage._getter = attrgetter(*IpcMessage._fields)
+IpcPrintMessage._getter = attrgetter(*IpcPrintMessage._fields)
 
 
 def create_nametuple(target, instance, **kwargs):
@@ -73,7 +184,237 @@ def create_nametuple(target, instance, **kwargs):
 
 
 def ipc_create_print_message(instance, **kwargs):
-    return create_nametuple(IpcPrintMessage, instance, **kwargs)
+    return IpcPrintMessage.from_model(instance, **kwargs)
+
+
+class IpcCodec(IntEnum):
+    """
+    List the supported wire formats of the IPC messages.
+
+    Every codec is recognized by :func:`ipc_decode` so consumers don't need to
+    know the codec used by the publisher.
+    """
+
+    JSON = 0
+    """JSON object of the message fields, understood by every consumer"""
+    BINARY = 1
+    """Compact versioned binary layout (see :func:`ipc_encode`)"""
+
+
+IPC_BINARY_MAGIC = 0xD5
+"""First byte of a binary message. A JSON message always start with '{'."""
+
+IPC_BINARY_VERSION = 1
+"""Version of the binary layout"""
+
+_BINARY_HEADER = struct.Struct("!BBBB")
+_BINARY_STR_LEN = struct.Struct("!H")
+_BINARY_NUMBER = struct.Struct("!q")
+_BINARY_NONE = 0xFFFF
+_BINARY_MAGIC_BYTE = bytes((IPC_BINARY_MAGIC,))
+
+_MESSAGE_CLASSES = {
+    IpcMessageType.PRINT: IpcPrintMessage,
+}
+
+
+def _binary_pack_str(out, value):
+    if value is None:
+        out.append(_BINARY_STR_LEN.pack(_BINARY_NONE))
+        return
+    raw = value.encode("utf-8")
+    if len(raw) >= _BINARY_NONE:
+        raise ValueError("String too long for the binary IPC format")
+    out.append(_BINARY_STR_LEN.pack(len(raw)))
+    out.append(raw)
+
+
+def _binary_unpack_str(data, offset):
+    (length,) = _BINARY_STR_LEN.unpack_from(data, offset)
+    offset += _BINARY_STR_LEN.size
+    if length == _BINARY_NONE:
+        return None, offset
+    return str(data[offset : offset + length], "utf-8"), offset + length
+
+
+def _binary_encode(msg):
+    out = [
+        _BINARY_HEADER.pack(
+            IPC_BINARY_MAGIC, IPC_BINARY_VERSION, msg.msg_type, msg.origin
+        )
+    ]
+    _binary_pack_str(out, msg.destination)
+    _binary_pack_str(out, msg.device)
+    if msg.msg_type == IpcMessageType.PRINT:
+        _binary_pack_str(out, msg.barcode)
+        _binary_pack_str(out, msg.name)
+        out.append(_BINARY_NUMBER.pack(msg.number))
+    return b"".join(out)
+
+
+def _binary_decode(data):
+    _, version, msg_type, origin = _BINARY_HEADER.unpack_from(data, 0)
+    if version != IPC_BINARY_VERSION:
+        raise ValueError("Unsupported binary IPC version %i" % (version))
+
+    offset = _BINARY_HEADER.size
+    destination, offset = _binary_unpack_str(data, offset)
+    device, offset = _binary_unpack_str(data, offset)
+    if msg_type == IpcMessageType.PRINT:
+        barcode, offset = _binary_unpack_str(data, offset)
+        name, offset = _binary_unpack_str(data, offset)
+        (number,) = _BINARY_NUMBER.unpack_from(data, offset)
+        return IpcPrintMessage(
+            destination=destination,
+            origin=origin,
+            device=device,
+            barcode=barcode,
+            name=name,
+            number=number,
+        )
+    return IpcMessage(
+        destination=destination, origin=origin, device=device, msg_type=msg_type
+    )
+
+
+def ipc_encode(msg: IpcMessage, codec=IpcCodec.JSON) -> bytes:
+    """Serialize a message for the wire.
+
+    The binary layout (version 1) is, in network byte order: a magic byte, a
+    version byte, the message type and origin bytes, then the `destination`
+    and `device` strings. Print messages follow with the `barcode` and
+    `name` strings and the `number` as a signed 64 bits integer.
+    Strings are prefixed with their UTF-8 length on 2 bytes, `0xFFFF` being
+    used for `None`.
+
+    :param msg: The message to serialize.
+
+    :param codec: The :class:`IpcCodec` of the output.
+    """
+    if codec == IpcCodec.BINARY:
+        return _binary_encode(msg)
+    return json.dumps(msg._asdict()).encode("utf-8")
+
+
+def ipc_decode(data) -> IpcMessage:
+    """Deserialize a message received from the wire whatever its codec.
+
+    :param data: `bytes` or `str` content of the message.
+
+    :raise ValueError: If `data` isn't a valid message.
+    """
+    if isinstance(data, (bytes, bytearray)) and data[:1] == _BINARY_MAGIC_BYTE:
+        return _binary_decode(data)
+
+    msg = json.loads(data)
+    if not isinstance(msg, dict):
+        raise ValueError("The IPC message is not a JSON object")
+    return _MESSAGE_CLASSES.get(msg.get("msg_type"), IpcMessage).from_dict(msg)
+
+
+IPC_CODECS_KEY = "despinassy:ipc:codecs:%s"
+"""
+Redis hash of the codecs accepted by the consumers of a channel, see
+:func:`ipc_advertise_codecs`.
+"""
+
+IPC_CONSUMER_CHANNEL = "despinassy:ipc:consumer:%s"
+"""
+Channel subscribed by a consumer advertising its codecs for as long as it is
+connected, used by the negotiation to only trust the advertisements of live
+consumers. Nothing is published on it.
+"""
+
+IPC_CODEC_PREFERENCE = (IpcCodec.BINARY, IpcCodec.JSON)
+"""Codecs chosen by the negotiation, most preferred first"""
+
+
+def ipc_advertise_codecs(redis, channel, consumer_id, codecs=tuple(IpcCodec), ttl=30.0):
+    """Advertise the codecs accepted by a consumer of a channel.
+
+    The advertisement expire after `ttl` seconds and must be renewed by the
+    consumer while it is subscribed. It is only trusted while the consumer
+    is also subscribed to its :data:`IPC_CONSUMER_CHANNEL`, on the connection
+    consuming the channel. Consumers that never advertise are assumed to only
+    accept JSON.
+
+    :param redis: The redis client used to advertise.
+
+    :param channel: Name of the channel consumed.
+
+    :param consumer_id: Unique identifier of the consumer.
+
+    :param codecs: The :class:`IpcCodec` accepted by the consumer.
+
+    :param ttl: Number of seconds the advertisement stay valid.
+    """
+    key = IPC_CODECS_KEY % (channel)
+    pipe = redis.pipeline(transaction=False)
+    pipe.hset(
+        key,
+        consumer_id,
+        "%.3f:%s" % (time.time() + ttl, ",".join(str(int(c)) for c in codecs)),
+    )
+    pipe.expire(key, int(ttl) + 1)
+    return pipe.execute()
+
+
+def ipc_withdraw_codecs(redis, channel, consumer_id):
+    """Remove the advertisement of a consumer unsubscribing from a channel."""
+    return redis.hdel(IPC_CODECS_KEY % (channel), consumer_id)
+
+
+def ipc_parse_advertisements(advertisements, now=None):
+    """Parse the content of the :data:`IPC_CODECS_KEY` hash of a channel.
+
+    :param advertisements: Content of the hash.
+
+    :param now: Current UNIX time, used to skip the expired advertisements.
+
+    :return: The dictionary of the codecs accepted by each consumer having
+     a valid advertisement and the list of the consumers whose advertisement
+     is expired or invalid.
+    """
+    now = time.time() if now is None else now
+    valid = {}
+    stale = []
+    for consumer_id, value in advertisements.items():
+        if isinstance(consumer_id, bytes):
+            consumer_id = consumer_id.decode("utf-8")
+        if isinstance(value, bytes):
+            value = value.decode("utf-8")
+        try:
+            expires_at, codecs = value.split(":", 1)
+            codecs = frozenset(int(c) for c in codecs.split(",") if c)
+            if float(expires_at) <= now:
+                raise ValueError("Expired advertisement")
+        except ValueError:
+            stale.append(consumer_id)
+            continue
+        valid[consumer_id] = codecs
+    return valid, stale
+
+
+def ipc_negotiate_codec(subscribers, accepted) -> IpcCodec:
+    """Choose the codec of a channel from the codecs accepted by its live
+    consumers.
+
+    A codec other than JSON is only chosen when every subscriber of the
+    channel is a live consumer accepting it, so a single consumer not
+    taking part in the negotiation keep the channel in JSON.
+
+    :param subscribers: Number of subscribers of the channel.
+
+    :param accepted: Dictionary of the codecs accepted by each live consumer
+     of the channel, see :func:`ipc_parse_advertisements`.
+    """
+    if not accepted or len(accepted) < subscribers:
+        return IpcCodec.JSON
+    common = frozenset.intersection(*accepted.values())
+    for codec in IPC_CODEC_PREFERENCE:
+        if codec in common:
+            return codec
+    return IpcCodec.JSON
 
 
 def redis_subscribers_num(redis, channel):
@@ -85,3 +426,440 @@ def redis_send_to_print(redis, channel, msg: IpcPrintMessage, **kwargs):
         return redis.publish(channel, json.dumps(msg._asdict()))
     else:
         return None
+
+
+class IpcPublisher:
+    """Publish IPC messages on redis channels.
+
+    The publisher hold a redis client (and so its connection pool) for its
+    whole lifetime. Instead of asking the number of subscribers of a channel
+    before each message like :func:`redis_send_to_print`, the publisher rely
+    on the number of receivers returned by each `PUBLISH` and remember it for
+    `subscribers_ttl` seconds: messages to a channel known to have no
+    subscriber are dropped without any round trip.
+
+    :param redis: The redis client used to publish.
+
+    :param subscribers_ttl: Number of seconds the number of subscribers of a
+     channel is remembered.
+
+    :param codecs: Dictionary of the :class:`IpcCodec` forced for each
+     channel.
+
+    :param negotiate: Names of the channels whose codec is negotiated with
+     the codecs advertised by their live consumers (see
+     :func:`ipc_negotiate_codec`). The messages of the other channels are
+     sent in JSON unless forced in `codecs`. The negotiation cost two round
+     trips every `negotiation_ttl` seconds per channel.
+
+    :param negotiation_ttl: Number of seconds the negotiated codec of a
+     channel is remembered.
+    """
+
+    def __init__(
+        self,
+        redis,
+        subscribers_ttl=1.0,
+        codecs=None,
+        negotiate=(),
+        negotiation_ttl=10.0,
+    ):
+        self.redis = redis
+        self.subscribers_ttl = subscribers_ttl
+        self.codecs = codecs or {}
+        self.negotiate = frozenset(negotiate)
+        self.negotiation_ttl = negotiation_ttl
+        self._subscribers = {}
+        self._negotiated = {}
+
+    @classmethod
+    def from_url(cls, url, **kwargs):
+        """Create a publisher with a pooled redis client connected to `url`."""
+        import redis
+
+        return cls(redis.Redis.from_url(url), **kwargs)
+
+    def codec(self, channel) -> IpcCodec:
+        """Return the codec of the messages published on a channel."""
+        codec = self.codecs.get(channel)
+        if codec is not None:
+            return codec
+        if channel not in self.negotiate:
+            return IpcCodec.JSON
+
+        cached = self._negotiated.get(channel)
+        if cached is not None and cached[1] > time.monotonic():
+            return cached[0]
+        codec = self._negotiate(channel)
+        self._negotiated[channel] = (codec, time.monotonic() + self.negotiation_ttl)
+        return codec
+
+    def _negotiate(self, channel):
+        key = IPC_CODECS_KEY % (channel)
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.execute_command("PUBSUB", "NUMSUB", channel)
+        pipe.hgetall(key)
+        numsub, advertisements = pipe.execute()
+        accepted, stale = ipc_parse_advertisements(advertisements or {})
+        if accepted:
+            # Only trust the advertisements of the consumers still connected.
+            ids = list(accepted)
+            live = self.redis.execute_command(
+                "PUBSUB", "NUMSUB", *[IPC_CONSUMER_CHANNEL % (i) for i in ids]
+            )
+            for consumer_id, subscribed in zip(ids, live[1::2]):
+                if not int(subscribed):
+                    stale.append(consumer_id)
+                    del accepted[consumer_id]
+        if stale:
+            self.redis.hdel(key, *stale)
+        return ipc_negotiate_codec(numsub[1], accepted)
+
+    def encode(self, channel, msg: IpcMessage) -> bytes:
+        """Serialize a message with the codec of a channel."""
+        return ipc_encode(msg, self.codec(channel))
+
+    def _has_no_subscriber(self, channel):
+        cached = self._subscribers.get(channel)
+        return cached is not None and cached[0] == 0 and cached[1] > time.monotonic()
+
+    def _remember(self, channel, subscribers):
+        self._subscribers[channel] = (
+            subscribers,
+            time.monotonic() + self.subscribers_ttl,
+        )
+
+    def send(self, channel, msg: IpcMessage):
+        """Publish a message on a channel.
+
+        :return: The number of subscribers that received the message or None
+         if the channel has no subscriber.
+        """
+        if self._has_no_subscriber(channel):
+            return None
+
+        received = self.redis.publish(channel, self.encode(channel, msg))
+        self._remember(channel, received)
+        return received or None
+
+    def send_many(self, channel, msgs):
+        """Publish a batch of messages on a channel in a single round trip.
+
+        :return: The list of the number of subscribers that received each
+         message or None if the channel has no subscriber.
+        """
+        if not msgs or self._has_no_subscriber(channel):
+            return None
+
+        codec = self.codec(channel)
+        pipe = self.redis.pipeline(transaction=False)
+        for msg in msgs:
+            pipe.publish(channel, ipc_encode(msg, codec))
+        received = pipe.execute()
+        self._remember(channel, received[-1])
+        return received if received[-1] else None
+
+
+def ipc_coalesce(msgs):
+    """Merge the print messages having the same `destination` and `barcode`.
+
+    The `number` of the merged messages is summed in the first one, other
+    fields are kept from the first message. The other messages are kept
+    unchanged and the order of the first occurrences is preserved. The
+    given messages are not modified.
+
+    :param msgs: Iterable of :class:`IpcMessage`.
+    """
+    out = []
+    index = {}
+    for msg in msgs:
+        if msg.msg_type != IpcMessageType.PRINT:
+            out.append(msg)
+            continue
+        key = (msg.destination, msg.barcode)
+        i = index.get(key)
+        if i is None:
+            index[key] = len(out)
+            out.append(msg)
+        else:
+            first = out[i]
+            out[i] = IpcPrintMessage(
+                destination=first.destination,
+                origin=first.origin,
+                device=first.device,
+                barcode=first.barcode,
+                name=first.name,
+                number=first.number + msg.number,
+            )
+    return out
+
+
+class IpcBatchConsumer:
+    """Consume the messages of redis channels by micro-batches.
+
+    Once a first message is received, the consumer keep reading for at most
+    `max_wait` seconds or until `max_batch` messages are received. The batch
+    is coalesced with :func:`ipc_coalesce` and handed to `handler`, so a
+    burst of identical print messages become a single print job.
+
+    :param redis: The redis client used to subscribe.
+
+    :param channels: Names of the channels to consume.
+
+    :param handler: Callable receiving each batch as a list of
+     :class:`IpcMessage`.
+
+    :param max_batch: Maximum number of received messages per batch.
+
+    :param max_wait: Maximum number of seconds waited for the messages
+     following the first one of a batch.
+
+    :param coalesce: Whether the batch are coalesced.
+
+    :param codecs: The :class:`IpcCodec` advertised as accepted on the
+     channels while subscribed (see :func:`ipc_advertise_codecs`), `None` to
+     not take part in the codec negotiation. The consumer also subscribe to
+     its :data:`IPC_CONSUMER_CHANNEL` to prove its advertisements are live.
+
+    :param advertise_ttl: Number of seconds an advertisement stay valid. It
+     is renewed while polling once half of it elapsed.
+    """
+
+    def __init__(
+        self,
+        redis,
+        channels,
+        handler,
+        max_batch=100,
+        max_wait=0.05,
+        coalesce=True,
+        codecs=tuple(IpcCodec),
+        advertise_ttl=30.0,
+    ):
+        self.redis = redis
+        self.channels = channels
+        self.handler = handler
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.coalesce = coalesce
+        self.codecs = codecs
+        self.advertise_ttl = advertise_ttl
+        self.consumer_id = uuid.uuid4().hex
+        self.running = False
+        self.pubsub = None
+        self._advertise_at = None
+
+    def subscribe(self):
+        if self.pubsub is None:
+            self.pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+            channels = list(self.channels)
+            if self.codecs is not None:
+                channels.append(IPC_CONSUMER_CHANNEL % (self.consumer_id))
+            self.pubsub.subscribe(*channels)
+            self._advertise_at = None
+        self.advertise()
+
+    def advertise(self):
+        """Advertise the accepted codecs if the advertisement is due."""
+        if self.codecs is None:
+            return
+        now = time.monotonic()
+        if self._advertise_at is not None and now < self._advertise_at:
+            return
+        for channel in self.channels:
+            ipc_advertise_codecs(
+                self.redis, channel, self.consumer_id, self.codecs, self.advertise_ttl
+            )
+        self._advertise_at = now + self.advertise_ttl / 2
+
+    def close(self):
+        if self.pubsub is not None:
+            self.pubsub.close()
+            self.pubsub = None
+            if self.codecs is not None:
+                for channel in self.channels:
+                    ipc_withdraw_codecs(self.redis, channel, self.consumer_id)
+
+    def _get(self, timeout):
+        message = self.pubsub.get_message(timeout=timeout)
+        if message is None or message["type"] != "message":
+            return None
+        try:
+            return ipc_decode(message["data"])
+        except (ValueError, TypeError, struct.error):
+            logger.warning("Invalid IPC message %r", message["data"])
+            return None
+
+    def poll(self, timeout=1.0):
+        """Wait up to `timeout` seconds for a message and handle the batch
+        starting with it.
+
+        :return: The handled batch, empty if no message was received.
+        """
+        self.subscribe()
+        first = self._get(timeout)
+        if first is None:
+            return []
+
+        msgs = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(msgs) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            msg = self._get(remaining)
+            if msg is not None:
+                msgs.append(msg)
+
+        batch = ipc_coalesce(msgs) if self.coalesce else msgs
+        self.handler(batch)
+        return batch
+
+    def run(self, timeout=1.0):
+        """Handle the batches until :meth:`IpcBatchConsumer.stop` is called."""
+        self.running = True
+        try:
+            while self.running:
+                self.poll(timeout)
+        finally:
+            self.close()
+
+    def stop(self):
+        self.running = False
+
+
+class AsyncIpcClient:
+    """Asyncio publisher and subscriber of IPC messages.
+
+    The client share the message types and codecs of the synchronous helpers
+    (see :func:`ipc_encode` and :func:`ipc_decode`).
+
+    :param redis: An asyncio redis client (e.g. `redis.asyncio.Redis`).
+
+    :param codecs: Dictionary of the :class:`IpcCodec` used for each channel
+     when publishing. JSON is used by default, the codecs are not negotiated.
+
+    :param max_pending: Maximum number of concurrent publications. Publishers
+     wait for a slot once it is reached.
+
+    :param queue_size: Maximum number of received messages buffered by a
+     subscription. The subscription stop reading from redis until the
+     consumer catch up.
+
+    :param reconnect_delay: Initial delay in seconds before re-subscribing
+     after a lost connection. The delay double after each failure up to
+     `max_reconnect_delay`.
+    """
+
+    def __init__(
+        self,
+        redis,
+        codecs=None,
+        max_pending=64,
+        queue_size=256,
+        reconnect_delay=0.1,
+        max_reconnect_delay=5.0,
+        reconnect_exceptions=_RECONNECT_EXCEPTIONS,
+    ):
+        self.redis = redis
+        self.codecs = codecs or {}
+        self.queue_size = queue_size
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self.reconnect_exceptions = reconnect_exceptions
+        self.max_pending = max_pending
+        self._pending = None
+
+    @property
+    def pending(self):
+        # Created lazily to be bound to the running event loop.
+        if self._pending is None:
+            self._pending = asyncio.Semaphore(self.max_pending)
+        return self._pending
+
+    def encode(self, channel, msg: IpcMessage) -> bytes:
+        """Serialize a message with the codec of a channel."""
+        return ipc_encode(msg, self.codecs.get(channel, IpcCodec.JSON))
+
+    async def publish(self, channel, msg: IpcMessage):
+        """Publish a message on a channel.
+
+        :return: The number of subscribers that received the message.
+        """
+        async with self.pending:
+            return await self.redis.publish(channel, self.encode(channel, msg))
+
+    async def publish_many(self, channel, msgs):
+        """Publish a batch of messages on a channel in a single round trip.
+
+        :return: The list of the number of subscribers that received each
+         message.
+        """
+        async with self.pending:
+            pipe = self.redis.pipeline(transaction=False)
+            for msg in msgs:
+                pipe.publish(channel, self.encode(channel, msg))
+            return await pipe.execute()
+
+    async def subscribe(self, *channels):
+        """Asynchronous iterator of the messages received on `channels`.
+
+        The subscription is restored when the connection to redis is lost.
+        Messages that can't be decoded are skipped. The subscription is
+        closed with the iterator (e.g. `await messages.aclose()`).
+        """
+        queue = asyncio.Queue(self.queue_size)
+        reader = asyncio.ensure_future(self._read(channels, queue))
+        try:
+            while True:
+                msg = await queue.get()
+                if isinstance(msg, BaseException):
+                    raise msg
+                yield msg
+        finally:
+            reader.cancel()
+            try:
+                await reader
+            except asyncio.CancelledError:
+                pass
+
+    async def _read(self, channels, queue):
+        delay = self.reconnect_delay
+        while True:
+            pubsub = self.redis.pubsub()
+            try:
+                await pubsub.subscribe(*channels)
+                async for message in pubsub.listen():
+                    if message["type"] != "message":
+                        continue
+                    delay = self.reconnect_delay
+                    try:
+                        msg = ipc_decode(message["data"])
+                    except (ValueError, TypeError, struct.error):
+                        logger.warning("Invalid IPC message %r", message["data"])
+                        continue
+                    await queue.put(msg)
+            except self.reconnect_exceptions:
+                pass
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                await queue.put(e)
+                return
+            finally:
+                await _close_pubsub(pubsub)
+
+            logger.warning("IPC subscription lost, retrying in %.1fs", delay)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.max_reconnect_delay)
+
+
+async def _close_pubsub(pubsub):
+    close = getattr(pubsub, "aclose", None) or getattr(pubsub, "close", None)
+    if close is not None:
+        try:
+            result = close()
+            if inspect.isawaitable(result):
+                await result
+        except Exception:
+            pass
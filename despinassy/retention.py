@@ -0,0 +1,434 @@
+"""
+Monthly partitioning and retention of the transaction tables.
+
+The rows of `printer_transaction` and `scanner_transaction` are split by
+month of creation so the tables queried by the running devices only hold the
+recent transactions:
+
+* On PostgreSQL, when the table was created as a natively range partitioned
+  table by :func:`create_partitioned_table` before `db.create_all()`, the
+  monthly partitions are created in advance with `PARTITION OF` and the
+  database routes the rows itself.
+* Otherwise the partitioning is emulated. The rows of the closed months are
+  moved out of the table into one table per month by :func:`rotate`. The
+  history of the devices read these tables through :func:`history_query`.
+
+The layout of the partitions is cached in the process (see
+:func:`partition_layout`) so reading the history doesn't query the database
+catalog.
+
+The partitions older than the retention period are rolled up into daily
+aggregates (:class:`despinassy.Printer.PrinterTransactionDaily` and
+:class:`despinassy.Scanner.ScannerTransactionDaily`) and then dropped by
+:func:`apply_retention`, which should be run at least once a month.
+"""
+
+from despinassy.db import db
+from despinassy.cache import LRUCache
+from despinassy.Printer import PrinterTransaction, PrinterTransactionDaily
+from despinassy.Scanner import ScannerTransaction, ScannerTransactionDaily
+from sqlalchemy import (
+    Table,
+    Column,
+    Index,
+    MetaData,
+    PrimaryKeyConstraint,
+    event,
+    inspect,
+    text,
+    and_,
+)
+from sqlalchemy.sql import func, select, union_all
+import collections
+import dataclasses
+import datetime
+import re
+
+partition_metadata = MetaData()
+"""Metadata of the partition tables, kept out of `db.Model.metadata`"""
+
+LAYOUT_TTL = 60.0
+"""
+Number of seconds the layout of the partitions of a table is kept in the
+`partition_layout_cache`.
+"""
+
+PartitionLayout = collections.namedtuple("PartitionLayout", ("native", "periods"))
+"""
+Partitioning of a table, `native` tells whether it is natively partitioned
+and `periods` are the months, oldest first, having an emulated partition.
+"""
+
+partition_layout_cache = LRUCache(maxsize=64, ttl=LAYOUT_TTL)
+"""
+Cache of the :class:`PartitionLayout` of the tables by name.
+
+It is invalidated when the partitions are created, filled or dropped by this
+process. The partitions changed by other processes are picked up when the
+layout expire after :data:`LAYOUT_TTL` seconds.
+"""
+
+
+@dataclasses.dataclass(frozen=True)
+class Rollup:
+    """Describe how the rows of a transaction table are aggregated by day."""
+
+    daily: type
+    """Model of the daily aggregates"""
+
+    keys: tuple
+    """Columns grouped on alongside the day"""
+
+    sums: tuple
+    """Columns of the transactions summed in the column of the same name"""
+
+
+ROLLUPS = {
+    PrinterTransaction.__tablename__: Rollup(
+        PrinterTransactionDaily, ("printer_id", "barcode"), ("number",)
+    ),
+    ScannerTransaction.__tablename__: Rollup(
+        ScannerTransactionDaily, ("scanner_id", "mode"), ("quantity",)
+    ),
+}
+"""Tables supporting the partitioning, by name"""
+
+
+def month_start(date):
+    """Return the first day of the month of `date`."""
+    return datetime.date(date.year, date.month, 1)
+
+
+def add_months(period, months):
+    """Return the first day of the month `months` months after `period`."""
+    m = period.year * 12 + period.month - 1 + months
+    return datetime.date(m // 12, m % 12 + 1, 1)
+
+
+def _as_datetime(date):
+    return datetime.datetime(date.year, date.month, date.day)
+
+
+def _period_range(column, period):
+    return and_(
+        column >= _as_datetime(period),
+        column < _as_datetime(add_months(period, 1)),
+    )
+
+
+def partition_name(table, period):
+    """Return the name of the partition of `table` holding the rows of the
+    month of `period`.
+    """
+    return "%s_y%04dm%02d" % (table.name, period.year, period.month)
+
+
+def partition_table(table, period):
+    """Return the :class:`sqlalchemy.Table` of a partition of `table`."""
+    name = partition_name(table, period)
+    if name in partition_metadata.tables:
+        return partition_metadata.tables[name]
+    partition = Table(
+        name,
+        partition_metadata,
+        *[
+            Column(c.name, c.type, primary_key=c.primary_key, autoincrement=False)
+            for c in table.columns
+        ],
+    )
+    # Index the emulated partitions read by `history_query` like the table.
+    suffix = name[len(table.name) :]
+    for index in table.indexes:
+        Index(
+            index.name + suffix,
+            *[partition.c[c.name] for c in index.columns],
+            unique=index.unique,
+        )
+    return partition
+
+
+def partitioned_table(table):
+    """Return the definition of `table` as a PostgreSQL table partitioned
+    by range of `created_at`.
+
+    The primary key of a partitioned table must include the partition key,
+    so `created_at` is added to it.
+    """
+    metadata = MetaData()
+    for fk in table.foreign_keys:
+        fk.column.table.tometadata(metadata)
+    parent = table.tometadata(metadata)
+    parent.c.created_at.primary_key = True
+    parent.append_constraint(
+        PrimaryKeyConstraint(*[c.name for c in parent.columns if c.primary_key])
+    )
+    parent.c.id.autoincrement = True
+    parent.dialect_kwargs["postgresql_partition_by"] = "RANGE (created_at)"
+    return parent
+
+
+def create_partitioned_table(table, now=None):
+    """Create `table` as a natively partitioned table with the partitions of
+    the current and next months.
+
+    Must be called before `db.create_all()` creates `table` as a regular
+    table, an existing table is left untouched. On the databases other than
+    PostgreSQL the table is created as a regular table and the partitioning
+    is emulated.
+
+    :param table: Transaction table to create.
+
+    :param now: Current date, defaults to the current UTC date.
+
+    :return: Whether the table is natively partitioned.
+    """
+    connection = db.session.connection()
+    if connection.dialect.name == "postgresql":
+        partitioned_table(table).create(bind=connection, checkfirst=True)
+    else:
+        table.create(bind=connection, checkfirst=True)
+    ensure_partitions(table, now)
+    db.session.commit()
+    partition_layout_cache.invalidate(table.name)
+    return partition_layout(table).native
+
+
+def is_natively_partitioned(table, connection=None):
+    """Whether `table` is a native PostgreSQL partitioned table."""
+    connection = connection or db.session.connection()
+    if connection.dialect.name != "postgresql":
+        return False
+    return (
+        connection.execute(
+            text(
+                "SELECT 1 FROM pg_partitioned_table p "
+                "JOIN pg_class c ON c.oid = p.partrelid "
+                "WHERE c.relname = :name"
+            ),
+            name=table.name,
+        ).first()
+        is not None
+    )
+
+
+def partitions(table, connection=None):
+    """Return the months, oldest first, having a partition of `table`."""
+    connection = connection or db.session.connection()
+    pattern = re.compile(r"^%s_y(\d{4})m(\d{2})$" % (re.escape(table.name)))
+    periods = []
+    for name in inspect(connection).get_table_names():
+        m = pattern.match(name)
+        if m:
+            periods.append(datetime.date(int(m.group(1)), int(m.group(2)), 1))
+    return sorted(periods)
+
+
+def partition_layout(table):
+    """Return the cached :class:`PartitionLayout` of `table`."""
+    return partition_layout_cache.get_or_load(
+        table.name, lambda name: _load_partition_layout(table)
+    )
+
+
+def _load_partition_layout(table):
+    connection = db.session.connection()
+    if is_natively_partitioned(table, connection):
+        return PartitionLayout(True, ())
+    return PartitionLayout(False, tuple(partitions(table, connection)))
+
+
+def create_partition(table, period):
+    """Create, if missing, the partition of `table` for the month of `period`.
+
+    :return: The :class:`sqlalchemy.Table` of the partition.
+    """
+    period = month_start(period)
+    partition = partition_table(table, period)
+    connection = db.session.connection()
+    if is_natively_partitioned(table, connection):
+        connection.execute(
+            'CREATE TABLE IF NOT EXISTS "%s" PARTITION OF "%s" '
+            "FOR VALUES FROM ('%s') TO ('%s')"
+            % (
+                partition.name,
+                table.name,
+                period.isoformat(),
+                add_months(period, 1).isoformat(),
+            )
+        )
+    else:
+        partition.create(bind=connection, checkfirst=True)
+    partition_layout_cache.invalidate(table.name)
+    return partition
+
+
+def ensure_partitions(table, now=None, ahead=1):
+    """Create the partitions of a natively partitioned `table` for the
+    current month and the `ahead` following months.
+
+    The rows of a month without partition can't be inserted so the
+    partitions must exist before the month start. Tables whose partitioning
+    is emulated are left untouched.
+
+    :return: The months whose partition exist.
+    """
+    if not is_natively_partitioned(table):
+        return []
+    current = month_start(now or datetime.datetime.utcnow())
+    periods = [add_months(current, n) for n in range(ahead + 1)]
+    for period in periods:
+        create_partition(table, period)
+    return periods
+
+
+def history_query(model):
+    """Return a query of `model` also reading the rows moved to the
+    emulated partitions of its table by :func:`rotate`.
+
+    The rows read from a partition must not be modified. Filter and order
+    the query through the attributes of `model` as usual.
+
+    :param model: Model of a transaction table (e.g.
+     :class:`despinassy.Printer.PrinterTransaction`).
+    """
+    table = model.__table__
+    layout = partition_layout(table)
+    if layout.native or not layout.periods:
+        return model.query
+    rows = union_all(
+        select([table]),
+        *[select([partition_table(table, p)]) for p in layout.periods],
+    ).alias("%s_history" % (table.name))
+    return model.query.select_entity_from(rows)
+
+
+def rotate(table, now=None):
+    """Move the rows of the closed months out of `table` into their
+    partition.
+
+    Natively partitioned tables are left untouched as the database already
+    stores the rows in their partition.
+
+    :param table: Transaction table to rotate.
+
+    :param now: Current date, defaults to the current UTC date.
+
+    :return: The number of rows moved.
+    """
+    if is_natively_partitioned(table):
+        return 0
+    current = _as_datetime(month_start(now or datetime.datetime.utcnow()))
+    columns = [c.name for c in table.columns]
+    moved = 0
+    while True:
+        oldest = db.session.execute(
+            select([func.min(table.c.created_at)]).where(table.c.created_at < current)
+        ).scalar()
+        if oldest is None:
+            break
+        period = month_start(oldest)
+        partition = create_partition(table, period)
+        in_period = _period_range(table.c.created_at, period)
+        db.session.execute(
+            partition.insert().from_select(
+                columns, select([table.c[c] for c in columns]).where(in_period)
+            )
+        )
+        moved += db.session.execute(table.delete().where(in_period)).rowcount
+    db.session.commit()
+    partition_layout_cache.invalidate(table.name)
+    return moved
+
+
+def rollup_partition(table, period):
+    """Add the rows of a partition of `table` to the daily aggregates.
+
+    The aggregates of the days already rolled up are incremented.
+
+    :return: The number of daily aggregates created or updated.
+    """
+    rollup = ROLLUPS[table.name]
+    daily = rollup.daily
+    partition = partition_table(table, period)
+    day = func.date(partition.c.created_at, type_=db.Date)
+    keys = [partition.c[k] for k in rollup.keys]
+    rows = db.session.execute(
+        select(
+            [day.label("day")]
+            + keys
+            + [func.count().label("transactions")]
+            + [func.coalesce(func.sum(partition.c[c]), 0).label(c) for c in rollup.sums]
+        ).group_by(day, *keys)
+    ).fetchall()
+
+    existing = {
+        (d.day,) + tuple(getattr(d, k) for k in rollup.keys): d
+        for d in daily.query.filter(
+            daily.day >= period, daily.day < add_months(period, 1)
+        )
+    }
+    for row in rows:
+        aggregate = existing.get((row.day,) + tuple(row[k] for k in rollup.keys))
+        if aggregate is None:
+            db.session.add(
+                daily(
+                    day=row.day,
+                    transactions=row.transactions,
+                    **{k: row[k] for k in rollup.keys + rollup.sums},
+                )
+            )
+        else:
+            aggregate.transactions += row.transactions
+            for c in rollup.sums:
+                setattr(aggregate, c, getattr(aggregate, c) + row[c])
+    return len(rows)
+
+
+def apply_retention(table, keep_months=3, now=None):
+    """Roll up and drop the partitions of `table` older than `keep_months`
+    months.
+
+    The closed months are first moved out of `table` by :func:`rotate` and
+    the partitions of the next months of a natively partitioned table are
+    created by :func:`ensure_partitions`. Each partition is rolled up and
+    dropped in its own transaction.
+
+    :param table: Transaction table on which to apply the retention.
+
+    :param keep_months: Number of months of raw transactions kept including
+     the current month.
+
+    :param now: Current date, defaults to the current UTC date.
+
+    :return: The months whose partition was dropped.
+    """
+    now = now or datetime.datetime.utcnow()
+    rotate(table, now)
+    ensure_partitions(table, now)
+    db.session.commit()
+    cutoff = add_months(month_start(now), 1 - keep_months)
+    dropped = []
+    for period in partitions(table):
+        if period >= cutoff:
+            break
+        try:
+            rollup_partition(table, period)
+            partition_table(table, period).drop(bind=db.session.connection())
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        finally:
+            partition_layout_cache.invalidate(table.name)
+        dropped.append(period)
+    return dropped
+
+
+def _drop_partitions(target, connection, **kw):
+    for period in partitions(target, connection):
+        partition_table(target, period).drop(bind=connection, checkfirst=True)
+    partition_layout_cache.invalidate(target.name)
+
+
+for _name in ROLLUPS:
+    event.listen(db.Model.metadata.tables[_name], "after_drop", _drop_partitions)
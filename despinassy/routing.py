@@ -0,0 +1,392 @@
+"""
+In-memory routing table of the messages sent on the channels.
+
+The routing table answer which available printers listen on a channel and
+on which channel a scanner send its messages without loading the
+:class:`despinassy.Printer.Printer`, :class:`despinassy.Scanner.Scanner` and
+:class:`despinassy.Channel.Channel` models.
+
+The table is an immutable snapshot swapped on each refresh. The devices
+changed through the ORM are marked dirty by the mapper events and only these
+devices are reloaded the next time the table is read.
+
+The devices changed by other processes are picked up by the periodic full
+refresh of the table or, sooner, through redis when the processes publish
+their changes (see :meth:`Router.publish_invalidation` and
+:meth:`Router.listen_invalidation`).
+"""
+
+from despinassy.db import db
+from despinassy.Channel import Channel
+from despinassy.Printer import Printer
+from despinassy.Scanner import Scanner
+from despinassy.settings import DeviceSettings
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session, object_session
+from types import MappingProxyType
+import collections
+import json
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+PrinterRoute = collections.namedtuple("PrinterRoute", ("id", "dialect", "settings"))
+"""
+Available printer listening on a channel, its `settings` are a
+:class:`despinassy.settings.DeviceSettings`.
+"""
+
+RoutingTable = collections.namedtuple("RoutingTable", ("channels", "scanners"))
+"""
+Immutable snapshot of the routes.
+
+`channels` map the name of a channel to the `PrinterRoute` of its available
+printers ordered by id and `scanners` map the id of a scanner to the name of
+its channel.
+"""
+
+
+class Router:
+    """
+    Maintain a :class:`despinassy.routing.RoutingTable` in sync with the
+    database.
+
+    :param refresh_interval: Maximum number of seconds between two full
+     refresh of the table, `None` to only rely on the invalidations.
+
+    :param clock: Function returning the current time in seconds.
+    """
+
+    INVALIDATION_CHANNEL = "despinassy:routing"
+    """
+    Redis channel used to invalidate the routing table of the other
+    processes. See :meth:`Router.listen_invalidation`.
+    """
+
+    def __init__(self, refresh_interval=60.0, clock=time.monotonic):
+        self.refresh_interval = refresh_interval
+        self._clock = clock
+        self._lock = threading.RLock()
+        self._table = None
+        self._expire_at = None
+        self._printer_channels = {}
+        self._dirty_printers = set()
+        self._dirty_scanners = set()
+        self._redis = None
+
+    def table(self):
+        """Return the up to date :class:`despinassy.routing.RoutingTable`."""
+        table = self._table
+        if (
+            table is None
+            or self._dirty_printers
+            or self._dirty_scanners
+            or (self._expire_at is not None and self._clock() >= self._expire_at)
+        ):
+            table = self.refresh()
+        return table
+
+    def printers(self, channel):
+        """Return the `PrinterRoute` of the available printers listening on
+        `channel`.
+        """
+        return self.table().channels.get(channel, ())
+
+    def scanner_channel(self, scanner_id):
+        """Return the name of the channel of a scanner."""
+        return self.table().scanners.get(scanner_id)
+
+    def route(self, msg):
+        """Return the `PrinterRoute` of the printers receiving an
+        :class:`despinassy.ipc.IpcPrintMessage`.
+        """
+        return self.printers(msg.destination)
+
+    def mark_printers(self, *ids):
+        with self._lock:
+            self._dirty_printers.update(ids)
+
+    def mark_scanners(self, *ids):
+        with self._lock:
+            self._dirty_scanners.update(ids)
+
+    def invalidate(self):
+        """Rebuild the whole table the next time it is read."""
+        with self._lock:
+            self._table = None
+
+    def publish_invalidation(self, redis):
+        """
+        Publish the devices changed by the commits of this process to the
+        other processes.
+
+        :param redis: Redis client used to publish on
+         :attr:`Router.INVALIDATION_CHANNEL`, `None` to stop publishing.
+        """
+        self._redis = redis
+
+    def notify_invalidation(self, redis, printers=(), scanners=()):
+        """
+        Ask the other processes to reload the routes of devices, or their
+        whole table if no device is given.
+
+        :param redis: Redis client used to publish on
+         :attr:`Router.INVALIDATION_CHANNEL`.
+
+        :param printers: Ids of the changed printers.
+
+        :param scanners: Ids of the changed scanners.
+        """
+        return redis.publish(
+            self.INVALIDATION_CHANNEL,
+            json.dumps({"printers": sorted(printers), "scanners": sorted(scanners)}),
+        )
+
+    def listen_invalidation(self, redis, sleep_time=0.1):
+        """
+        Reload the routes each time another process call
+        :meth:`Router.notify_invalidation`.
+
+        :param redis: Redis client used to subscribe to
+         :attr:`Router.INVALIDATION_CHANNEL`.
+
+        :return: The background thread handling the subscription.
+        """
+        pubsub = redis.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(**{self.INVALIDATION_CHANNEL: self._on_invalidation})
+        return pubsub.run_in_thread(sleep_time=sleep_time, daemon=True)
+
+    def _on_invalidation(self, message):
+        try:
+            changes = json.loads(message["data"])
+            printers = changes["printers"]
+            scanners = changes["scanners"]
+        except (TypeError, ValueError, KeyError):
+            printers = scanners = None
+        if printers or scanners:
+            self.mark_printers(*printers)
+            self.mark_scanners(*scanners)
+        else:
+            self.invalidate()
+
+    def _notify(self, printers=(), scanners=()):
+        redis = self._redis
+        if redis is None:
+            return
+        try:
+            self.notify_invalidation(redis, printers, scanners)
+        except Exception:
+            # The other processes still pick up the changes on their next
+            # full refresh.
+            logger.warning("Routing invalidation not published", exc_info=True)
+
+    @staticmethod
+    def _printer_query():
+        return db.session.query(
+            Printer.id,
+            Printer.available,
+            Printer.dialect,
+            Printer.settings,
+            Channel.name,
+        ).outerjoin(Channel, Printer.redis_id == Channel.id)
+
+    @staticmethod
+    def _scanner_query():
+        return db.session.query(Scanner.id, Channel.name).outerjoin(
+            Channel, Scanner.redis_id == Channel.id
+        )
+
+    def refresh(self):
+        """Reload the dirty entries of the table and return it."""
+        with self._lock:
+            if self._table is None or (
+                self._expire_at is not None and self._clock() >= self._expire_at
+            ):
+                self._dirty_printers.clear()
+                self._dirty_scanners.clear()
+                self._printer_channels = {}
+                self._table = self._build(
+                    {}, {}, self._printer_query().all(), self._scanner_query().all()
+                )
+                if self.refresh_interval is not None:
+                    self._expire_at = self._clock() + self.refresh_interval
+            elif self._dirty_printers or self._dirty_scanners:
+                printer_ids = self._dirty_printers
+                scanner_ids = self._dirty_scanners
+                self._dirty_printers = set()
+                self._dirty_scanners = set()
+                printers = []
+                if printer_ids:
+                    printers = (
+                        self._printer_query()
+                        .filter(Printer.id.in_(list(printer_ids)))
+                        .all()
+                    )
+                scanners = []
+                if scanner_ids:
+                    scanners = (
+                        self._scanner_query()
+                        .filter(Scanner.id.in_(list(scanner_ids)))
+                        .all()
+                    )
+                channels = dict(self._table.channels)
+                for printer_id in printer_ids:
+                    channel = self._printer_channels.pop(printer_id, None)
+                    if channel is not None:
+                        channels[channel] = tuple(
+                            r for r in channels[channel] if r.id != printer_id
+                        )
+                        if not channels[channel]:
+                            del channels[channel]
+                scanner_channels = {
+                    k: v
+                    for (k, v) in self._table.scanners.items()
+                    if k not in scanner_ids
+                }
+                self._table = self._build(
+                    channels, scanner_channels, printers, scanners
+                )
+            return self._table
+
+    def _build(self, channels, scanner_channels, printers, scanners):
+        added = collections.defaultdict(list)
+        for printer_id, available, dialect, settings, channel in printers:
+            if available and channel is not None:
+                try:
+                    settings = DeviceSettings(settings)
+                except ValueError:
+                    logger.warning(
+                        "Printer %i not routed, invalid settings %r",
+                        printer_id,
+                        settings,
+                    )
+                    continue
+                added[channel].append(PrinterRoute(printer_id, dialect, settings))
+                self._printer_channels[printer_id] = channel
+        for channel, routes in added.items():
+            channels[channel] = tuple(
+                sorted(channels.get(channel, ()) + tuple(routes), key=lambda r: r.id)
+            )
+        for scanner_id, channel in scanners:
+            scanner_channels[scanner_id] = channel
+        return RoutingTable(
+            MappingProxyType(channels), MappingProxyType(scanner_channels)
+        )
+
+
+router = Router()
+"""Routing table of the process"""
+
+
+def _pending(target):
+    session = object_session(target)
+    if session is None:
+        return (set(), set())
+    return session.info.setdefault("routing_dirty", (set(), set()))
+
+
+def _invalidate_all(session):
+    router.invalidate()
+    if session is not None:
+        session.info["routing_invalidated"] = True
+
+
+_ROUTED_ATTRIBUTES = {
+    Printer: ("available", "dialect", "settings", "redis_id", "redis", "hidden"),
+    Scanner: ("available", "redis_id", "redis", "hidden"),
+}
+"""Attributes of the devices whose change can change their routes"""
+
+
+def _routes_changed(target):
+    attrs = inspect(target).attrs
+    return any(
+        attrs[key].history.has_changes() for key in _ROUTED_ATTRIBUTES[type(target)]
+    )
+
+
+@event.listens_for(Printer, "after_insert")
+@event.listens_for(Printer, "after_delete")
+def _mark_printer(mapper, connection, target):
+    router.mark_printers(target.id)
+    _pending(target)[0].add(target.id)
+
+
+@event.listens_for(Printer, "after_update")
+def _mark_updated_printer(mapper, connection, target):
+    # Skip the updates not touching the routes, like the bump of the
+    # `updated_at` of the printer on each print.
+    if _routes_changed(target):
+        _mark_printer(mapper, connection, target)
+
+
+@event.listens_for(Scanner, "after_insert")
+@event.listens_for(Scanner, "after_delete")
+def _mark_scanner(mapper, connection, target):
+    router.mark_scanners(target.id)
+    _pending(target)[1].add(target.id)
+
+
+@event.listens_for(Scanner, "after_update")
+def _mark_updated_scanner(mapper, connection, target):
+    if _routes_changed(target):
+        _mark_scanner(mapper, connection, target)
+
+
+@event.listens_for(Channel, "after_update")
+@event.listens_for(Channel, "after_delete")
+def _invalidate_router(mapper, connection, target):
+    _invalidate_all(object_session(target))
+
+
+@event.listens_for(Session, "after_commit")
+def _mark_on_commit(session):
+    # The table could have been refreshed with the uncommitted changes of the
+    # transaction.
+    dirty = session.info.pop("routing_dirty", None)
+    if dirty is not None:
+        router.mark_printers(*dirty[0])
+        router.mark_scanners(*dirty[1])
+    if session.info.pop("routing_invalidated", False):
+        router.invalidate()
+        router._notify()
+    elif dirty is not None and (dirty[0] or dirty[1]):
+        router._notify(*dirty)
+
+
+@event.listens_for(Session, "after_rollback")
+def _mark_on_rollback(session):
+    if session.info.pop("routing_invalidated", False):
+        router.invalidate()
+    dirty = session.info.pop("routing_dirty", None)
+    if dirty is not None:
+        router.mark_printers(*dirty[0])
+        router.mark_scanners(*dirty[1])
+
+
+_UNROUTED_COLUMNS = frozenset(("updated_at",))
+
+
+@event.listens_for(Session, "after_bulk_update")
+def _invalidate_router_on_bulk_update(context):
+    if context.mapper.class_ in (Printer, Scanner, Channel):
+        # Skip the updates of the timestamps by the write-behind loggers.
+        columns = {getattr(k, "key", k) for k in context.values}
+        if not columns <= _UNROUTED_COLUMNS:
+            _invalidate_all(context.session)
+
+
+@event.listens_for(Session, "after_bulk_delete")
+def _invalidate_router_on_bulk_delete(context):
+    if context.mapper.class_ in (Printer, Scanner, Channel):
+        _invalidate_all(context.session)
+
+
+def _invalidate_router_on_drop(target, connection, **kw):
+    router.invalidate()
+
+
+for _table in (Printer.__table__, Scanner.__table__, Channel.__table__):
+    event.listen(_table, "after_drop", _invalidate_router_on_drop)
@@ -0,0 +1,134 @@
+"""
+Settings of the :class:`despinassy.Printer.Printer` and
+:class:`despinassy.Scanner.Scanner` devices.
+
+The settings are stored as native JSON objects in the `settings` column of
+the devices. Older versions stored the settings as a JSON encoded string
+inside this JSON column, these rows are converted by :func:`migrate_settings`.
+"""
+
+from despinassy.db import db
+from sqlalchemy import bindparam
+from collections.abc import Mapping
+import json
+
+
+def decode_settings(value):
+    """Return the native value of settings.
+
+    :param value: Settings as a native value or as a JSON string, possibly
+     encoded more than once.
+
+    :raise ValueError: If `value` is a string that isn't valid JSON.
+    """
+    if not isinstance(value, str):
+        return value
+    value = json.loads(value)
+    while isinstance(value, str):
+        try:
+            value = json.loads(value)
+        except ValueError:
+            break
+    return value
+
+
+class DeviceSettings(Mapping):
+    """
+    Read-only view of the settings of a device parsed only once.
+
+    The keys of the settings can also be read as attributes.
+    Use :meth:`DeviceSettings.of` to get the settings of a device, the view
+    is cached on the device until its `settings` are reassigned or reloaded.
+
+    :param raw: Value of the `settings` column of the device.
+    """
+
+    __slots__ = ("raw", "_data")
+
+    def __init__(self, raw):
+        self.raw = raw
+        data = decode_settings(raw)
+        if data is None:
+            data = {}
+        elif not isinstance(data, dict):
+            raise ValueError("The settings are not a JSON object")
+        self._data = data
+
+    @staticmethod
+    def of(device):
+        """Return the cached settings of a device."""
+        raw = device.settings
+        cached = device.__dict__.get("_device_settings")
+        if cached is None or cached.raw is not raw:
+            cached = DeviceSettings(raw)
+            device._device_settings = cached
+        return cached
+
+    def __getitem__(self, key):
+        return self._data[key]
+
+    def __getattr__(self, key):
+        # Only called for the missing attributes, like the `_data` slot of an
+        # instance being copied or unpickled.
+        if key.startswith("_"):
+            raise AttributeError(key)
+        try:
+            return self._data[key]
+        except KeyError:
+            raise AttributeError(key) from None
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __len__(self):
+        return len(self._data)
+
+    def __repr__(self):
+        return "DeviceSettings(%r)" % (self._data)
+
+    def to_dict(self):
+        return dict(self._data)
+
+
+def settings_to_dict(value):
+    """Return the settings of a device serialized like the `to_dict` of the
+    device.
+
+    :param value: Value of the `settings` column of the device.
+    """
+    return DeviceSettings(value).to_dict()
+
+
+def migrate_settings(models=None):
+    """Convert the settings stored as JSON encoded strings to native JSON.
+
+    :param models: Models of the devices to migrate, the
+     :class:`despinassy.Printer.Printer` and
+     :class:`despinassy.Scanner.Scanner` by default.
+
+    :return: The number of devices migrated.
+    """
+    if models is None:
+        from despinassy.Printer import Printer
+        from despinassy.Scanner import Scanner
+
+        models = (Printer, Scanner)
+
+    migrated = 0
+    for model in models:
+        table = model.__table__
+        rows = [
+            {"_id": id, "_settings": decode_settings(settings)}
+            for (id, settings) in db.session.query(model.id, model.settings)
+            if isinstance(settings, str)
+        ]
+        if rows:
+            db.session.execute(
+                table.update()
+                .where(table.c.id == bindparam("_id"))
+                .values(settings=bindparam("_settings")),
+                rows,
+            )
+            migrated += len(rows)
+    db.session.commit()
+    return migrated
@@ -21,4 +21,5 @@ setuptools.setup(
     ],
     python_requires='>=3.6',
     install_requires=["Flask-SQLAlchemy"],
+    extras_require={"orjson": ["orjson"]},
 )
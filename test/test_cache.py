@@ -0,0 +1,116 @@
+import unittest
+import threading
+from despinassy.cache import InvalidationPublisher, LRUCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestLRUCache(unittest.TestCase):
+    def setUp(self):
+        self.loads = []
+
+    def loader(self, key):
+        self.loads.append(key)
+        return key.upper()
+
+    def test_cache_hit_miss(self):
+        cache = LRUCache(maxsize=2)
+        self.assertEqual(cache.get_or_load("a", self.loader), "A")
+        self.assertEqual(cache.get_or_load("a", self.loader), "A")
+        self.assertEqual(self.loads, ["a"])
+        stats = cache.stats()
+        self.assertEqual((stats.hits, stats.misses, stats.size), (1, 1, 1))
+        self.assertEqual(stats.hit_ratio, 0.5)
+
+    def test_cache_lru_eviction(self):
+        cache = LRUCache(maxsize=2)
+        cache.get_or_load("a", self.loader)
+        cache.get_or_load("b", self.loader)
+        cache.get_or_load("a", self.loader)
+        cache.get_or_load("c", self.loader)
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.stats().evictions, 1)
+        cache.get_or_load("a", self.loader)
+        cache.get_or_load("b", self.loader)
+        self.assertEqual(self.loads, ["a", "b", "c", "b"])
+
+    def test_cache_ttl(self):
+        clock = FakeClock()
+        cache = LRUCache(ttl=10, clock=clock)
+        cache.get_or_load("a", self.loader)
+        clock.now = 9
+        cache.get_or_load("a", self.loader)
+        clock.now = 10
+        cache.get_or_load("a", self.loader)
+        self.assertEqual(self.loads, ["a", "a"])
+
+    def test_cache_negative_ttl(self):
+        clock = FakeClock()
+        cache = LRUCache(maxsize=10, ttl=60, clock=clock, negative_ttl=5)
+        self.assertIsNone(cache.get_or_load("a", lambda key: None))
+        self.assertIsNone(cache.get_or_load("a", self.loader))
+        clock.now = 5
+        self.assertEqual(cache.get_or_load("a", self.loader), "A")
+        clock.now = 30
+        self.assertEqual(cache.get_or_load("a", self.loader), "A")
+        self.assertEqual(self.loads, ["a"])
+
+        cache = LRUCache(maxsize=10, negative_ttl=0)
+        self.assertIsNone(cache.get_or_load("a", lambda key: None))
+        self.assertEqual(len(cache), 0)
+
+    def test_cache_invalidate(self):
+        cache = LRUCache()
+        cache.get_or_load("a", self.loader)
+        cache.get_or_load("b", self.loader)
+        cache.invalidate("a")
+        cache.get_or_load("a", self.loader)
+        cache.get_or_load("b", self.loader)
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(self.loads, ["a", "b", "a"])
+
+    def test_cache_invalidate_during_load(self):
+        cache = LRUCache()
+
+        def loader(key):
+            cache.invalidate(key)
+            return "stale"
+
+        self.assertEqual(cache.get_or_load("a", loader), "stale")
+        self.assertEqual(len(cache), 0)
+
+
+class TestInvalidationPublisher(unittest.TestCase):
+    def test_publisher_queue_full(self):
+        class SlowRedis:
+            def __init__(self):
+                self.started = threading.Event()
+                self.release = threading.Event()
+                self.published = []
+
+            def publish(self, channel, data):
+                self.started.set()
+                self.release.wait(5)
+                self.published.append((channel, data))
+
+        redis = SlowRedis()
+        publisher = InvalidationPublisher(redis, maxsize=1)
+        self.assertTrue(publisher.publish("a", "1"))
+        self.assertTrue(redis.started.wait(5))
+        self.assertTrue(publisher.publish("b", "2"))
+        with self.assertLogs("despinassy.cache", "WARNING"):
+            self.assertFalse(publisher.publish("c", "3"))
+        redis.release.set()
+        publisher.close()
+        self.assertEqual(redis.published, [("a", "1"), ("b", "2")])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -2,7 +2,8 @@ import unittest
 from despinassy import db
 from despinassy.Printer import Printer, PrinterDialectEnum, PrinterTypeEnum
 from despinassy.Scanner import Scanner, ScannerTypeEnum, ScannerModeEnum
-from despinassy.Channel import Channel
+from despinassy.Channel import Channel, channel_cache
+from sqlalchemy import event
 
 
 class TestDatabaseChannel(unittest.TestCase):
@@ -41,6 +42,44 @@ class TestDatabaseChannel(unittest.TestCase):
         self.assertEqual(len(c.printers), 2)
         self.assertEqual(len(c.scanners), 1)
 
+    def test_channel_get_or_create(self):
+        statements = []
+
+        def count(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        c = Channel.get_or_create("victoria")
+        self.assertEqual(c.name, "victoria")
+        event.listen(db.engine, "before_cursor_execute", count)
+        try:
+            self.assertIs(Channel.get_or_create("victoria"), c)
+            p = Printer(name="main",
+                        type=1,
+                        dialect=1,
+                        redis="victoria",
+                        settings='{"address": "192.168.0.1"}')
+        finally:
+            event.remove(db.engine, "before_cursor_execute", count)
+        self.assertEqual(statements, [])
+        self.assertIs(p.redis, c)
+
+        n = Channel.get_or_create("new")
+        self.assertIsNotNone(n.id)
+        self.assertEqual(Channel.query.count(), 2)
+        db.session.rollback()
+        self.assertEqual(Channel.query.count(), 1)
+        n = Channel.get_or_create("new")
+        self.assertEqual(Channel.query.count(), 2)
+        db.session.delete(n)
+        db.session.commit()
+        n = Channel.get_or_create("new")
+        self.assertEqual(n.name, "new")
+        self.assertEqual(len(channel_cache), 1)
+
+    def test_channel_invalid(self):
+        self.assertRaises(Exception, Scanner, redis=1)
+        self.assertRaises(Exception, Printer, redis=None)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -1,5 +1,10 @@
 import unittest
+from unittest import mock
 from despinassy import db, Part, Inventory
+from despinassy.Part import PartImport, PartImportSummary, part_fingerprint
+from sqlalchemy.dialects import postgresql
+from flask_sqlalchemy import SQLAlchemy
+import flask
 import sqlalchemy
 import io
 import uuid
@@ -131,6 +136,188 @@ class TestCsv(unittest.TestCase):
         self.assertEqual(Part.query.filter(Part.hidden == False).count(), 2)
         self.assertEqual(Part.query.count(), 3)
 
+    def test_csv_import_chunked(self):
+        """
+        Test the import of a '.csv' staged in multiple chunks
+        """
+        content = "name,barcode\n" + "".join(
+            "part%i,barcode%i\n" % (i, i) for i in range(25)
+        )
+        summary = Part._import_csv_content(io.StringIO(content), chunk_size=4)
+        self.assertEqual(summary.inserted, 25)
+        self.assertEqual(Part.query.count(), 25)
+        p = Part.query.filter(Part.barcode == "barcode17").first()
+        self.assertEqual(p.name, "part17")
+
+    def test_csv_import_summary(self):
+        """
+        Test the summary returned by a re-import only count the changed parts
+        """
+        csv1 = io.StringIO("name,barcode\nhello,world\nfoo,bar\n123,456\n")
+        summary = Part._import_csv_content(csv1)
+        self.assertEqual(summary.inserted, 3)
+        self.assertEqual(summary.hidden, 0)
+        csv2 = io.StringIO("name,barcode\nhello,world\nfoo2,bar\n")
+        summary = Part._import_csv_content(csv2, chunk_size=1)
+        self.assertEqual(summary.inserted, 0)
+        self.assertEqual(summary.updated, 1)
+        self.assertEqual(summary.hidden, 1)
+        self.assertEqual(Part.query.filter(Part.barcode == "bar").first().name, "foo2")
+        csv3 = io.StringIO("name,barcode\n123,456\n123,456\n")
+        summary = Part._import_csv_content(csv3, chunk_size=1)
+        self.assertEqual(summary.unhidden, 1)
+        self.assertEqual(summary.hidden, 2)
+        self.assertEqual(Part.query.filter(Part.hidden == False).count(), 1)
+        self.assertEqual(Part.query.count(), 3)
+
+    def test_csv_import_duplicate(self):
+        """
+        Test the last occurence of a barcode present many times is imported
+        """
+        csv = io.StringIO("name,barcode\nfoo,bar\nhello,world\nfoo2,bar\n")
+        summary = Part._import_csv_content(csv, chunk_size=2)
+        self.assertEqual(summary.inserted, 2)
+        self.assertEqual(Part.query.filter(Part.barcode == "bar").first().name, "foo2")
+
+    def test_csv_import_incremental(self):
+        """
+        Test an incremental import skip a file identical to the last import
+        and only update the changed parts otherwise
+        """
+        filename = "/tmp/%s" % (uuid.uuid4())
+        with open(filename, "w") as f:
+            f.write("name,barcode\nhello,world\nfoo,bar\n")
+        summary = Part.import_csv(filename, incremental=True)
+        self.assertFalse(summary.skipped)
+        self.assertEqual(summary.inserted, 2)
+        self.assertEqual(PartImport.query.count(), 1)
+
+        summary = Part.import_csv(filename, incremental=True)
+        self.assertTrue(summary.skipped)
+        self.assertEqual(PartImport.query.count(), 1)
+
+        with open(filename, "w") as f:
+            f.write("name,barcode\nhello,world\nfoo2,bar\n")
+        summary = Part.import_csv(filename, incremental=True)
+        self.assertFalse(summary.skipped)
+        self.assertEqual(summary.updated, 1)
+        self.assertEqual(summary.inserted, 0)
+        self.assertEqual(PartImport.query.count(), 2)
+
+    def test_csv_import_fingerprint(self):
+        """
+        Test parts created outside of an import are not updated by an
+        import with the same content
+        """
+        db.session.add(Part(name="foo", barcode="bar"))
+        db.session.commit()
+        p = Part.query.first()
+        self.assertEqual(p.fingerprint, part_fingerprint("foo", "bar"))
+        summary = Part._import_csv_content(io.StringIO("name,barcode\nfoo,bar\n"))
+        self.assertEqual(summary.updated, 0)
+        self.assertEqual(summary.inserted, 0)
+
+    def test_csv_import_postgresql_reconcile(self):
+        """
+        Test the statements reconciling the staging table on PostgreSQL
+        """
+        executed = []
+
+        def execute(stmt, *args, **kwargs):
+            executed.append(
+                " ".join(str(stmt.compile(dialect=postgresql.dialect())).split())
+            )
+            return mock.Mock(rowcount=len(executed))
+
+        summary = PartImportSummary()
+        with mock.patch.object(db.session, "execute", execute):
+            Part._reconcile_import_staging_postgresql(summary)
+
+        dedup, unhide, update, hide, insert = executed
+        self.assertEqual(
+            dedup,
+            "DELETE FROM part_import_staging WHERE part_import_staging.id NOT IN "
+            "(SELECT max(part_import_staging.id) AS max_1 FROM part_import_staging "
+            "GROUP BY part_import_staging.barcode)",
+        )
+        self.assertTrue(unhide.startswith("UPDATE part SET hidden=%(hidden)s"))
+        self.assertIn(
+            "FROM part_import_staging WHERE part.barcode = "
+            "part_import_staging.barcode AND part.hidden IS NOT false",
+            unhide,
+        )
+        self.assertTrue(
+            update.startswith(
+                "UPDATE part SET name=part_import_staging.name, "
+                "fingerprint=part_import_staging.fingerprint"
+            )
+        )
+        self.assertIn(
+            "FROM part_import_staging WHERE part.barcode = "
+            "part_import_staging.barcode AND part.fingerprint IS DISTINCT FROM "
+            "part_import_staging.fingerprint",
+            update,
+        )
+        self.assertIn(
+            "WHERE part.hidden IS NOT true AND NOT (EXISTS (SELECT * FROM "
+            "part_import_staging WHERE part_import_staging.barcode = part.barcode))",
+            hide,
+        )
+        self.assertTrue(
+            insert.startswith(
+                "INSERT INTO part (name, barcode, fingerprint, counter, hidden, "
+                "created_at) SELECT part_import_staging.name, "
+                "part_import_staging.barcode, part_import_staging.fingerprint"
+            )
+        )
+        self.assertTrue(
+            insert.endswith(
+                "FROM part_import_staging WHERE part_import_staging.barcode IS "
+                "NOT NULL ON CONFLICT (barcode) DO NOTHING"
+            )
+        )
+        self.assertEqual(
+            summary,
+            PartImportSummary(inserted=5, unhidden=2, updated=3, hidden=4),
+        )
+
+    def test_csv_import_postgresql_copy(self):
+        """
+        Test the '.csv' content sent to the PostgreSQL 'COPY' of the staging
+        table
+        """
+        copies = []
+
+        class FakeCursor:
+            closed = False
+
+            def copy_expert(self, sql, buf):
+                copies.append((sql, buf.read()))
+
+            def close(self):
+                self.closed = True
+
+        cursor = FakeCursor()
+        conn = mock.Mock()
+        conn.connection.cursor.return_value = cursor
+        Part._copy_to_import_staging(
+            conn,
+            [
+                {"name": "a,b", "barcode": 'q"x', "fingerprint": "f1"},
+                {"name": "line\nbreak", "barcode": "plain", "fingerprint": None},
+            ],
+        )
+        self.assertTrue(cursor.closed)
+        ((sql, content),) = copies
+        self.assertEqual(
+            sql,
+            "COPY part_import_staging (name, barcode, fingerprint) FROM STDIN "
+            "WITH (FORMAT csv)",
+        )
+        # Columns in the order of the 'COPY', special characters quoted and
+        # `None` written unquoted empty, which is NULL in the csv format.
+        self.assertEqual(content, '"a,b","q""x",f1\r\n"line\nbreak",plain,\r\n')
+
     def test_csv_export_1(self):
         BARCODE = "QWERTY1234"
         NAME = "BARCODE"
@@ -169,6 +356,69 @@ class TestCsv(unittest.TestCase):
         header, content = output.split("\n")
         self.assertTrue("BARCODE,QWERTY1234,2.0," in content)
 
+    def test_csv_export_chunks(self):
+        for n in range(5):
+            p = Part(name="NAME%i" % (n), barcode="BARCODE%i" % (n))
+            db.session.add(p)
+            db.session.add(Inventory(part=p, quantity=n))
+        db.session.commit()
+
+        chunks = list(Inventory.iter_csv(chunk_size=2))
+        self.assertEqual(len(chunks), 3)
+        lines = "".join(chunks).strip().split("\n")
+        self.assertEqual(len(lines), 6)
+        self.assertTrue("NAME4,BARCODE4,4.0," in lines[-1])
+
+        filename = "/tmp/%s" % (uuid.uuid4())
+        Inventory.export_csv(filename)
+        with open(filename) as f:
+            self.assertEqual(f.read(), "".join(chunks))
+
+
+class TestCsvFlask(unittest.TestCase):
+    """Stream the export from a Flask application registering `db`."""
+
+    def setUp(self):
+        db.init_app(config={"uri": "sqlite://"})
+        self.app = flask.Flask(__name__)
+        self.app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite://"
+        self.app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+        SQLAlchemy.init_app(db, self.app)
+
+        @self.app.route("/inventory.csv")
+        def export():
+            return flask.Response(
+                flask.stream_with_context(Inventory.iter_csv(chunk_size=1)),
+                mimetype="text/csv",
+            )
+
+        # Like a deployment calling `db.init_app(app)`, `db` has no fallback
+        # application outside of a context.
+        self.no_app = mock.patch.object(db, "app", None)
+        self.no_app.start()
+        db.session.remove()
+        with self.app.app_context():
+            db.create_all()
+
+    def tearDown(self):
+        with self.app.app_context():
+            db.drop_all()
+        self.no_app.stop()
+
+    def test_csv_export_stream(self):
+        with self.app.app_context():
+            for n in range(3):
+                p = Part(name="NAME%i" % (n), barcode="BARCODE%i" % (n))
+                db.session.add(p)
+                db.session.add(Inventory(part=p, quantity=n))
+            db.session.commit()
+
+        response = self.app.test_client().get("/inventory.csv")
+        self.assertEqual(response.status_code, 200)
+        lines = response.get_data(as_text=True).strip().split("\n")
+        self.assertEqual(len(lines), 4)
+        self.assertTrue("NAME2,BARCODE2,2.0," in lines[-1])
+
 
 if __name__ == "__main__":
     unittest.main()
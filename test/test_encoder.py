@@ -0,0 +1,64 @@
+import unittest
+import datetime
+import enum
+import json
+from despinassy import encoder
+from despinassy.Inventory import InventoryUnitEnum
+from despinassy.Printer import PrinterTypeEnum
+from despinassy.settings import DeviceSettings
+
+
+class Color(enum.Enum):
+    RED = "red"
+
+
+class TestEncoder(unittest.TestCase):
+    ROW = {
+        "id": 1,
+        "type": PrinterTypeEnum.STATIC,
+        "unit": str(InventoryUnitEnum.PIECES),
+        "color": Color.RED,
+        "settings": DeviceSettings({"address": "192.168.0.1"}),
+        "created_at": datetime.datetime(2026, 10, 18, 12, 30, 1, 250),
+        "day": datetime.date(2026, 10, 18),
+        "updated_at": None,
+        "quantity": 1.5,
+        "name": "m³",
+        "transactions": [{"id": 2}],
+    }
+    EXPECTED = {
+        "id": 1,
+        "type": 3,
+        "unit": "pcs",
+        "color": "red",
+        "settings": {"address": "192.168.0.1"},
+        "created_at": "2026-10-18T12:30:01.000250",
+        "day": "2026-10-18",
+        "updated_at": None,
+        "quantity": 1.5,
+        "name": "m³",
+        "transactions": [{"id": 2}],
+    }
+
+    def test_dumps(self):
+        data = encoder.dumps(self.ROW)
+        self.assertIsInstance(data, bytes)
+        self.assertEqual(json.loads(data), self.EXPECTED)
+
+    def test_dumps_json(self):
+        # The fallback without orjson give the same result.
+        data = encoder._dumps_json(self.ROW)
+        self.assertEqual(json.loads(data), self.EXPECTED)
+        self.assertTrue(data.startswith(b'{"id":1,"type":3,"unit":"pcs",'))
+
+    def test_dumps_invalid(self):
+        self.assertRaises(TypeError, encoder.dumps, {"x": object()})
+        self.assertRaises(TypeError, encoder._dumps_json, {"x": object()})
+
+    def test_dumps_ndjson(self):
+        lines = list(encoder.dumps_ndjson([{"id": 1}, {"id": 2}]))
+        self.assertEqual(lines, [b'{"id":1}\n', b'{"id":2}\n'])
+
+
+if __name__ == "__main__":
+    unittest.main()
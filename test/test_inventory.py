@@ -1,5 +1,9 @@
 import unittest
 from despinassy import db, Part, Inventory, InventorySession
+from despinassy.Inventory import InventoryUnitEnum
+from sqlalchemy import event
+from sqlalchemy.dialects import postgresql
+from unittest import mock
 
 
 class TestDatabaseInventory(unittest.TestCase):
@@ -153,6 +157,190 @@ class TestDatabaseInventory(unittest.TestCase):
 
         self.assertEqual(i1.to_dict(), result)
 
+    def test_inventory_bulk_to_dict(self):
+        i1 = TestDatabaseInventory.inventory_creation("BARCODE", "QWERTY1234", 2)
+        TestDatabaseInventory.inventory_creation("FOO", "BAR")
+        entries = Inventory.bulk_to_dict()
+        self.assertEqual(len(entries), 2)
+        self.assertEqual(entries[0], i1.to_dict())
+
+    def test_inventory_serializers_counter(self):
+        i1 = TestDatabaseInventory.inventory_creation("BARCODE", "QWERTY1234")
+        i1.part.printed(3)
+        db.session.commit()
+        self.assertEqual(i1.to_dict()["part"]["counter"], 3)
+        self.assertEqual(Inventory.bulk_to_dict()[0]["part"]["counter"], 3)
+        self.assertEqual(Inventory.serialize_query()[0]["part"]["counter"], 3)
+
+    def test_inventory_bulk_statement_count(self):
+        """
+        Verify the bulk serialization and the '.csv' export use the same
+        number of statements whatever the number of inventory entries.
+        """
+        statements = []
+
+        def count(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        def measure():
+            del statements[:]
+            event.listen(db.engine, "before_cursor_execute", count)
+            try:
+                self.assertEqual(len(Inventory.bulk_to_dict()), Inventory.query.count())
+                "".join(Inventory.iter_csv(chunk_size=2))
+            finally:
+                event.remove(db.engine, "before_cursor_execute", count)
+            return len(statements)
+
+        TestDatabaseInventory.inventory_creation("BARCODE", "QWERTY1234")
+        db.session.expire_all()
+        few = measure()
+        for n in range(10):
+            TestDatabaseInventory.inventory_creation("NAME%i" % (n), "BARCODE%i" % (n))
+        db.session.expire_all()
+        self.assertEqual(measure(), few)
+
+    def test_inventory_session_cache(self):
+        """
+        Verify the current session is only queried once when creating
+        many inventory entries.
+        """
+        statements = []
+
+        def count(conn, cursor, statement, parameters, context, executemany):
+            if "FROM inventory_session" in statement:
+                statements.append(statement)
+
+        InventorySession.current_id()
+        event.listen(db.engine, "before_cursor_execute", count)
+        try:
+            for n in range(3):
+                TestDatabaseInventory.inventory_creation(
+                    "NAME%i" % (n), "BARCODE%i" % (n)
+                )
+        finally:
+            event.remove(db.engine, "before_cursor_execute", count)
+        self.assertEqual(statements, [])
+
+    def test_inventory_session_cache_archive(self):
+        i1 = TestDatabaseInventory.inventory_creation("FOO", "BAR")
+        Inventory.archive()
+        self.assertEqual(InventorySession.current_id(), InventorySession.last().id)
+        i2 = TestDatabaseInventory.inventory_creation("BARCODE", "QWERTY1234")
+        self.assertNotEqual(i1.session_id, i2.session_id)
+        self.assertEqual(i2.session, InventorySession.last())
+        self.assertEqual(Inventory.last_session_entries().count(), 1)
+
+    def test_inventory_increment(self):
+        i = TestDatabaseInventory.inventory_creation("BARCODE", "QWERTY1234", 2)
+        self.assertEqual(Inventory.increment("QWERTY1234"), 3)
+        self.assertEqual(Inventory.increment("QWERTY1234", 1.5), 4.5)
+        db.session.commit()
+        db.session.refresh(i)
+        self.assertEqual(i.quantity, 4.5)
+
+    def test_inventory_increment_creation(self):
+        db.session.add(Part(name="FOO", barcode="BAR"))
+        db.session.commit()
+        self.assertEqual(Inventory.increment("BAR", 2, InventoryUnitEnum.METER), 2)
+        db.session.commit()
+        i = Inventory.retrieve_inventory_from_barcode("BAR")
+        self.assertEqual(i.quantity, 2)
+        self.assertEqual(i.unit, InventoryUnitEnum.METER)
+        self.assertEqual(i.session_id, InventorySession.current_id())
+        self.assertIsNone(Inventory.increment("UNKNOWN"))
+        self.assertEqual(Inventory.query.count(), 1)
+
+    def test_inventory_increment_without_session(self):
+        db.session.add(Part(name="FOO", barcode="BAR"))
+        InventorySession.query.delete()
+        db.session.commit()
+        self.assertIsNone(InventorySession.current_id())
+        for _ in range(2):
+            self.assertRaises(ValueError, Inventory.increment, "BAR")
+            self.assertRaises(ValueError, Inventory.increment_many, [("BAR", 1)])
+        db.session.commit()
+        self.assertEqual(Inventory.query.count(), 0)
+
+    def test_inventory_increment_many(self):
+        TestDatabaseInventory.inventory_creation("BARCODE", "QWERTY1234", 2)
+        db.session.add(Part(name="FOO", barcode="BAR"))
+        db.session.commit()
+        scans = [("QWERTY1234", 1), ("BAR", 2), ("UNKNOWN", 1), ("QWERTY1234", 3)]
+        result = Inventory.increment_many(scans)
+        db.session.commit()
+        self.assertEqual(result, {"QWERTY1234": 6, "BAR": 2})
+        self.assertEqual(Inventory.query.count(), 2)
+        self.assertEqual(Inventory.retrieve_inventory_from_barcode("BAR").quantity, 2)
+        self.assertEqual(Inventory.increment_many([("BAR", 1)]), {"BAR": 3})
+        self.assertEqual(Inventory.increment_many([("UNKNOWN", 1)]), {})
+
+    def test_inventory_increment_many_update_first(self):
+        TestDatabaseInventory.inventory_creation("BARCODE", "QWERTY1234", 2)
+        db.session.add(Part(name="FOO", barcode="BAR"))
+        db.session.commit()
+        statements = []
+
+        def count(conn, cursor, statement, *args):
+            if "inventory" in statement and "inventory_session" not in statement:
+                statements.append(statement.split()[0])
+
+        event.listen(db.engine, "before_cursor_execute", count)
+        try:
+            result = Inventory.increment_many([("QWERTY1234", 1), ("BAR", 2)])
+        finally:
+            event.remove(db.engine, "before_cursor_execute", count)
+        db.session.commit()
+        self.assertEqual(result, {"QWERTY1234": 3, "BAR": 2})
+        # The write lock is taken before looking for the missing entries.
+        self.assertEqual(statements, ["UPDATE", "INSERT", "SELECT"])
+
+    def test_inventory_increment_many_postgresql_chunks(self):
+        for n in range(5):
+            db.session.add(Part(name="NAME%i" % (n), barcode="BARCODE%i" % (n)))
+        db.session.commit()
+        executed = []
+
+        def execute(stmt, *args, **kwargs):
+            executed.append(stmt)
+            return []
+
+        with mock.patch.object(db, "dialect_name", return_value="postgresql"):
+            with mock.patch("despinassy.Inventory.UPSERT_CHUNK_SIZE", 2):
+                with mock.patch.object(db.session, "execute", execute):
+                    Inventory.increment_many(("BARCODE%i" % (n), 1) for n in range(5))
+        self.assertEqual(len(executed), 3)
+        sql = str(executed[0].compile(dialect=postgresql.dialect()))
+        self.assertIn("ON CONFLICT (part_id, session_id) DO UPDATE", sql)
+        self.assertEqual(
+            [
+                len(stmt.compile(dialect=postgresql.dialect()).params)
+                for stmt in executed
+            ],
+            [12, 12, 6],
+        )
+
+    def test_inventory_retrieve_session(self):
+        i1 = TestDatabaseInventory.inventory_creation("BARCODE", "QWERTY1234", 1)
+        old_session = i1.session
+        Inventory.archive()
+        self.assertIsNone(Inventory.retrieve_inventory_from_barcode("QWERTY1234"))
+        i2 = Inventory(part=i1.part, quantity=2)
+        db.session.add(i2)
+        db.session.commit()
+        self.assertEqual(Inventory.retrieve_inventory_from_barcode("QWERTY1234"), i2)
+        self.assertEqual(
+            Inventory.retrieve_inventory_from_barcode("QWERTY1234", old_session), i1
+        )
+
+    def test_inventory_retrieve_many(self):
+        i1 = TestDatabaseInventory.inventory_creation("BARCODE", "QWERTY1234")
+        i2 = TestDatabaseInventory.inventory_creation("FOO", "BAR")
+        result = Inventory.retrieve_inventories_from_barcodes(
+            ["QWERTY1234", "BAR", "UNKNOWN"]
+        )
+        self.assertEqual(result, {"QWERTY1234": i1, "BAR": i2})
+
 
 if __name__ == "__main__":
     unittest.main()
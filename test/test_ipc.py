@@ -2,8 +2,117 @@ import unittest
 from despinassy.ipc import (
     IpcOrigin,
     IpcPrintMessage,
+    IpcPublisher,
+    AsyncIpcClient,
+    IpcBatchConsumer,
+    ipc_coalesce,
+    ipc_advertise_codecs,
+    ipc_negotiate_codec,
+    ipc_parse_advertisements,
+    IPC_CODECS_KEY,
+    IPC_CONSUMER_CHANNEL,
+    IpcCodec,
+    IpcMessage,
+    IpcMessageType,
+    ipc_encode,
+    ipc_decode,
+    ipc_create_print_message,
 )
+import asyncio
 import json
+import time
+
+
+class FakeRedis:
+    """Local stand-in of a redis client counting the round trips.
+
+    The number of subscribers of the channels missing from `subscribers` is
+    counted from the subscribed `FakePubSub`.
+    """
+
+    def __init__(self, subscribers=None):
+        self.subscribers = subscribers or {}
+        self.pubsubs = []
+        self.published = []
+        self.hashes = {}
+        self.round_trips = 0
+
+    def numsub(self, channel):
+        if channel in self.subscribers:
+            return self.subscribers[channel]
+        return sum(channel in p.channels for p in self.pubsubs)
+
+    def _execute_command(self, *args):
+        if args[:2] == ("PUBSUB", "NUMSUB"):
+            return [x for c in args[2:] for x in (c, self.numsub(c))]
+
+    def execute_command(self, *args):
+        self.round_trips += 1
+        return self._execute_command(*args)
+
+    def _hset(self, key, field, value):
+        self.hashes.setdefault(key, {})[field] = value.encode("utf-8")
+        return 1
+
+    def _hgetall(self, key):
+        return dict(self.hashes.get(key, {}))
+
+    def _expire(self, key, ttl):
+        return 1
+
+    def hdel(self, key, *fields):
+        self.round_trips += 1
+        fields = [self.hashes.get(key, {}).pop(f, None) for f in fields]
+        return sum(f is not None for f in fields)
+
+    def _publish(self, channel, data):
+        self.published.append((channel, data))
+        return self.numsub(channel)
+
+    def publish(self, channel, data):
+        self.round_trips += 1
+        return self._publish(channel, data)
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+    def pubsub(self, ignore_subscribe_messages=False):
+        pubsub = FakePubSub(self)
+        self.pubsubs.append(pubsub)
+        return pubsub
+
+
+class FakePubSub:
+    def __init__(self, redis):
+        self.redis = redis
+        self.channels = ()
+
+    def subscribe(self, *channels):
+        self.channels = channels
+
+    def get_message(self, timeout=0.0):
+        for i, (channel, data) in enumerate(self.redis.published):
+            if channel in self.channels:
+                del self.redis.published[i]
+                return {"type": "message", "channel": channel, "data": data}
+        return None
+
+    def close(self):
+        self.channels = ()
+
+
+class FakePipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.commands = []
+
+    def __getattr__(self, name):
+        command = getattr(self.redis, "_" + name)
+        return lambda *args: self.commands.append((command, args))
+
+    def execute(self):
+        self.redis.round_trips += 1
+        return [command(*args) for (command, args) in self.commands]
 
 
 class TestIpc(unittest.TestCase):
@@ -43,6 +152,387 @@ class TestIpc(unittest.TestCase):
         ii = IpcPrintMessage(**json.loads(dump))
         self.assertEqual(ii, i)
 
+    def test_msg_slots(self):
+        i = IpcPrintMessage(barcode=1234, name="name", origin=2, number=2.0)
+        self.assertFalse(hasattr(i, "__dict__"))
+        self.assertEqual(i.barcode, "1234")
+        self.assertEqual(i.number, 2)
+        self.assertIs(i.origin, IpcOrigin.HURON)
+        self.assertIs(i.msg_type, IpcMessageType.PRINT)
+        self.assertRaises(ValueError, IpcPrintMessage, origin=42)
+        self.assertEqual(
+            repr(IpcMessage(destination="victoria")),
+            "IpcMessage(destination='victoria', origin=<IpcOrigin.UNDEFINED: 0>, "
+            "device=None, msg_type=<IpcMessageType.UNDEFINED: 0>)",
+        )
+
+    def test_msg_from_model(self):
+        class PartRow:
+            barcode = "barcode"
+            name = "name"
+            counter = 3
+
+        i = ipc_create_print_message(
+            PartRow(), destination="victoria", origin=IpcOrigin.TEST, name=""
+        )
+        self.assertEqual(
+            i,
+            IpcPrintMessage(
+                barcode="barcode",
+                name="name",
+                destination="victoria",
+                origin=IpcOrigin.TEST,
+            ),
+        )
+        d = dict(i._asdict(), unknown=1)
+        self.assertEqual(IpcPrintMessage.from_dict(d), i)
+        self.assertEqual(IpcPrintMessage.from_model(d, number=4).number, 4)
+
+    def test_msg_binary(self):
+        i = IpcPrintMessage(
+            barcode="bärcode",
+            name="name",
+            origin=IpcOrigin.TEST,
+            destination="victoria",
+            number=3,
+        )
+        data = ipc_encode(i, IpcCodec.BINARY)
+        self.assertLess(len(data), len(ipc_encode(i)))
+        ii = ipc_decode(data)
+        self.assertEqual(ii, i)
+        self.assertIsNone(ii.device)
+        self.assertEqual(ii.origin, IpcOrigin.TEST)
+
+        m = IpcMessage(
+            destination="victoria", device="dev", msg_type=IpcMessageType.UNDEFINED
+        )
+        self.assertEqual(ipc_decode(ipc_encode(m, IpcCodec.BINARY)), m)
+
+    def test_msg_decode_json(self):
+        i = IpcPrintMessage(barcode="barcode", name="name", destination="victoria")
+        self.assertEqual(ipc_decode(ipc_encode(i)), i)
+        self.assertEqual(ipc_decode(json.dumps(i._asdict())), i)
+        for data in (b"5", b"[]", b'"victoria"', b"null"):
+            self.assertRaises(ValueError, ipc_decode, data)
+
+
+class TestIpcBatch(unittest.TestCase):
+    @staticmethod
+    def message(barcode, number=1, destination="victoria"):
+        return IpcPrintMessage(
+            barcode=barcode, name="name", destination=destination, number=number
+        )
+
+    def test_coalesce(self):
+        msgs = [
+            self.message("a"),
+            self.message("b", 2),
+            self.message("a", 3),
+            self.message("a", 1, "erie"),
+            IpcMessage(destination="victoria"),
+            self.message("b"),
+        ]
+        batch = ipc_coalesce(msgs)
+        self.assertEqual(
+            [(m.destination, m.barcode, m.number) for m in batch[:3]],
+            [("victoria", "a", 4), ("victoria", "b", 3), ("erie", "a", 1)],
+        )
+        self.assertEqual(batch[3], IpcMessage(destination="victoria"))
+        self.assertEqual(msgs[0].number, 1)
+
+    def test_batch_consumer(self):
+        redis = FakeRedis({"victoria": 1})
+        batches = []
+        consumer = IpcBatchConsumer(
+            redis, ["victoria"], batches.append, max_batch=3, max_wait=0.01
+        )
+        publisher = IpcPublisher(redis, codecs={"victoria": IpcCodec.BINARY})
+        for barcode in ["a", "a", "b", "a"]:
+            publisher.send("victoria", self.message(barcode))
+        publisher.send("erie", self.message("c"))
+
+        batch = consumer.poll(0)
+        self.assertEqual([(m.barcode, m.number) for m in batch], [("a", 2), ("b", 1)])
+        batch = consumer.poll(0)
+        self.assertEqual([(m.barcode, m.number) for m in batch], [("a", 1)])
+        self.assertEqual(consumer.poll(0), [])
+        self.assertEqual(len(batches), 2)
+
+
+class FakeAsyncRedis:
+    """In-process stand-in of an asyncio redis server and client."""
+
+    def __init__(self):
+        self.subscribers = {}
+
+    async def publish(self, channel, data):
+        queues = self.subscribers.get(channel, [])
+        for queue in queues:
+            queue.put_nowait({"type": "message", "channel": channel, "data": data})
+        return len(queues)
+
+    def pubsub(self):
+        return FakeAsyncPubSub(self)
+
+    def pipeline(self, transaction=True):
+        return FakeAsyncPipeline(self)
+
+    def disconnect(self):
+        for queues in self.subscribers.values():
+            for queue in queues:
+                queue.put_nowait(ConnectionError())
+
+
+class FakeAsyncPubSub:
+    def __init__(self, redis):
+        self.redis = redis
+        self.queue = asyncio.Queue()
+        self.channels = []
+
+    async def subscribe(self, *channels):
+        for channel in channels:
+            self.redis.subscribers.setdefault(channel, []).append(self.queue)
+            self.channels.append(channel)
+            self.queue.put_nowait({"type": "subscribe", "channel": channel})
+
+    async def listen(self):
+        while True:
+            message = await self.queue.get()
+            if isinstance(message, Exception):
+                raise message
+            yield message
+
+    async def aclose(self):
+        for channel in self.channels:
+            self.redis.subscribers[channel].remove(self.queue)
+
+
+class FakeAsyncPipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.commands = []
+
+    def publish(self, channel, data):
+        self.commands.append((channel, data))
+
+    async def execute(self):
+        return [await self.redis.publish(*c) for c in self.commands]
+
+
+class TestAsyncIpcClient(unittest.TestCase):
+    @staticmethod
+    def message(barcode="barcode"):
+        return IpcPrintMessage(barcode=barcode, name="name", destination="victoria")
+
+    @staticmethod
+    async def wait_subscribed(redis, channel):
+        while not redis.subscribers.get(channel):
+            await asyncio.sleep(0)
+
+    def test_publish_subscribe(self):
+        async def run():
+            redis = FakeAsyncRedis()
+            client = AsyncIpcClient(redis, codecs={"victoria": IpcCodec.BINARY})
+            received = []
+
+            async def consume():
+                messages = client.subscribe("victoria")
+                async for msg in messages:
+                    received.append(msg)
+                    if len(received) == 3:
+                        break
+                await messages.aclose()
+
+            consumer = asyncio.ensure_future(consume())
+            await self.wait_subscribed(redis, "victoria")
+            self.assertEqual(await client.publish("victoria", self.message("1")), 1)
+            await redis.publish("victoria", b"garbage")
+            await redis.publish("victoria", b"5")
+            await client.publish_many(
+                "victoria", [self.message("2"), self.message("3")]
+            )
+            await asyncio.wait_for(consumer, 1)
+            self.assertEqual([m.barcode for m in received], ["1", "2", "3"])
+            self.assertEqual(redis.subscribers["victoria"], [])
+
+        asyncio.run(run())
+
+    def test_reconnect(self):
+        async def run():
+            redis = FakeAsyncRedis()
+            client = AsyncIpcClient(redis, reconnect_delay=0.01)
+            received = []
+
+            async def consume():
+                async for msg in client.subscribe("victoria"):
+                    received.append(msg)
+                    if len(received) == 2:
+                        return
+
+            consumer = asyncio.ensure_future(consume())
+            await self.wait_subscribed(redis, "victoria")
+            await client.publish("victoria", self.message("1"))
+            redis.disconnect()
+            await asyncio.sleep(0)
+            await asyncio.wait_for(self.wait_subscribed(redis, "victoria"), 1)
+            await client.publish("victoria", self.message("2"))
+            await asyncio.wait_for(consumer, 1)
+            self.assertEqual([m.barcode for m in received], ["1", "2"])
+
+        asyncio.run(run())
+
+
+class TestIpcPublisher(unittest.TestCase):
+    @staticmethod
+    def message(barcode="barcode"):
+        return IpcPrintMessage(
+            barcode=barcode,
+            name="name",
+            origin=IpcOrigin.TEST,
+            destination="victoria",
+        )
+
+    def test_send(self):
+        redis = FakeRedis({"victoria": 2})
+        publisher = IpcPublisher(redis)
+        self.assertEqual(publisher.send("victoria", self.message()), 2)
+        self.assertEqual(publisher.send("victoria", self.message()), 2)
+        self.assertEqual(redis.round_trips, 2)
+        channel, data = redis.published[0]
+        self.assertEqual(channel, "victoria")
+        self.assertEqual(IpcPrintMessage(**json.loads(data)), self.message())
+
+    def test_send_no_subscriber(self):
+        redis = FakeRedis()
+        publisher = IpcPublisher(redis, subscribers_ttl=60)
+        self.assertIsNone(publisher.send("victoria", self.message()))
+        self.assertIsNone(publisher.send("victoria", self.message()))
+        self.assertEqual(redis.round_trips, 1)
+
+        publisher = IpcPublisher(redis, subscribers_ttl=0)
+        self.assertIsNone(publisher.send("victoria", self.message()))
+        redis.subscribers["victoria"] = 1
+        self.assertEqual(publisher.send("victoria", self.message()), 1)
+
+    def test_send_many(self):
+        redis = FakeRedis({"victoria": 1})
+        publisher = IpcPublisher(redis)
+        msgs = [self.message(str(n)) for n in range(10)]
+        self.assertEqual(publisher.send_many("victoria", msgs), [1] * 10)
+        self.assertEqual(redis.round_trips, 1)
+        self.assertEqual(len(redis.published), 10)
+
+    def test_send_codec(self):
+        redis = FakeRedis({"victoria": 1, "erie": 1})
+        publisher = IpcPublisher(redis, codecs={"erie": IpcCodec.BINARY})
+        publisher.send("victoria", self.message())
+        publisher.send("erie", self.message())
+        self.assertEqual(json.loads(redis.published[0][1]), self.message()._asdict())
+        self.assertEqual(
+            redis.published[1][1], ipc_encode(self.message(), IpcCodec.BINARY)
+        )
+        self.assertEqual(ipc_decode(redis.published[1][1]), self.message())
+
+
+class TestIpcNegotiation(unittest.TestCase):
+    @staticmethod
+    def message(barcode="barcode"):
+        return IpcPrintMessage(
+            barcode=barcode,
+            name="name",
+            origin=IpcOrigin.TEST,
+            destination="victoria",
+        )
+
+    def test_negotiate_codec(self):
+        now = time.time()
+        binary = "%f:0,1" % (now + 10)
+        accepted, stale = ipc_parse_advertisements(
+            {
+                b"a": binary.encode("utf-8"),
+                "b": "%f:0" % (now + 10),
+                "expired": "%f:0,1" % (now - 1),
+                "invalid": "invalid",
+            },
+            now,
+        )
+        self.assertEqual(accepted, {"a": {0, 1}, "b": {0}})
+        self.assertEqual(stale, ["expired", "invalid"])
+
+        self.assertEqual(ipc_negotiate_codec(0, {}), IpcCodec.JSON)
+        self.assertEqual(
+            ipc_negotiate_codec(1, {"a": frozenset((0, 1))}), IpcCodec.BINARY
+        )
+        self.assertEqual(
+            ipc_negotiate_codec(2, {"a": frozenset((0, 1))}), IpcCodec.JSON
+        )
+        self.assertEqual(ipc_negotiate_codec(2, accepted), IpcCodec.JSON)
+
+    def test_publisher_negotiation(self):
+        redis = FakeRedis()
+        publisher = IpcPublisher(redis, negotiate={"victoria"}, negotiation_ttl=0)
+        consumer = IpcBatchConsumer(redis, ["victoria"], None)
+        consumer.subscribe()
+        publisher.send("victoria", self.message())
+        self.assertEqual(
+            redis.published[-1][1], ipc_encode(self.message(), IpcCodec.BINARY)
+        )
+
+        # A consumer not taking part in the negotiation subscribe.
+        redis.pubsub().subscribe("victoria")
+        publisher.send_many("victoria", [self.message(), self.message()])
+        self.assertEqual(redis.published[-1][1][:1], b"{")
+
+        # The channels are only negotiated on demand.
+        redis.subscribers["erie"] = 1
+        ipc_advertise_codecs(redis, "erie", consumer.consumer_id)
+        publisher.send("erie", self.message())
+        self.assertEqual(redis.published[-1][1][:1], b"{")
+
+        publisher = IpcPublisher(
+            redis, negotiate={"victoria"}, codecs={"victoria": IpcCodec.BINARY}
+        )
+        publisher.send("victoria", self.message())
+        self.assertEqual(
+            redis.published[-1][1], ipc_encode(self.message(), IpcCodec.BINARY)
+        )
+
+    def test_negotiation_crashed_consumer(self):
+        redis = FakeRedis()
+        key = IPC_CODECS_KEY % ("victoria")
+        publisher = IpcPublisher(redis, negotiate={"victoria"}, negotiation_ttl=0)
+        crashed = IpcBatchConsumer(redis, ["victoria"], None)
+        crashed.subscribe()
+        ipc_advertise_codecs(redis, "victoria", "expired", ttl=-1)
+        publisher.send("victoria", self.message())
+        self.assertEqual(redis.published[-1][1][:1], bytes((0xD5,)))
+        self.assertEqual(list(redis.hashes[key]), [crashed.consumer_id])
+
+        # The connection of the consumer is lost without withdrawing its
+        # still valid advertisement and a JSON only consumer subscribe.
+        crashed.pubsub.close()
+        redis.pubsub().subscribe("victoria")
+        publisher.send("victoria", self.message())
+        self.assertEqual(redis.published[-1][1][:1], b"{")
+        self.assertEqual(redis.hashes[key], {})
+
+    def test_consumer_advertise(self):
+        redis = FakeRedis()
+        batches = []
+        consumer = IpcBatchConsumer(redis, ["victoria"], batches.append)
+        consumer.subscribe()
+        key = IPC_CODECS_KEY % ("victoria")
+        self.assertIn(consumer.consumer_id, redis.hashes[key])
+        self.assertEqual(redis.numsub(IPC_CONSUMER_CHANNEL % (consumer.consumer_id)), 1)
+
+        publisher = IpcPublisher(redis, negotiate={"victoria"})
+        publisher.send("victoria", self.message())
+        self.assertEqual(redis.published[-1][1][:1], bytes((0xD5,)))
+        self.assertEqual(consumer.poll(timeout=0), [self.message()])
+
+        consumer.close()
+        self.assertEqual(redis.hashes[key], {})
+
 
 if __name__ == "__main__":
     unittest.main()
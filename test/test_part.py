@@ -1,6 +1,16 @@
 import unittest
 from despinassy import db, Part, Inventory
+from despinassy.Part import (
+    PartCounterDelta,
+    PartSnapshot,
+    part_lookup_cache,
+    _on_lookup_invalidation,
+)
+import json
+import threading
+from unittest import mock
 import sqlalchemy
+from sqlalchemy import event
 
 class TestDatabasePart(unittest.TestCase):
     @classmethod
@@ -52,6 +62,161 @@ class TestDatabasePart(unittest.TestCase):
         db.session.commit()
         self.assertEqual(Part.query.count(), 0)
 
+    def test_part_printed(self):
+        x = Part(name="BARCODE", barcode="QWERTY1234")
+        db.session.add(x)
+        db.session.commit()
+        x.printed()
+        x.printed(3)
+        db.session.flush()
+        self.assertEqual(x.print_count, 4)
+        db.session.commit()
+        # The counter column only includes the compacted prints.
+        self.assertEqual(x.counter, 0)
+        self.assertEqual(x.to_dict()["counter"], 4)
+        self.assertEqual(Part.print_counts(), {x.id: 4})
+
+        self.assertEqual(Part.compact_counters(), 2)
+        self.assertEqual(PartCounterDelta.query.count(), 0)
+        self.assertEqual(x.counter, 4)
+        self.assertEqual(x.to_dict()["counter"], 4)
+        self.assertEqual(x.print_count, 4)
+        x.printed()
+        self.assertEqual(Part.print_counts([x.id]), {x.id: 5})
+        db.session.commit()
+        self.assertEqual(Part.compact_counters(), 1)
+        self.assertEqual(Part.compact_counters(), 0)
+
+    def test_part_to_dict_statement_count(self):
+        statements = []
+
+        def count(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        for n in range(10):
+            p = Part(name="NAME%i" % (n), barcode="BARCODE%i" % (n))
+            db.session.add(p)
+            p.printed()
+        db.session.commit()
+        event.listen(db.engine, "before_cursor_execute", count)
+        try:
+            self.assertEqual(len([p.to_dict() for p in Part.query]), 10)
+        finally:
+            event.remove(db.engine, "before_cursor_execute", count)
+        self.assertEqual(len(statements), 1)
+        self.assertEqual(Part.query.first().to_dict()["counter"], 1)
+
+    def test_part_lookup(self):
+        x = Part(name="BARCODE", barcode="QWERTY1234")
+        db.session.add(x)
+        db.session.commit()
+        stats = Part.lookup_stats()
+        snapshot = Part.lookup("QWERTY1234")
+        self.assertEqual(snapshot, PartSnapshot(x.id, "BARCODE", "QWERTY1234", False))
+        self.assertIs(Part.lookup("QWERTY1234"), snapshot)
+        self.assertIsNone(Part.lookup("UNKNOWN"))
+        self.assertEqual(Part.lookup_stats().hits, stats.hits + 1)
+        self.assertEqual(Part.lookup_stats().misses, stats.misses + 2)
+
+        x.name = "RENAMED"
+        db.session.commit()
+        self.assertEqual(Part.lookup("QWERTY1234").name, "RENAMED")
+        x.barcode = "UNKNOWN"
+        db.session.commit()
+        self.assertIsNone(Part.lookup("QWERTY1234"))
+        self.assertEqual(Part.lookup("UNKNOWN").id, x.id)
+        Part.query.delete()
+        db.session.commit()
+        self.assertIsNone(Part.lookup("UNKNOWN"))
+
+    def test_part_lookup_unknown(self):
+        now = [0.0]
+        with mock.patch.object(part_lookup_cache, "_clock", lambda: now[0]):
+            self.assertIsNone(Part.lookup("CREATED"))
+            # Created by another process.
+            db.session.execute(
+                Part.__table__.insert().values(name="CREATED", barcode="CREATED")
+            )
+            db.session.commit()
+            self.assertIsNone(Part.lookup("CREATED"))
+            now[0] = part_lookup_cache.negative_ttl
+            self.assertEqual(Part.lookup("CREATED").name, "CREATED")
+        Part.query.delete()
+        db.session.commit()
+
+    def test_part_lookup_invalidation(self):
+        class FakeRedis:
+            def __init__(self):
+                self.published = []
+
+            def publish(self, channel, data):
+                self.published.append((channel, json.loads(data)))
+
+        db.session.commit()
+        redis = FakeRedis()
+        publisher = Part.publish_lookup_invalidation(redis)
+        try:
+            x = Part(name="BARCODE", barcode="QWERTY1234")
+            db.session.add(x)
+            db.session.flush()
+            publisher.join()
+            self.assertEqual(redis.published, [])
+            db.session.commit()
+            publisher.join()
+            self.assertEqual(
+                redis.published, [(Part.LOOKUP_INVALIDATION_CHANNEL, ["QWERTY1234"])]
+            )
+            Part.query.filter_by(id=x.id).update({"name": "RENAMED"})
+            db.session.commit()
+            publisher.join()
+            self.assertEqual(redis.published[-1][1], [])
+        finally:
+            Part.publish_lookup_invalidation(None)
+
+        self.assertEqual(Part.lookup("QWERTY1234").name, "RENAMED")
+        db.session.execute(
+            Part.__table__.update().values(name="OTHER PROCESS")
+        )
+        db.session.commit()
+        _on_lookup_invalidation({"data": json.dumps(["QWERTY1234"])})
+        self.assertEqual(Part.lookup("QWERTY1234").name, "OTHER PROCESS")
+        Part.query.delete()
+        db.session.commit()
+
+    def test_part_lookup_invalidation_redis_down(self):
+        class BlockingRedis:
+            def __init__(self):
+                self.release = threading.Event()
+
+            def publish(self, channel, data):
+                self.release.wait(5)
+                raise ConnectionError("redis down")
+
+        db.session.commit()
+        redis = BlockingRedis()
+        publisher = Part.publish_lookup_invalidation(redis)
+        try:
+            x = Part(name="BARCODE", barcode="QWERTY1234")
+            db.session.add(x)
+            # The commit doesn't wait for redis nor fail with it.
+            with self.assertLogs("despinassy.cache", "WARNING"):
+                db.session.commit()
+                redis.release.set()
+                publisher.join()
+        finally:
+            Part.publish_lookup_invalidation(None)
+        self.assertEqual(Part.lookup("QWERTY1234").name, "BARCODE")
+        Part.query.delete()
+        db.session.commit()
+
+    def test_part_lookup_rollback(self):
+        x = Part(name="BARCODE", barcode="QWERTY1234")
+        db.session.add(x)
+        db.session.flush()
+        self.assertIsNotNone(Part.lookup("QWERTY1234"))
+        db.session.rollback()
+        self.assertIsNone(Part.lookup("QWERTY1234"))
+
     def test_part_long_barcode(self):
         longbarcode = "X" * 256
         self.assertRaises(sqlalchemy.exc.ArgumentError, Part, name="foo", barcode=longbarcode)
@@ -1,5 +1,4 @@
 import unittest
-import json
 from despinassy import db
 from despinassy.ipc import IpcPrintMessage, IpcOrigin
 from despinassy.Printer import (
@@ -7,8 +6,10 @@ from despinassy.Printer import (
     PrinterTransaction,
     PrinterDialectEnum,
     PrinterTypeEnum,
+    PrinterTransactionLogger,
 )
 from despinassy.Channel import Channel
+from despinassy.Part import Part
 
 
 class TestDatabasePrinter(unittest.TestCase):
@@ -41,7 +42,14 @@ class TestDatabasePrinter(unittest.TestCase):
         self.assertEqual(p.type, PrinterTypeEnum.STDOUT)
         self.assertEqual(p.dialect, PrinterDialectEnum.ZEBRA_ZPL)
         self.assertEqual(Printer.query.get(p.id), p)
-        self.assertEqual(json.loads(p.settings)["address"], "192.168.0.1")
+        self.assertEqual(p.settings["address"], "192.168.0.1")
+        self.assertEqual(p.device_settings.address, "192.168.0.1")
+        self.assertIs(p.device_settings, p.device_settings)
+        self.assertEqual(p.to_dict()["settings"], {"address": "192.168.0.1"})
+        p.settings = '{"address": "192.168.0.2"}'
+        self.assertEqual(p.device_settings.address, "192.168.0.2")
+        db.session.commit()
+        self.assertEqual(p.settings, {"address": "192.168.0.2"})
 
     def test_printer_transaction(self):
         p = Printer(
@@ -109,6 +117,91 @@ class TestDatabasePrinter(unittest.TestCase):
         self.assertEqual(p.transactions[0].name, "world")
         self.assertEqual(p.transactions[1].name, "bar")
 
+    def test_printer_transactions_page(self):
+        p = Printer(
+            name="main",
+            type=1,
+            dialect=1,
+            redis="victoria",
+            settings='{"address": "192.168.0.1"}',
+        )
+        db.session.add(p)
+        for i in range(5):
+            db.session.add(
+                p.add_transaction(origin=IpcOrigin.TEST, barcode="foo", name=str(i))
+            )
+        db.session.commit()
+        page, cursor = p.transactions_page(limit=2)
+        self.assertEqual([t.name for t in page], ["4", "3"])
+        page, cursor = p.transactions_page(after=cursor, limit=2)
+        self.assertEqual([t.name for t in page], ["2", "1"])
+        page, cursor = p.transactions_page(
+            after=(cursor[0].isoformat(), cursor[1]), limit=2
+        )
+        self.assertEqual([t.name for t in page], ["0"])
+        self.assertIsNone(cursor)
+        d = p.to_dict(full=True)
+        self.assertEqual(len(d["transactions"]), 5)
+        self.assertIsNone(d["transactions_next"])
+
+    def test_printer_transaction_logger(self):
+        p = Printer(
+            name="main",
+            type=1,
+            dialect=1,
+            redis="victoria",
+            settings='{"address": "192.168.0.1"}',
+        )
+        db.session.add(p)
+        db.session.commit()
+        msg = IpcPrintMessage(
+            barcode="hello",
+            name="world",
+            origin=IpcOrigin.TEST,
+            destination="victoria",
+            number=2,
+        )
+        with PrinterTransactionLogger(max_size=3, flush_interval=60) as logger:
+            logger.log(p, **msg._asdict())
+            logger.log(p.id, **msg._asdict())
+            self.assertEqual(len(logger), 2)
+            self.assertEqual(PrinterTransaction.query.count(), 0)
+            logger.log(p, **msg._asdict())
+            logger.log(p, **msg._asdict())
+        self.assertEqual(len(logger), 0)
+        self.assertEqual(PrinterTransaction.query.count(), 4)
+        self.assertIsNotNone(
+            db.session.query(Printer.updated_at).filter_by(id=p.id).scalar()
+        )
+        pt = PrinterTransaction.query.first()
+        self.assertEqual(pt.number, 2)
+        self.assertEqual(pt.origin, IpcOrigin.TEST)
+        self.assertEqual(pt.printer, p)
+
+    def test_printer_transaction_logger_session(self):
+        p = Printer(
+            name="main",
+            type=1,
+            dialect=1,
+            redis="victoria",
+            settings='{"address": "192.168.0.1"}',
+        )
+        db.session.add(p)
+        db.session.commit()
+        msg = IpcPrintMessage(
+            barcode="hello",
+            name="world",
+            origin=IpcOrigin.TEST,
+            destination="victoria",
+        )
+        # The flush of the logger doesn't commit the changes of the caller.
+        db.session.add(Part(name="pending", barcode="PENDING"))
+        with PrinterTransactionLogger(max_size=1, flush_interval=60) as logger:
+            logger.log(p, **msg._asdict())
+        db.session.rollback()
+        self.assertEqual(PrinterTransaction.query.count(), 1)
+        self.assertEqual(Part.query.filter_by(barcode="PENDING").count(), 0)
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,179 @@
+import unittest
+import datetime
+from despinassy import db, Printer, Scanner
+from despinassy.ipc import IpcOrigin
+from despinassy.Printer import PrinterTransaction, PrinterTransactionDaily
+from despinassy.Scanner import (
+    ScannerModeEnum,
+    ScannerTransaction,
+    ScannerTransactionDaily,
+)
+from despinassy.retention import (
+    apply_retention,
+    create_partitioned_table,
+    ensure_partitions,
+    partitioned_table,
+    partitions,
+    rotate,
+)
+from sqlalchemy import event
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.schema import CreateTable
+
+NOW = datetime.datetime(2026, 10, 15)
+
+
+class TestRetention(unittest.TestCase):
+    @classmethod
+    def setUpClass(self):
+        db.init_app(
+            config={
+                "uri": "sqlite://",
+            }
+        )
+        db.drop_all()
+
+    def setUp(self):
+        db.create_all()
+        self.printer = Printer(
+            name="main", type=1, dialect=1, redis="victoria", settings="{}"
+        )
+        db.session.add(self.printer)
+        db.session.commit()
+
+    def tearDown(self):
+        db.drop_all()
+
+    def add_print(self, created_at, barcode="FOO", number=1):
+        db.session.add(
+            PrinterTransaction(
+                printer=self.printer,
+                origin=IpcOrigin.TEST,
+                barcode=barcode,
+                name="bar",
+                number=number,
+                created_at=created_at,
+            )
+        )
+
+    def test_rotate(self):
+        table = PrinterTransaction.__table__
+        self.add_print(datetime.datetime(2026, 7, 3))
+        self.add_print(datetime.datetime(2026, 9, 30, 23, 59))
+        self.add_print(datetime.datetime(2026, 10, 1))
+        db.session.commit()
+        self.assertEqual(rotate(table, NOW), 2)
+        self.assertEqual(PrinterTransaction.query.count(), 1)
+        self.assertEqual(
+            partitions(table), [datetime.date(2026, 7, 1), datetime.date(2026, 9, 1)]
+        )
+        self.assertEqual(rotate(table, NOW), 0)
+
+    def test_rotate_history(self):
+        table = PrinterTransaction.__table__
+        for n, month in enumerate((7, 8, 8, 10)):
+            self.add_print(datetime.datetime(2026, month, 3 + n), barcode=str(n))
+        db.session.commit()
+        self.assertEqual(len(self.printer.transactions_page()[0]), 4)
+        rotate(table, NOW)
+        self.assertEqual(len(self.printer.transactions), 1)
+
+        statements = []
+
+        def count(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(db.engine, "before_cursor_execute", count)
+        try:
+            page, cursor = self.printer.transactions_page(limit=3)
+            page, cursor = self.printer.transactions_page(limit=3)
+        finally:
+            event.remove(db.engine, "before_cursor_execute", count)
+        # The layout of the partitions is only read once.
+        self.assertEqual(len(statements), 3)
+        self.assertEqual([t.barcode for t in page], ["3", "2", "1"])
+        page, cursor = self.printer.transactions_page(after=cursor, limit=3)
+        self.assertEqual([t.barcode for t in page], ["0"])
+        self.assertIsNone(cursor)
+
+    def test_partitioned_table(self):
+        table = PrinterTransaction.__table__
+        ddl = str(
+            CreateTable(partitioned_table(table)).compile(dialect=postgresql.dialect())
+        )
+        self.assertIn("PRIMARY KEY (id, created_at)", ddl)
+        self.assertIn("PARTITION BY RANGE (created_at)", ddl)
+        self.assertIn("id SERIAL", ddl)
+        # The partitioning is emulated on SQLite.
+        self.assertFalse(create_partitioned_table(table, NOW))
+        self.assertEqual(ensure_partitions(table, NOW), [])
+        self.assertEqual(partitions(table), [])
+
+    def test_printer_retention(self):
+        table = PrinterTransaction.__table__
+        self.add_print(datetime.datetime(2026, 6, 1, 8), number=2)
+        self.add_print(datetime.datetime(2026, 6, 1, 9), number=3)
+        self.add_print(datetime.datetime(2026, 6, 2), barcode="BAR")
+        self.add_print(datetime.datetime(2026, 9, 2))
+        db.session.commit()
+        dropped = apply_retention(table, keep_months=2, now=NOW)
+        self.assertEqual(dropped, [datetime.date(2026, 6, 1)])
+        self.assertEqual(partitions(table), [datetime.date(2026, 9, 1)])
+        d = PrinterTransactionDaily.query.filter_by(
+            day=datetime.date(2026, 6, 1), barcode="FOO"
+        ).one()
+        self.assertEqual(d.printer, self.printer)
+        self.assertEqual(d.transactions, 2)
+        self.assertEqual(d.number, 5)
+        self.assertEqual(PrinterTransactionDaily.query.count(), 2)
+
+        # A late transaction is merged in the existing aggregate.
+        self.add_print(datetime.datetime(2026, 6, 1, 10))
+        db.session.commit()
+        apply_retention(table, keep_months=2, now=NOW)
+        d = PrinterTransactionDaily.query.filter_by(
+            day=datetime.date(2026, 6, 1), barcode="FOO"
+        ).one()
+        self.assertEqual(d.transactions, 3)
+        self.assertEqual(d.number, 6)
+
+    def test_scanner_retention(self):
+        table = ScannerTransaction.__table__
+        s = Scanner.query.get(1)
+        for mode, quantity in (
+            (ScannerModeEnum.PRINTMODE, 1),
+            (ScannerModeEnum.INVENTORYMODE, 2),
+            (ScannerModeEnum.INVENTORYMODE, 3),
+        ):
+            db.session.add(
+                ScannerTransaction(
+                    scanner=s,
+                    mode=mode,
+                    quantity=quantity,
+                    value="FOO",
+                    created_at=datetime.datetime(2026, 1, 5),
+                )
+            )
+        db.session.commit()
+        apply_retention(table, now=NOW)
+        self.assertEqual(ScannerTransaction.query.count(), 0)
+        self.assertEqual(partitions(table), [])
+        d = ScannerTransactionDaily.query.filter_by(
+            mode=ScannerModeEnum.INVENTORYMODE
+        ).one()
+        self.assertEqual(d.day, datetime.date(2026, 1, 5))
+        self.assertEqual(d.transactions, 2)
+        self.assertEqual(d.quantity, 5)
+
+    def test_drop_partitions(self):
+        table = PrinterTransaction.__table__
+        self.add_print(datetime.datetime(2026, 7, 3))
+        db.session.commit()
+        rotate(table, NOW)
+        db.drop_all()
+        db.create_all()
+        self.assertEqual(partitions(table), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
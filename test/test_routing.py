@@ -0,0 +1,195 @@
+import unittest
+from despinassy import db, Printer, Scanner
+from despinassy.ipc import IpcOrigin, IpcPrintMessage
+from despinassy.Printer import PrinterDialectEnum
+from despinassy.Channel import Channel
+from despinassy.routing import router, Router, PrinterRoute
+from sqlalchemy import event
+import json
+
+
+class TestRouting(unittest.TestCase):
+    @classmethod
+    def setUpClass(self):
+        db.init_app(
+            config={
+                "uri": "sqlite://",
+            }
+        )
+        db.drop_all()
+
+    def setUp(self):
+        db.create_all()
+
+    def tearDown(self):
+        db.drop_all()
+
+    @staticmethod
+    def printer(name, redis="victoria", available=True):
+        p = Printer(
+            name=name,
+            type=1,
+            dialect=1,
+            redis=redis,
+            available=available,
+            settings="{}",
+        )
+        db.session.add(p)
+        db.session.commit()
+        return p
+
+    def test_routing_printers(self):
+        p1 = self.printer("main")
+        p2 = self.printer("second")
+        self.printer("off", available=False)
+        self.printer("other", redis="other")
+        self.assertEqual(
+            router.printers("victoria"),
+            (
+                PrinterRoute(p1.id, PrinterDialectEnum.ZEBRA_ZPL, {}),
+                PrinterRoute(p2.id, PrinterDialectEnum.ZEBRA_ZPL, {}),
+            ),
+        )
+        self.assertEqual(
+            [r.id for r in router.route(IpcPrintMessage(destination="victoria"))],
+            [p1.id, p2.id],
+        )
+        self.assertEqual(router.printers("unknown"), ())
+
+        statements = []
+
+        def count(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(db.engine, "before_cursor_execute", count)
+        try:
+            router.printers("victoria")
+        finally:
+            event.remove(db.engine, "before_cursor_execute", count)
+        self.assertEqual(statements, [])
+
+    def test_routing_incremental(self):
+        p1 = self.printer("main")
+        p2 = self.printer("second")
+        table = router.table()
+        p1.available = False
+        db.session.commit()
+        self.assertEqual([r.id for r in router.printers("victoria")], [p2.id])
+        p2.redis = "other"
+        db.session.commit()
+        self.assertEqual(router.printers("victoria"), ())
+        self.assertEqual([r.id for r in router.printers("other")], [p2.id])
+        db.session.delete(p2)
+        db.session.commit()
+        self.assertEqual(router.printers("other"), ())
+        # Previous snapshots are never modified.
+        self.assertEqual(len(table.channels["victoria"]), 2)
+
+    def test_routing_unrouted_update(self):
+        p = self.printer("main")
+        s = Scanner.query.get(1)
+        router.table()
+        p.name = "renamed"
+        db.session.add(
+            p.add_transaction(origin=IpcOrigin.TEST, barcode="foo", name="bar")
+        )
+        db.session.add(s.add_transaction(mode=1, value="foo"))
+        db.session.commit()
+        self.assertFalse(router._dirty_printers)
+        self.assertFalse(router._dirty_scanners)
+        p.settings = {"a": 1}
+        db.session.commit()
+        self.assertEqual(router._dirty_printers, {p.id})
+        self.assertEqual(router.printers("victoria")[0].settings, {"a": 1})
+
+    def test_routing_invalid_settings(self):
+        p1 = self.printer("main")
+        p2 = self.printer("list")
+        p3 = self.printer("string")
+        p2.settings = [1]
+        db.session.commit()
+        # Stored by an older version, bypassing the validation of the model.
+        db.session.execute(
+            Printer.__table__.update()
+            .where(Printer.__table__.c.id == p3.id)
+            .values(settings="{")
+        )
+        db.session.commit()
+        router.invalidate()
+        with self.assertLogs("despinassy.routing", "WARNING") as logs:
+            self.assertEqual([r.id for r in router.printers("victoria")], [p1.id])
+        self.assertEqual(len(logs.records), 2)
+        # Also skipped when only the device is reloaded.
+        router.mark_printers(p2.id)
+        with self.assertLogs("despinassy.routing", "WARNING"):
+            self.assertEqual([r.id for r in router.printers("victoria")], [p1.id])
+
+    def test_routing_rollback(self):
+        p1 = self.printer("main")
+        router.table()
+        p1.available = False
+        db.session.flush()
+        self.assertEqual(router.printers("victoria"), ())
+        db.session.rollback()
+        self.assertEqual([r.id for r in router.printers("victoria")], [p1.id])
+
+    def test_routing_scanners(self):
+        s = Scanner.query.get(1)
+        self.assertEqual(router.scanner_channel(s.id), "victoria")
+        s.redis = "other"
+        db.session.commit()
+        self.assertEqual(router.scanner_channel(s.id), "other")
+        Printer.query.update({"updated_at": None})
+        self.assertIsNotNone(router._table)
+        Channel.query.filter_by(name="victoria").update({"name": "renamed"})
+        db.session.commit()
+        self.assertEqual(router.scanner_channel(s.id), "other")
+
+    def test_routing_refresh_interval(self):
+        now = [0.0]
+        local = Router(refresh_interval=60, clock=lambda: now[0])
+        p = self.printer("main")
+        self.assertEqual([r.id for r in local.printers("victoria")], [p.id])
+        # Changed by another process, without any ORM event in this one.
+        db.session.execute(Printer.__table__.update().values(available=False))
+        db.session.commit()
+        self.assertEqual([r.id for r in local.printers("victoria")], [p.id])
+        now[0] = 60
+        self.assertEqual(local.printers("victoria"), ())
+
+    def test_routing_invalidation(self):
+        class FakeRedis:
+            def __init__(self):
+                self.published = []
+
+            def publish(self, channel, data):
+                self.published.append((channel, json.loads(data)))
+
+        redis = FakeRedis()
+        router.publish_invalidation(redis)
+        try:
+            p = self.printer("main")
+            self.assertEqual(
+                redis.published[-1],
+                (Router.INVALIDATION_CHANNEL, {"printers": [p.id], "scanners": []}),
+            )
+            Channel.query.filter_by(name="victoria").update({"name": "renamed"})
+            db.session.rollback()
+            Printer.query.update({"available": False})
+            db.session.commit()
+            self.assertEqual(redis.published[-1][1], {"printers": [], "scanners": []})
+            self.assertEqual(len(redis.published), 2)
+        finally:
+            router.publish_invalidation(None)
+
+        # Apply the invalidation published by another process.
+        local = Router(refresh_interval=None)
+        self.assertEqual(local.printers("victoria"), ())
+        db.session.execute(Printer.__table__.update().values(available=True))
+        db.session.commit()
+        local._on_invalidation({"data": json.dumps(redis.published[0][1])})
+        self.assertEqual([r.id for r in local.printers("victoria")], [p.id])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,14 +1,42 @@
 import unittest
+import json
+import os
+import threading
+import uuid
 from despinassy import db
 from despinassy.Scanner import (
     Scanner,
     ScannerTransaction,
     ScannerTypeEnum,
     ScannerModeEnum,
+    ScannerTransactionRecorder,
 )
 from despinassy.Channel import Channel
 
 
+class SlowRecorder(ScannerTransactionRecorder):
+    """Recorder whose writes wait for `release` to be set."""
+
+    def __init__(self, *args, **kwargs):
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.writers = []
+        super().__init__(*args, **kwargs)
+
+    def _write(self, session, rows):
+        self.writers.append(threading.get_ident())
+        self.started.set()
+        self.release.wait(5)
+        super()._write(session, rows)
+
+
+class FailingRecorder(ScannerTransactionRecorder):
+    """Recorder whose writes always fail, like in a crashing process."""
+
+    def _write(self, session, rows):
+        raise RuntimeError("crash")
+
+
 class TestDatabaseScanner(unittest.TestCase):
     @classmethod
     def setUpClass(self):
@@ -80,6 +108,111 @@ class TestDatabaseScanner(unittest.TestCase):
         self.assertEqual(s.transactions[0].value, "HELLOWORLD")
         self.assertEqual(s.transactions[1].value, "FOOBAR123")
 
+    def test_scanner_transactions_page(self):
+        s = Scanner.query.get(1)
+        for i in range(3):
+            db.session.add(
+                s.add_transaction(mode=ScannerModeEnum.PRINTMODE, value=str(i))
+            )
+        db.session.commit()
+        page, cursor = s.transactions_page(limit=2)
+        self.assertEqual([t.value for t in page], ["2", "1"])
+        page, cursor = s.transactions_page(after=cursor, limit=2)
+        self.assertEqual([t.value for t in page], ["0"])
+        self.assertIsNone(cursor)
+        d = s.to_dict(full=True)
+        self.assertEqual(len(d["transactions"]), 3)
+
+    def test_scanner_transaction_recorder(self):
+        s = Scanner.query.get(1)
+        with ScannerTransactionRecorder(max_size=2, flush_interval=60) as recorder:
+            recorder.record(s, mode=ScannerModeEnum.INVENTORYMODE, value="FOO")
+            self.assertEqual(ScannerTransaction.query.count(), 0)
+            recorder.record(s.id, mode=ScannerModeEnum.PRINTMODE, value="BAR")
+            recorder.record(s, mode=ScannerModeEnum.PRINTMODE, value="BAZ", quantity=2)
+        self.assertEqual(ScannerTransaction.query.count(), 3)
+        st = ScannerTransaction.query.filter_by(value="FOO").first()
+        self.assertEqual(st.mode, ScannerModeEnum.INVENTORYMODE)
+        self.assertEqual(st.scanner, s)
+
+    def test_scanner_transaction_recorder_spool(self):
+        s = Scanner.query.get(1)
+        spool = "/tmp/%s" % (uuid.uuid4())
+        # The process crash before writing the rows to the database: the
+        # buffered rows are lost but not the spool.
+        crashed = FailingRecorder(max_size=10, flush_interval=60, spool_path=spool)
+        crashed.record(s, mode=ScannerModeEnum.INVENTORYMODE, value="FOO")
+        crashed.record(s, mode=ScannerModeEnum.PRINTMODE, value="BAR", quantity=2)
+        with self.assertLogs("despinassy.buffer", "ERROR"):
+            crashed.close()
+        self.assertEqual(ScannerTransaction.query.count(), 0)
+
+        with ScannerTransactionRecorder(spool_path=spool) as recorder:
+            self.assertEqual(len(recorder), 2)
+            self.assertEqual(recorder.flush(), 2)
+            self.assertEqual(os.path.getsize(spool), 0)
+        st = ScannerTransaction.query.filter_by(value="BAR").first()
+        self.assertEqual(st.mode, ScannerModeEnum.PRINTMODE)
+        self.assertEqual(st.quantity, 2)
+
+    def test_scanner_transaction_recorder_background(self):
+        s = Scanner.query.get(1)
+        recorder = SlowRecorder(max_size=1, flush_interval=60)
+        recorder.start()
+        # Only wake up the background thread.
+        recorder.record(s, mode=ScannerModeEnum.INVENTORYMODE, value="FOO")
+        self.assertTrue(recorder.started.wait(5))
+        # Not blocked by the write in progress.
+        recorder.record(s, mode=ScannerModeEnum.INVENTORYMODE, value="BAR")
+        self.assertEqual(len(recorder), 1)
+        recorder.release.set()
+        recorder.close()
+        self.assertNotEqual(recorder.writers[0], threading.get_ident())
+        self.assertEqual(ScannerTransaction.query.count(), 2)
+
+    def test_scanner_transaction_recorder_overflow(self):
+        s = Scanner.query.get(1)
+        recorder = SlowRecorder(
+            max_size=1, flush_interval=60, max_pending=1, overflow_timeout=0.1
+        )
+        self.assertTrue(
+            recorder.record(s, mode=ScannerModeEnum.INVENTORYMODE, value="FOO")
+        )
+        self.assertTrue(recorder.started.wait(5))
+        self.assertTrue(
+            recorder.record(s, mode=ScannerModeEnum.INVENTORYMODE, value="BAR")
+        )
+        # The write in progress doesn't make room in time.
+        self.assertFalse(
+            recorder.record(s, mode=ScannerModeEnum.INVENTORYMODE, value="BAZ")
+        )
+        self.assertEqual(recorder.dropped, 1)
+        recorder.release.set()
+        recorder.close()
+        self.assertNotIn(threading.get_ident(), recorder.writers)
+        self.assertEqual(
+            [st.value for st in ScannerTransaction.query.order_by("id")],
+            ["FOO", "BAR"],
+        )
+
+    def test_scanner_transaction_recorder_spool_during_write(self):
+        s = Scanner.query.get(1)
+        spool = "/tmp/%s" % (uuid.uuid4())
+        recorder = SlowRecorder(max_size=10, flush_interval=60, spool_path=spool)
+        recorder.record(s, mode=ScannerModeEnum.INVENTORYMODE, value="FOO")
+        flush = threading.Thread(target=recorder.flush)
+        flush.start()
+        self.assertTrue(recorder.started.wait(5))
+        recorder.record(s, mode=ScannerModeEnum.INVENTORYMODE, value="BAR")
+        recorder.release.set()
+        flush.join()
+        # Only the row added during the write is left in the spool.
+        with open(spool) as f:
+            self.assertEqual([json.loads(line)["value"] for line in f], ["BAR"])
+        recorder.close()
+        self.assertEqual(os.path.getsize(spool), 0)
+        self.assertEqual(ScannerTransaction.query.count(), 2)
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,206 @@
+import unittest
+import json
+import datetime
+from despinassy import db, encoder, Part, Inventory, Printer, Scanner
+from despinassy.Channel import Channel
+from despinassy.ipc import IpcOrigin
+from despinassy.Inventory import InventorySession, InventoryUnitEnum
+from despinassy.Part import PartImport
+from despinassy.Printer import (
+    PrinterTransaction,
+    PrinterTransactionDaily,
+    PrinterTypeEnum,
+)
+from despinassy.Scanner import (
+    ScannerModeEnum,
+    ScannerTransaction,
+    ScannerTransactionDaily,
+)
+from sqlalchemy import event
+
+
+class TestSerialize(unittest.TestCase):
+    @classmethod
+    def setUpClass(self):
+        db.init_app(
+            config={
+                "uri": "sqlite://",
+            }
+        )
+        db.drop_all()
+
+    def setUp(self):
+        db.create_all()
+
+    def tearDown(self):
+        db.drop_all()
+
+    def test_serialize_part(self):
+        p = Part(name="BARCODE", barcode="QWERTY1234")
+        db.session.add(p)
+        db.session.commit()
+        p.printed(2)
+        db.session.commit()
+        self.assertEqual(
+            Part.serialize_query(),
+            [{"id": p.id, "barcode": "QWERTY1234", "name": "BARCODE", "counter": 2}],
+        )
+        self.assertEqual(
+            Part.serialize_query(
+                Part.query.filter(Part.barcode == "NONE"), fields=("id",)
+            ),
+            [],
+        )
+
+    def test_serialize_inventory(self):
+        p = Part(name="BARCODE", barcode="QWERTY1234")
+        db.session.add(p)
+        db.session.add(Inventory(part=p, quantity=3))
+        db.session.commit()
+        statements = []
+
+        def count(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(db.engine, "before_cursor_execute", count)
+        try:
+            result = Inventory.serialize_query()
+        finally:
+            event.remove(db.engine, "before_cursor_execute", count)
+        self.assertEqual(len(statements), 1)
+        self.assertEqual(
+            result,
+            [
+                {
+                    "id": 1,
+                    "session": 1,
+                    "part": {
+                        "id": p.id,
+                        "barcode": "QWERTY1234",
+                        "name": "BARCODE",
+                        "counter": 0,
+                    },
+                    "quantity": 3,
+                    "unit": "pcs",
+                }
+            ],
+        )
+
+    def test_serialize_devices(self):
+        p = Printer(
+            name="main", type=1, dialect=1, redis="victoria", settings='{"a": 1}'
+        )
+        db.session.add(p)
+        db.session.add(
+            p.add_transaction(origin=IpcOrigin.TEST, barcode="foo", name="bar")
+        )
+        s = Scanner.query.get(1)
+        db.session.add(s.add_transaction(mode=ScannerModeEnum.PRINTMODE, value="foo"))
+        db.session.commit()
+
+        (printer,) = Printer.serialize_query()
+        self.assertEqual(printer["redis"], "victoria")
+        self.assertEqual(printer["type"], PrinterTypeEnum.STDOUT)
+        self.assertEqual(printer["settings"], {"a": 1})
+        self.assertEqual(set(printer), set(p.to_dict()))
+        (scanner,) = Scanner.serialize_query()
+        self.assertEqual(scanner["redis"], "victoria")
+        self.assertEqual(set(scanner), set(s.to_dict()))
+
+        (pt,) = PrinterTransaction.serialize_query(
+            fields=("id", "printer.name", "printer.redis.name")
+        )
+        self.assertEqual(
+            pt, {"id": 1, "printer": {"name": "main", "redis": {"name": "victoria"}}}
+        )
+        (st,) = ScannerTransaction.serialize_query(
+            ScannerTransaction.query.filter_by(scanner_id=s.id)
+        )
+        self.assertEqual(st["value"], "foo")
+        self.assertEqual(st["mode"], ScannerModeEnum.PRINTMODE)
+
+    def test_serialize_to_dict(self):
+        p = Part(name="BARCODE", barcode="QWERTY1234")
+        db.session.add(p)
+        db.session.add(Inventory(part=p, quantity=3))
+        db.session.add(
+            Inventory(
+                part=Part(name="FOO", barcode="BAR"), unit=InventoryUnitEnum.METER
+            )
+        )
+        printer = Printer(
+            name="main", type=1, dialect=1, redis="victoria", settings='{"a": 1}'
+        )
+        db.session.add(printer)
+        db.session.add(Printer(name="none", type=1, dialect=1))
+        db.session.add(
+            printer.add_transaction(origin=IpcOrigin.TEST, barcode="foo", name="bar")
+        )
+        scanner = Scanner.query.get(1)
+        db.session.add(
+            scanner.add_transaction(mode=ScannerModeEnum.PRINTMODE, value="foo")
+        )
+        day = datetime.date(2020, 1, 1)
+        db.session.add(
+            PrinterTransactionDaily(
+                day=day, printer=printer, barcode="foo", transactions=2, number=3
+            )
+        )
+        db.session.add(
+            ScannerTransactionDaily(
+                day=day,
+                scanner=scanner,
+                mode=ScannerModeEnum.PRINTMODE,
+                transactions=2,
+                quantity=3,
+            )
+        )
+        db.session.add(PartImport(filename="parts.csv", digest="0" * 64))
+        db.session.commit()
+        p.printed(2)
+        db.session.commit()
+
+        for model in (
+            Part,
+            PartImport,
+            Inventory,
+            InventorySession,
+            Channel,
+            Printer,
+            PrinterTransaction,
+            PrinterTransactionDaily,
+            Scanner,
+            ScannerTransaction,
+            ScannerTransactionDaily,
+        ):
+            query = model.query.order_by(model.id)
+            expected = [x.to_dict() for x in query]
+            self.assertEqual(model.serialize_query(query), expected, model)
+            self.assertEqual(
+                encoder.dumps(model.serialize_query(query)),
+                encoder.dumps(expected),
+                model,
+            )
+        self.assertEqual(
+            Inventory.bulk_to_dict(), [x.to_dict() for x in Inventory.query]
+        )
+
+    def test_serialize_ndjson(self):
+        for i in range(3):
+            db.session.add(Part(name="part%i" % (i), barcode="%i" % (i)))
+        db.session.commit()
+        lines = list(
+            Part.serialize_query(
+                Part.query.order_by(Part.id), fields=("id", "name"), ndjson=True
+            )
+        )
+        self.assertEqual(len(lines), 3)
+        self.assertTrue(all(line.endswith(b"\n") for line in lines))
+        self.assertEqual(json.loads(lines[1]), {"id": 2, "name": "part1"})
+        (scanner,) = Scanner.serialize_query(ndjson=True)
+        self.assertEqual(json.loads(scanner)["mode"], int(ScannerModeEnum.PRINTMODE))
+        self.assertEqual(scanner, next(encoder.dumps_ndjson(Scanner.serialize_query())))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,65 @@
+import unittest
+import copy
+import json
+import pickle
+from despinassy import db, Printer, Scanner
+from despinassy.settings import DeviceSettings, decode_settings, migrate_settings
+
+
+class TestSettings(unittest.TestCase):
+    @classmethod
+    def setUpClass(self):
+        db.init_app(
+            config={
+                "uri": "sqlite://",
+            }
+        )
+        db.drop_all()
+
+    def setUp(self):
+        db.create_all()
+
+    def tearDown(self):
+        db.drop_all()
+
+    def test_decode_settings(self):
+        self.assertEqual(decode_settings('{"a": 1}'), {"a": 1})
+        self.assertEqual(decode_settings(json.dumps('{"a": 1}')), {"a": 1})
+        self.assertEqual(decode_settings({"a": 1}), {"a": 1})
+        self.assertIsNone(decode_settings(None))
+        self.assertRaises(ValueError, decode_settings, "{")
+
+    def test_device_settings(self):
+        s = DeviceSettings({"address": "192.168.0.1"})
+        self.assertEqual(s["address"], "192.168.0.1")
+        self.assertEqual(s.address, "192.168.0.1")
+        self.assertEqual(s, {"address": "192.168.0.1"})
+        self.assertRaises(AttributeError, getattr, s, "port")
+        self.assertEqual(DeviceSettings(None), {})
+        self.assertRaises(ValueError, DeviceSettings, "[1]")
+        for clone in (copy.copy(s), copy.deepcopy(s), pickle.loads(pickle.dumps(s))):
+            self.assertEqual(clone, s)
+            self.assertEqual(clone.address, "192.168.0.1")
+            self.assertEqual(clone.raw, s.raw)
+
+    def test_migrate_settings(self):
+        p = Printer(name="main", type=1, dialect=1, redis="victoria", settings="{}")
+        db.session.add(p)
+        db.session.commit()
+        # Rows written before the settings were stored natively.
+        for model in (Printer, Scanner):
+            db.session.execute(
+                model.__table__.update().values(settings='{"address": "a"}')
+            )
+        db.session.commit()
+        self.assertEqual(p.settings, '{"address": "a"}')
+        self.assertEqual(p.to_dict()["settings"], {"address": "a"})
+
+        self.assertEqual(migrate_settings(), 2)
+        self.assertEqual(p.settings, {"address": "a"})
+        self.assertEqual(Scanner.query.get(1).settings, {"address": "a"})
+        self.assertEqual(migrate_settings(), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()